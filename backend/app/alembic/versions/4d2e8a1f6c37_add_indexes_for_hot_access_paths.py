@@ -0,0 +1,62 @@
+"""Add indexes for the hot access paths
+
+Revision ID: 4d2e8a1f6c37
+Revises: e27c9b15d3a8
+Create Date: 2026-10-17 21:02:47.530114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d2e8a1f6c37'
+down_revision = 'e27c9b15d3a8'
+branch_labels = None
+depends_on = None
+
+# the primary key already indexes id
+ID_INDEXES = [
+    'assistantmanager', 'doctormanager', 'doctorpatient', 'item', 'note', 'remarquenote',
+    'uploadsession', 'user', 'voice',
+]
+
+INDEXES = [
+    ('ix_voice_doctor_id_note_created', 'voice', ['doctor_id', 'note_created', 'date_creation', 'id'], False),
+    ('ix_voice_patient_id_doctor_id', 'voice', ['patient_id', 'doctor_id', 'date_creation', 'id'], False),
+    ('ix_note_assistant_id_validated_modifier_id', 'note', ['assistant_id', 'validated', 'modifier_id'], False),
+    ('ix_note_voice_id', 'note', ['voice_id'], True),
+    ('ix_remarquenote_note_id', 'remarquenote', ['note_id', 'date_creation', 'id'], False),
+    ('ix_doctormanager_doctor_id_manager_id', 'doctormanager', ['doctor_id', 'manager_id'], False),
+    ('ix_doctormanager_manager_id_doctor_id', 'doctormanager', ['manager_id', 'doctor_id'], False),
+    ('ix_assistantmanager_assistant_id_manager_id', 'assistantmanager', ['assistant_id', 'manager_id'], False),
+    ('ix_assistantmanager_manager_id_assistant_id', 'assistantmanager', ['manager_id', 'assistant_id'], False),
+    ('ix_doctorpatient_doctor_id_patient_id', 'doctorpatient', ['doctor_id', 'patient_id'], False),
+    ('ix_doctorpatient_patient_id_doctor_id', 'doctorpatient', ['patient_id', 'doctor_id'], False),
+]
+
+
+def upgrade():
+    duplicates = op.get_bind().execute(sa.text(
+        'SELECT voice_id FROM note WHERE voice_id IS NOT NULL GROUP BY voice_id HAVING count(*) > 1 LIMIT 10'
+    )).scalars().all()
+    if duplicates:
+        raise RuntimeError(f'voices with several notes, they must be merged before upgrading: {duplicates}')
+
+    # the indexes are built without locking the tables against writes, which can not be done
+    # in a transaction. An interrupted build leaves an invalid index, it is dropped before retrying.
+    with op.get_context().autocommit_block():
+        for name, table, columns, unique in INDEXES:
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+            op.create_index(name, table, columns, unique=unique, postgresql_concurrently=True)
+        for table in ID_INDEXES:
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS ix_{table}_id')
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for table in ID_INDEXES:
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS ix_{table}_id')
+            op.create_index(f'ix_{table}_id', table, ['id'], unique=False, postgresql_concurrently=True)
+        for name, table, columns, unique in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
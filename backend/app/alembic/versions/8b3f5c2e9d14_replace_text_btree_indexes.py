@@ -0,0 +1,53 @@
+"""Replace the B-tree indexes of the text columns
+
+Revision ID: 8b3f5c2e9d14
+Revises: 4d2e8a1f6c37
+Create Date: 2026-10-17 22:14:09.861205
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '8b3f5c2e9d14'
+down_revision = '4d2e8a1f6c37'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_note_content_txt_trgm', 'note', 'content_txt', 'gin', {'content_txt': 'gin_trgm_ops'}),
+    ('ix_voice_title_trgm', 'voice', 'title', 'gin', {'title': 'gin_trgm_ops'}),
+    ('ix_voice_path_hash', 'voice', 'path', 'hash', {}),
+]
+
+# they do not serve ILIKE '%...%' and a B-tree entry can not be larger than about 2.7 kB,
+# long transcriptions could not be written
+BTREE_INDEXES = [
+    ('ix_note_content_txt', 'note', 'content_txt'),
+    ('ix_voice_title', 'voice', 'title'),
+    ('ix_voice_path', 'voice', 'path'),
+    ('ix_voice_remarque', 'voice', 'remarque'),
+    ('ix_remarquenote_remarque', 'remarquenote', 'remarque'),
+]
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # the new indexes are built before the old ones are dropped, the queries always have one
+    with op.get_context().autocommit_block():
+        for name, table, column, using, ops in INDEXES:
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+            op.create_index(name, table, [column], unique=False, postgresql_using=using,
+                postgresql_ops=ops, postgresql_concurrently=True)
+        for name, table, column in BTREE_INDEXES:
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+def downgrade():
+    # pg_trgm is left installed, it may be used by other databases objects
+    with op.get_context().autocommit_block():
+        for name, table, column in BTREE_INDEXES:
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+            op.create_index(name, table, [column], unique=False, postgresql_concurrently=True)
+        for name, table, column, using, ops in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,97 @@
+"""Add search_vector to note and voice
+
+Revision ID: c5a9e7d3b261
+Revises: 8b3f5c2e9d14
+Create Date: 2026-10-17 23:05:41.207395
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5a9e7d3b261'
+down_revision = '8b3f5c2e9d14'
+branch_labels = None
+depends_on = None
+
+
+# the search vector of a row, kept up to date by a trigger when the searched column changes
+SEARCH_VECTORS = [
+    ('note', 'content_txt', 'B'),
+    # the title weighs more than the content of the note in the search ranking
+    ('voice', 'title', 'A'),
+]
+SEARCH_VECTOR = "setweight(to_tsvector('french_unaccent'::regconfig, coalesce({column}, '')), '{weight}')"
+BACKFILL_BATCH_SIZE = 5000
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS unaccent')
+    # the french configuration with the accents removed before stemming,
+    # "ecchymose" then matches "ecchymosé"
+    op.execute("""
+        DO $$ BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'french_unaccent') THEN
+                CREATE TEXT SEARCH CONFIGURATION french_unaccent (COPY = french);
+                ALTER TEXT SEARCH CONFIGURATION french_unaccent
+                    ALTER MAPPING FOR hword, hword_part, word WITH unaccent, french_stem;
+            END IF;
+        END $$
+    """)
+    for table, column, weight in SEARCH_VECTORS:
+        # a nullable column without default is only added to the catalog, the table is not rewritten
+        op.add_column(table, sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+        op.execute(f"""
+            CREATE OR REPLACE FUNCTION {table}_search_vector_update() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector := {SEARCH_VECTOR.format(column='NEW.' + column, weight=weight)};
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        op.execute(f"""
+            CREATE TRIGGER {table}_search_vector_update BEFORE INSERT OR UPDATE OF {column} ON {table}
+            FOR EACH ROW EXECUTE FUNCTION {table}_search_vector_update()
+        """)
+
+    with op.get_context().autocommit_block():
+        # the rows written before the trigger are filled by batches of short transactions,
+        # the rows written since are skipped
+        bind = op.get_bind()
+        for table, column, weight in SEARCH_VECTORS:
+            max_id = bind.execute(sa.text(f'SELECT max(id) FROM {table}')).scalar() or 0
+            for start in range(0, max_id, BACKFILL_BATCH_SIZE):
+                op.execute(f"""
+                    UPDATE {table} SET search_vector = {SEARCH_VECTOR.format(column=column, weight=weight)}
+                    WHERE id > {start} AND id <= {start + BACKFILL_BATCH_SIZE} AND search_vector IS NULL
+                """)
+
+        # the trigram indexes served the ILIKE searches replaced by the text search
+        for table, column, weight in SEARCH_VECTORS:
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS ix_{table}_search_vector')
+            op.create_index(f'ix_{table}_search_vector', table, ['search_vector'], unique=False,
+                postgresql_using='gin', postgresql_concurrently=True)
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_note_content_txt_trgm')
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_voice_title_trgm')
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_note_content_txt_trgm')
+        op.create_index('ix_note_content_txt_trgm', 'note', ['content_txt'], unique=False,
+            postgresql_using='gin', postgresql_ops={'content_txt': 'gin_trgm_ops'},
+            postgresql_concurrently=True)
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_voice_title_trgm')
+        op.create_index('ix_voice_title_trgm', 'voice', ['title'], unique=False,
+            postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'},
+            postgresql_concurrently=True)
+        op.drop_index('ix_voice_search_vector', table_name='voice', postgresql_concurrently=True)
+        op.drop_index('ix_note_search_vector', table_name='note', postgresql_concurrently=True)
+    for table, column, weight in SEARCH_VECTORS:
+        op.execute(f'DROP TRIGGER IF EXISTS {table}_search_vector_update ON {table}')
+        op.execute(f'DROP FUNCTION IF EXISTS {table}_search_vector_update()')
+        op.drop_column(table, 'search_vector')
+    # unaccent is left installed, it may be used by other databases objects
+    op.execute('DROP TEXT SEARCH CONFIGURATION IF EXISTS french_unaccent')
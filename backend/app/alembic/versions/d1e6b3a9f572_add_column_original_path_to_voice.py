@@ -0,0 +1,30 @@
+"""Add column original_path to voice
+
+Revision ID: d1e6b3a9f572
+Revises: a7d2c9e41b58
+Create Date: 2026-10-19 10:12:36.504817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd1e6b3a9f572'
+down_revision = 'a7d2c9e41b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('voice', sa.Column('original_path', sa.String(), nullable=True))
+    with op.get_context().autocommit_block():
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_voice_original_path_hash')
+        op.create_index('ix_voice_original_path_hash', 'voice', ['original_path'], unique=False,
+            postgresql_using='hash', postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_voice_original_path_hash', table_name='voice', postgresql_concurrently=True)
+    op.drop_column('voice', 'original_path')
@@ -0,0 +1,42 @@
+"""Add folded full_name index to user
+
+Revision ID: f3b7d1a4c8e6
+Revises: c5a9e7d3b261
+Create Date: 2026-10-18 09:41:12.384521
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b7d1a4c8e6'
+down_revision = 'c5a9e7d3b261'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS unaccent')
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # unaccent is only stable as its dictionary could change, an index needs an immutable function
+    op.execute("""
+        CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+        AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$
+    """)
+    with op.get_context().autocommit_block():
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_user_full_name_trgm')
+        op.execute('CREATE INDEX CONCURRENTLY ix_user_full_name_trgm ON "user" '
+            'USING gin (f_unaccent(lower(full_name)) gin_trgm_ops)')
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_user_birth_date')
+        op.create_index('ix_user_birth_date', 'user', ['birth_date'], unique=False, postgresql_concurrently=True)
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_user_full_name')
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_user_full_name')
+        op.create_index('ix_user_full_name', 'user', ['full_name'], unique=False, postgresql_concurrently=True)
+        op.drop_index('ix_user_birth_date', table_name='user', postgresql_concurrently=True)
+        op.drop_index('ix_user_full_name_trgm', table_name='user', postgresql_concurrently=True)
+    op.execute('DROP FUNCTION IF EXISTS f_unaccent(text)')
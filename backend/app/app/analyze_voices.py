@@ -0,0 +1,55 @@
+import argparse
+import asyncio
+import logging
+
+from app import crud
+from app.db import base  # noqa: F401
+from app.db.session import SessionLocal
+from app.storage.session import voice_storage
+from app.storage.analysis import analyze_voice
+from app.storage.transcode import ffmpeg_available
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def analyze(*, batch_size: int, pause: float) -> int:
+    db = SessionLocal()
+    analyzed = 0
+    after_id = 0
+    try:
+        while True:
+            voice_ids = [voice.id for voice in
+                crud.voice.get_multi_not_analyzed(db, after_id=after_id, limit=batch_size)]
+            db.rollback()
+            if not voice_ids:
+                return analyzed
+            after_id = voice_ids[-1]
+            for voice_id in voice_ids:
+                if await analyze_voice(voice_id, voice_storage):
+                    analyzed += 1
+            await asyncio.sleep(pause)
+    finally:
+        db.close()
+        await voice_storage.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Compute the duration and the waveform peaks of the voices not analyzed yet"
+    )
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--pause", type=float, default=1.0,
+        help="seconds to wait between two batches")
+    args = parser.parse_args()
+
+    if not ffmpeg_available():
+        logger.error("ffmpeg and ffprobe are required")
+        return
+    logger.info("Analyzing voices")
+    analyzed = asyncio.run(analyze(batch_size=args.batch_size, pause=args.pause))
+    logger.info(f"{analyzed} voices analyzed")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 
-from app.api.api_v1.endpoints import login, users, utils, voices, notes, relationships, notification
+from app.api.api_v1.endpoints import login, users, utils, voices, notes, relationships, notification, stats
 
 api_router = APIRouter()
 api_router.include_router(login.router, tags=["login"])
@@ -10,3 +10,4 @@ api_router.include_router(utils.router, prefix="/utils", tags=["utils"])
 api_router.include_router(notification.router, prefix="/notification", tags=["notification"])
 api_router.include_router(voices.router, prefix="/voices", tags=["voices"])
 api_router.include_router(notes.router, prefix="/notes", tags=["notes"])
+api_router.include_router(stats.router, prefix="/stats", tags=["stats"])
@@ -1,12 +1,15 @@
-from typing import Any, List, Optional, Union
+from typing import Any, Dict, Iterator, List, Optional, Union
 from itertools import chain
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from datetime import datetime
 from app import crud, models, schemas
-from app.api import deps
+from app.api import deps, pagination
+from app.crud.pagination import InvalidCursor
+from app.db.session import SessionLocal
 
 from app.models.doctor_manager import DoctorManager
 from app.models.assistant_manager import AssistantManager
@@ -66,16 +69,19 @@ def read_note_by_id(
         raise HTTPException(status_code=404, detail="No note found with given note id")
     return note
 
-@router.get("/assistant/{assistant_id}", response_model=Union[List[schemas.Note], int])
+@router.get("/assistant/{assistant_id}", response_model=Union[List[schemas.Note], int, schemas.NotePage])
 def get_notes_assistant(
     *,
     db: Session = Depends(deps.get_db),
     assistant_id : int,
     skip: int = 0,
     limit: int = 5,
+    cursor: Optional[str] = Depends(pagination.get_cursor),
+    response: Response,
     validated: Optional[bool]=None,
     treated: Optional[bool]=None,
     count: Optional[bool]=None,
+    envelope: Optional[bool]=None,
     current_user: models.User = Depends(deps.get_current_active_user),
     
 ) -> Any:
@@ -94,7 +100,9 @@ def get_notes_assistant(
     if assistant and assistant.role == 'assistant':
         if count:
             return crud.note.get_multi_by_assistant_count(db=db, assistant_id=assistant_id, validated=validated, treated=treated)
-        notes = crud.note.get_multi_by_assistant(db=db, assistant_id=assistant_id, validated=validated, treated=treated, skip=skip, limit=limit)
+        notes = crud.note.get_multi_by_assistant(db=db, assistant_id=assistant_id, validated=validated, treated=treated, skip=skip, limit=limit, cursor=cursor,
+            with_total=bool(envelope))
+        notes = pagination.page_response(response, notes, limit)
         return notes
     else:
         raise HTTPException(status_code=404, detail="No assistant found with given id")
@@ -188,16 +196,19 @@ def update_note(
 
 #############################################
 
-@router.get("/doctor/{doctor_id}", response_model=Union[List[schemas.Note], int])
+@router.get("/doctor/{doctor_id}", response_model=Union[List[schemas.Note], int, schemas.NotePage])
 def read_doctor_notes(
     *,
     db: Session = Depends(deps.get_db),
     doctor_id: int,
     skip: int = 0,
     limit: int = 5,
+    cursor: Optional[str] = Depends(pagination.get_cursor),
+    response: Response,
     validated: Optional[bool]=None,
     treated: Optional[bool]=None,
     count: Optional[bool]=None,
+    envelope: Optional[bool]=None,
     current_user: models.User = Depends(deps.get_current_active_user),
     
 ) -> Any:
@@ -211,7 +222,9 @@ def read_doctor_notes(
     if crud.user.is_superuser(current_user) or current_user.id  == doctor_id:
         if count:
             return crud.note.get_multi_by_doctor_id_count(db=db, validated=validated, doctor_id=doctor_id, treated=treated)
-        notes = crud.note.get_multi_by_doctor_id(db, doctor_id=doctor_id, validated=validated, treated=treated, skip=skip, limit=limit)
+        notes = crud.note.get_multi_by_doctor_id(db, doctor_id=doctor_id, validated=validated, treated=treated, skip=skip, limit=limit, cursor=cursor,
+            with_total=bool(envelope))
+        notes = pagination.page_response(response, notes, limit)
     else :
         raise HTTPException(status_code=400, detail="Not enough permissions")
     return notes
@@ -226,22 +239,24 @@ def search_note(
         patient_name: Optional[str]='',
         validated: Optional[bool]=None,
         treated: Optional[bool]=None,
+        skip: int = 0,
+        limit: int = Query(100, le=500),
+        cursor: Optional[str] = None,
+        stream: Optional[bool] = None,
+        response: Response,
         current_user: models.User = Depends(deps.get_current_active_user)) -> Any:
     """
-    Search for notes
+    Search for notes, content_text accepts the web search syntax:
+    "quoted phrase", or, -excluded words.
+    The cursor of the next page is sent in the X-Next-Cursor header.
+    With stream all the results are sent as JSON lines (application/x-ndjson),
+    skip, limit and cursor are then ignored
     """
     user_id = current_user.id
     if (current_user.role != 'manager' or not current_user.is_superuser):
-        notes = crud.note.search_note(db=db, user_idx=[user_id], content_text=content_text, 
-            date_creation_before=date_creation_before, date_creation_after=date_creation_after,
-            patient_name=patient_name, treated=treated, validated=validated)
-        print(notes)
-        return notes
+        user_idx = [user_id]
     elif current_user.is_superuser:
-        notes = crud.note.search_note(db=db, user_idx=[], content_text=content_text, 
-            date_creation_before=date_creation_before, date_creation_after=date_creation_after,
-            patient_name=patient_name, treated=treated, validated=validated)
-        return notes
+        user_idx = []
 
     elif current_user.role == 'manager':
         assistants_idx = crud.user.get_manager_assistants(db=db, 
@@ -251,25 +266,49 @@ def search_note(
             manager_id=current_user.id)
         doctor_idx = list(chain(*doctor_idx))
         
-        indices = doctor_idx + assistants_idx + [current_user.id]
-
-        notes = crud.note.search_note(db=db, user_idx=indices, content_text=content_text, 
-            date_creation_before=date_creation_before, date_creation_after=date_creation_after,
-            patient_name=patient_name, treated=treated, validated=validated)
-        return notes
+        user_idx = doctor_idx + assistants_idx + [current_user.id]
     else :
         raise HTTPException(status_code=400, detail="Not enough permissions")
 
+    filters = dict(user_idx=user_idx, content_text=content_text, 
+        date_creation_before=date_creation_before, date_creation_after=date_creation_after,
+        patient_name=patient_name, treated=treated, validated=validated)
+    if stream:
+        return StreamingResponse(_stream_search(filters), media_type='application/x-ndjson')
+    try:
+        notes = crud.note.search_note(db=db, **filters, skip=skip, limit=limit, cursor=cursor)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    next_cursor = crud.note.search_next_cursor(notes, limit)
+    if next_cursor is not None:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
+    return notes
+
+def _stream_search(filters: Dict[str, Any]) -> Iterator[str]:
+    """
+    The search results as JSON lines, sent by pages. The session of the request is closed
+    when the response starts, the pages are read with a session of their own
+    """
+    db = SessionLocal()
+    try:
+        for results in crud.note.iter_search_note_pages(db, **filters):
+            yield ''.join(schemas.Search.from_orm(result).json() + '\n' for result in results)
+    finally:
+        db.close()
+
 
-@router.get("/manager/{manager_id}", response_model=Union[List[schemas.Note], int])
+@router.get("/manager/{manager_id}", response_model=Union[List[schemas.Note], int, schemas.NotePage])
 def read_manager_notes(
     *,
     db: Session = Depends(deps.get_db),
     manager_id: int,
     skip: int = 0,
     limit: int = 5,
+    cursor: Optional[str] = Depends(pagination.get_cursor),
+    response: Response,
     validated: Optional[bool]=None,
     count: Optional[bool]=None,
+    envelope: Optional[bool]=None,
     current_user: models.User = Depends(deps.get_current_active_user),
     
 ) -> Any:
@@ -282,21 +321,26 @@ def read_manager_notes(
     if crud.user.is_superuser(current_user) or current_user.id  == manager_id:
         if count:
             return crud.note.get_multi_by_manager_count(db=db, manager_id=manager_id, validated=validated)
-        notes = crud.note.get_multi_by_manager(db, manager_id=manager_id, validated=validated, skip=skip, limit=limit)
+        notes = crud.note.get_multi_by_manager(db, manager_id=manager_id, validated=validated, skip=skip, limit=limit, cursor=cursor,
+            with_total=bool(envelope))
+        notes = pagination.page_response(response, notes, limit)
         return notes
     else :
         raise HTTPException(status_code=400, detail="Not enough permissions")
     
 
-@router.get("/patient/{patient_id}", response_model=Union[List[schemas.Note], int])
+@router.get("/patient/{patient_id}", response_model=Union[List[schemas.Note], int, schemas.NotePage])
 def read_patient_voices(
     *,
     db: Session = Depends(deps.get_db),
     patient_id: int,
     skip: int = 0,
     limit: int = 5,
+    cursor: Optional[str] = Depends(pagination.get_cursor),
+    response: Response,
     validated: Optional[bool]=None,
     count: Optional[bool]=None,
+    envelope: Optional[bool]=None,
     current_user: models.User = Depends(deps.get_current_active_user),
     
 ) -> Any:
@@ -310,7 +354,9 @@ def read_patient_voices(
     if crud.user.is_superuser(current_user) or current_user.id  == patient_id or current_user.id in doctor_idx:
         if count:
             return crud.note.get_multi_by_patient_count(db=db, patient_id=patient_id, validated=validated)
-        notes = crud.note.get_multi_by_patient(db, patient_id=patient_id, validated=validated, skip=skip, limit=limit)
+        notes = crud.note.get_multi_by_patient(db, patient_id=patient_id, validated=validated, skip=skip, limit=limit, cursor=cursor,
+            with_total=bool(envelope))
+        notes = pagination.page_response(response, notes, limit)
         return notes
     else :
         raise HTTPException(status_code=400, detail="Not enough permissions")
@@ -324,6 +370,8 @@ def read_remarques_note_by_id(
     note_id : int,
     skip: int = 0,
     limit: int = 20,
+    cursor: Optional[str] = Depends(pagination.get_cursor),
+    response: Response,
     current_user: models.User = Depends(deps.get_current_active_user),
     
 ) -> Any:
@@ -342,7 +390,8 @@ def read_remarques_note_by_id(
         print('doctor_idx', doctor_idx)
         doctor_idx = list(chain(*doctor_idx))
 
-        remarques_note = crud.note.get_remarques_by_note_id(db=db,id=note_id, skip=skip, limit=limit)
+        remarques_note = crud.note.get_remarques_by_note_id(db=db,id=note_id, skip=skip, limit=limit, cursor=cursor)
+        pagination.set_next_cursor(response, remarques_note, limit)
         if current_user.id == note.assistant_id or current_user.id == note.modifier_id \
             or current_user.is_superuser:
             return remarques_note
@@ -0,0 +1,40 @@
+from typing import Any
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from app import crud, models, schemas
+from app.api import deps
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.crud.crud_scope_counter import STATS_ROLES
+
+router = APIRouter()
+
+# a dashboard loading again within the TTL gets the counts of the previous load
+stats_cache = TTLCache(ttl=settings.STATS_CACHE_TTL, max_size=settings.STATS_CACHE_MAX_USERS)
+
+
+@router.get("/me", response_model=schemas.Stats)
+def read_stats_me(
+    db: Session = Depends(deps.get_db),
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    Counts of the voices and notes of the current user dashboard: the ones of a doctor or a patient,
+    of the doctors and assistants of a manager, of the doctors of the managers of an assistant
+    and their own notes, of all the doctors for a super user of another role.
+    Kept STATS_CACHE_TTL seconds by each worker.
+    """
+    if current_user.role in STATS_ROLES:
+        role = current_user.role
+    elif crud.user.is_superuser(current_user):
+        role = None
+    else:
+        raise HTTPException(status_code=403, detail="The user doesn't have enough privileges")
+    stats = stats_cache.get(current_user.id)
+    if stats is None:
+        counts = crud.scope_counter.get_stats(db, role=role, user_id=current_user.id)
+        stats = schemas.Stats(role=current_user.role, **counts)
+        stats_cache.set(current_user.id, stats)
+    return stats
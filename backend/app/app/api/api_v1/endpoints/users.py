@@ -1,6 +1,6 @@
 from typing import Any, List, Union, Optional
 
-from fastapi import APIRouter, Body, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Body, Depends, HTTPException, BackgroundTasks, Query
 from fastapi.encoders import jsonable_encoder
 from pydantic.networks import EmailStr
 from sqlalchemy.orm import Session
@@ -109,6 +109,23 @@ def read_patients(
     users = crud.user.get_multi_patients(db, skip=skip, limit=limit)
     return users
 
+@router.get("/patients/lookup", response_model=List[schemas.PatientMatch])
+def lookup_patients(
+    db: Session = Depends(deps.get_db),
+    name: str = Query(..., min_length=2),
+    limit: int = Query(10, le=50),
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    Autocomplete of the patients by name, accents, case and typos ignored.
+    A doctor finds their patients, a super user all the patients
+    """
+    if crud.user.is_superuser(current_user):
+        return crud.user.search_patients(db, name=name, limit=limit)
+    if current_user.role == 'doctor':
+        return crud.user.search_patients(db, name=name, doctor_id=current_user.id, limit=limit)
+    raise HTTPException(status_code=400, detail="Not enough permissions")
+
 @router.post("/", response_model=Union[schemas.User, schemas.UserLoginOrCreationErr])
 def create_user(
     *,
@@ -149,11 +166,14 @@ def create_patient_user(
     *,
     db: Session = Depends(deps.get_db),
     user_in: schemas.UserCreate,
+    allow_similar: bool = False,
     current_user: models.User = Depends(deps.get_current_user),
 ) -> Any:
     """
     Create new patient user.
-    Only doctor who can create patient
+    Only doctor who can create patient.
+    A patient born the same day with a similar name is reported as a possible duplicate,
+    allow_similar creates the patient anyway unless the names are the same
     """
 
     if (current_user.role != 'doctor' or user_in.role != 'patient'):
@@ -174,9 +194,11 @@ def create_patient_user(
         return schemas.UserLoginOrCreationErr(msg='Un utilisateur avec la meme adresse est déjà enregistré')
         #raise HTTPException(status_code=400,detail="The user with this username already exists in the system.")
     
-    user = crud.user.get_by_name_birthday(db, full_name=user_in.full_name, birth_date= user_in.birth_date)
-    if user:
+    similar = crud.user.get_similar_patients(db, full_name=user_in.full_name or '', birth_date=user_in.birth_date)
+    if similar and similar[0].similarity >= 1:
         return schemas.UserLoginOrCreationErr(msg='Un utilisateur avec la meme nom et date de naissance deja existant')
+    if similar and not allow_similar:
+        return schemas.UserLoginOrCreationErr(msg='Un utilisateur avec un nom proche et la meme date de naissance existe deja')
         #raise HTTPException(status_code=400,detail="The user with this username already exists in the system.")
     
     user_in.is_active = False
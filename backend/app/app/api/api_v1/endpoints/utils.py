@@ -6,6 +6,7 @@ from pydantic.networks import EmailStr
 from app import models, schemas
 from app.api import deps
 from app import crud
+from app.core.admission import ingest_admission
 from app.utils import send_test_email, send_notification, send_notification_firebase
 
 from uuid import uuid4
@@ -48,3 +49,13 @@ def test_notification(
         result = 'firebase_device_token is none' 
 
     return result
+
+
+@router.get("/ingest-stats/")
+def read_ingest_stats(
+    current_user: models.User = Depends(deps.get_current_active_superuser),
+) -> Any:
+    """
+    Counters of the voice uploads admission of this worker.
+    """
+    return ingest_admission.stats()
@@ -1,33 +1,49 @@
+import asyncio
 import os
 import aiofiles
 
-from typing import Any, List, Optional, Union
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
 from itertools import chain
 from pathlib import Path
 
 
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Request, Response
 from fastapi import File, UploadFile, Form
 from sqlalchemy.orm import Session
-from fastapi.responses import FileResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
 import uuid
 import base64
+import json
+import mimetypes
+import zipfile
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from app import crud, models, schemas
-from app.api import deps
+from app.api import deps, pagination
+from app.api.routing import ThreadpoolJSONRoute
+from app.core.config import settings
+from app.storage import staging
+from app.storage.base import StorageBackend
+from app.storage.cold import ColdTier
+from app.storage.analysis import analyze_voice
+from app.storage.transcode import ffmpeg_available, transcode_available, transcode_voice
+from app.storage.zip_stream import ZipStreamBuffer
 
 from app.models.doctor_manager import DoctorManager
 from app.models.assistant_manager import AssistantManager
 from app.models.doctor_patient import DoctorPatient
 from app.models.voice import Voice
+from app.models.upload_session import UploadSession
+from app.db.session import SessionLocal
 
 from app.models.note import Note
 
 from app.utils import send_notification, send_notification_firebase
 
-router = APIRouter()
+router = APIRouter(route_class=ThreadpoolJSONRoute)
 
 
 @router.get("/", response_model=List[schemas.Voice])
@@ -125,69 +141,171 @@ def read_note_voice_by_id(
     else:
         raise HTTPException(status_code=400, detail="No Voice found with given voice_id")
 
+def _check_audio_access(
+    db: Session, current_user: models.User, voice: Voice
+) -> None:
+    """
+    Only the doctor of the patient, the patient, the managers of the doctor
+    and the assistant owner of the voice can retrieve the audio
+    """
+    manager_idx = crud.user.get_doctor_managers(db=db, doctor_id=voice.doctor_id)
+    manager_idx = list(chain(*manager_idx))
+    assistant_idx = crud.user.get_doctor_assistants(db=db, doctor_id=voice.doctor_id)
+    assistant_idx = list(chain(*assistant_idx))
+
+    if not voice.note_created and current_user.role == 'assistant':
+        raise HTTPException(status_code=400, detail="note need to be created to retrieve the voice by an assistant")
+
+    if voice.note_created:
+        note = crud.note.get_by_voice_id(db=db, id=voice.id)
+        if note:
+            assistant_idx = [note.assistant_id]
+    if current_user.id in [voice.doctor_id, voice.patient_id] + manager_idx + assistant_idx:
+        return
+    raise HTTPException(status_code=400, detail="Not enough permissions")
+
+
+async def _audio_source(
+    voice: Voice, storage: StorageBackend, cold_tier: ColdTier
+) -> StorageBackend:
+    """
+    Where the audio of the voice can be read, archived voices are rehydrated first
+    """
+    if voice.cold_path and await cold_tier.rehydrate(voice.path, voice.cold_path):
+        return cold_tier.cache
+    return storage
+
+
+def _parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Return the (start, end) bytes of a single "bytes=" range, end included.
+    None is returned when the header should be ignored and the whole file sent.
+    """
+    unit, _, ranges = range_header.partition('=')
+    if unit.strip() != 'bytes' or ',' in ranges:
+        return None
+    start_str, _, end_str = ranges.strip().partition('-')
+    try:
+        if start_str == '':
+            # suffix range, the last bytes of the file
+            start, end = max(size - int(end_str), 0), size - 1
+        else:
+            start = int(start_str)
+            end = min(int(end_str), size - 1) if end_str else size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable",
+            headers={'Content-Range': f'bytes */{size}'})
+    return start, end
+
+
 @router.get("/audiofile/{voice_id}", response_model=schemas.AudioFileVoice)
-def audiofile_by_id(
+async def audiofile_by_id(
     *,
     db: Session = Depends(deps.get_db),
     voice_id : int,
     current_user: models.User = Depends(deps.get_current_active_user),
-    
+    storage: StorageBackend = Depends(deps.get_storage),
+    cold_tier: ColdTier = Depends(deps.get_cold_tier),
 ) -> Any:
     """
     Retrieve the audio voice by id. 
     Only the doctor of the patient, the assistant owner of the voice or his manager can retrieve it
     """
-     #to change after having the relationship crud
-    voice = crud.voice.get_by_voice_id(db, id=voice_id)
-    if voice:
-        audio_file = Path(voice.path)
-        if not audio_file.is_file():
-            raise HTTPException(status_code=500, detail="The audio file of the given voice not found, please check with your admin")
-        
-        #audio_file = FileResponse(path=voice.path, filename=voice.path.split('/')[-1], media_type='audio/mpeg')
-        
-        f = open(voice.path, 'rb')
-        audio_file = base64.b64encode(f.read())
-        audio_file = str(audio_file, 'ascii', 'ignore')
-        f.close()
+    voice = await run_in_threadpool(_get_audio_voice, db=db, current_user=current_user, voice_id=voice_id)
 
-        audio_file = schemas.AudioFileVoice(voice_file_b64=audio_file)
+    storage = await _audio_source(voice=voice, storage=storage, cold_tier=cold_tier)
+    if not await storage.exists(voice.path):
+        raise HTTPException(status_code=500, detail="The audio file of the given voice not found, please check with your admin")
 
-        
-        manager_idx = crud.user.get_doctor_managers(db=db, doctor_id=voice.doctor_id)
-        manager_idx = list(chain(*manager_idx))
-        assistant_idx = crud.user.get_doctor_assistants(db=db, doctor_id=voice.doctor_id)
-        assistant_idx = list(chain(*assistant_idx))
+    # the file is encoded in a thread, it is known to be valid base64 and not validated again
+    return await run_in_threadpool(_audio_file_response, await storage.read(voice.path))
 
-        if not voice.note_created and current_user.role == 'assistant':
-            raise HTTPException(status_code=400, detail="note need to be created to retrieve the voice by an assistant")
 
-        if voice.note_created:
-            note = crud.note.get_by_voice_id(db=db, id=voice.id)
-            if note:
-                assistant_idx = [note.assistant_id]
-        if current_user.id == voice.doctor_id:
-            return audio_file
-        elif current_user.id == voice.patient_id:
-            return audio_file
-        elif current_user.id in manager_idx:
-            return audio_file
-        elif current_user.id in assistant_idx:
-            return audio_file
-        else:
-            raise HTTPException(status_code=400, detail="Not enough permissions")
-    else:
+def _get_audio_voice(db: Session, current_user: models.User, voice_id: int) -> Voice:
+    voice = crud.voice.get_by_voice_id(db, id=voice_id)
+    if not voice:
         raise HTTPException(status_code=404, detail="No voice found with this id")
+    _check_audio_access(db=db, current_user=current_user, voice=voice)
+    return voice
+
+
+def _audio_file_response(data: bytes) -> JSONResponse:
+    return JSONResponse({'voice_file_b64': base64.b64encode(data).decode('ascii')})
+
+@router.get("/audio/{voice_id}")
+async def audio_by_id(
+    *,
+    db: Session = Depends(deps.get_db),
+    voice_id : int,
+    request: Request,
+    current_user: models.User = Depends(deps.get_current_active_user),
+    storage: StorageBackend = Depends(deps.get_storage),
+    cold_tier: ColdTier = Depends(deps.get_cold_tier),
+) -> Any:
+    """
+    Stream the audio voice by id as binary, a single Range header is supported
+    so that players can seek and start playing before the whole file is received.
+    Only the doctor of the patient, the assistant owner of the voice or his manager can retrieve it
+    """
+    voice = await run_in_threadpool(_get_audio_voice, db=db, current_user=current_user, voice_id=voice_id)
+
+    storage = await _audio_source(voice=voice, storage=storage, cold_tier=cold_tier)
+    size = await storage.size(voice.path)
+    if size is None:
+        raise HTTPException(status_code=500, detail="The audio file of the given voice not found, please check with your admin")
+
+    media_type = mimetypes.guess_type(voice.path)[0] or 'application/octet-stream'
+    headers = {'Accept-Ranges': 'bytes'}
+
+    byte_range = None
+    range_header = request.headers.get('range')
+    if range_header and size > 0:
+        byte_range = _parse_range(range_header, size)
+    if byte_range is None:
+        headers['Content-Length'] = str(size)
+        return StreamingResponse(storage.iter_range(voice.path, start=0, end=size - 1),
+            media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    headers['Content-Length'] = str(end - start + 1)
+    headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return StreamingResponse(storage.iter_range(voice.path, start=start, end=end),
+        status_code=206, media_type=media_type, headers=headers)
+
+@router.get("/peaks/{voice_id}", response_model=schemas.VoicePeaks)
+async def peaks_by_id(
+    *,
+    db: Session = Depends(deps.get_db),
+    voice_id : int,
+    current_user: models.User = Depends(deps.get_current_active_user),
+    storage: StorageBackend = Depends(deps.get_storage),
+) -> Any:
+    """
+    Retrieve the waveform peaks of the voice to draw its timeline without the audio.
+    Only the users allowed to retrieve the audio can retrieve them
+    """
+    voice = await run_in_threadpool(_get_audio_voice, db=db, current_user=current_user, voice_id=voice_id)
+
+    peaks_key = staging.peaks_key(voice.path)
+    if voice.duration is None or not await storage.exists(peaks_key):
+        raise HTTPException(status_code=404, detail="The peaks of this voice are not computed yet")
+    return schemas.VoicePeaks(duration=voice.duration, sample_rate=voice.sample_rate,
+        peaks_per_second=settings.VOICE_PEAKS_PER_SECOND, peaks=list(await storage.read(peaks_key)))
 
-@router.get("/doctor/{doctor_id}", response_model=Union[List[schemas.Voice], int])
+@router.get("/doctor/{doctor_id}", response_model=Union[List[schemas.Voice], int, schemas.VoicePage])
 def read_doctor_voices(
     *,
     db: Session = Depends(deps.get_db),
     doctor_id: int,
     skip: int=0,
     limit: int=5,
+    cursor: Optional[str] = Depends(pagination.get_cursor),
+    response: Response,
     note_created: Optional[bool]=None,
     count: Optional[bool]=None,
+    envelope: Optional[bool]=None,
     current_user: models.User = Depends(deps.get_current_active_user),
     
 ) -> Any:
@@ -198,20 +316,25 @@ def read_doctor_voices(
     if (crud.user.is_superuser(current_user) or (current_user.id  == doctor_id and current_user.role=='doctor')):
         if count:
             return crud.voice.get_multi_by_doctor_count(db=db, doctor_id=doctor_id, note_created=note_created)
-        voices = crud.voice.get_multi_by_doctor_id(db, doctor_id=doctor_id, note_created=note_created, skip=skip, limit=limit)
+        voices = crud.voice.get_multi_by_doctor_id(db, doctor_id=doctor_id, note_created=note_created, skip=skip, limit=limit, cursor=cursor,
+            with_total=bool(envelope))
+        voices = pagination.page_response(response, voices, limit)
     else :
         raise HTTPException(status_code=400, detail="Not enough permissions")
     return voices
 
-@router.get("/manager/{manager_id}", response_model=Union[List[schemas.VoiceReduced], int])
+@router.get("/manager/{manager_id}", response_model=Union[List[schemas.VoiceReduced], int, schemas.VoiceReducedPage])
 def read_manager_voices(
     *,
     db: Session = Depends(deps.get_db),
     manager_id: int,
     skip: int=0,
     limit: int=5,
+    cursor: Optional[str] = Depends(pagination.get_cursor),
+    response: Response,
     note_created: Optional[bool]=None,
     count: Optional[bool]=None,
+    envelope: Optional[bool]=None,
     current_user: models.User = Depends(deps.get_current_active_user),
     
 ) -> Any:
@@ -222,19 +345,24 @@ def read_manager_voices(
     if (crud.user.is_superuser(current_user) or (current_user.id  == manager_id and current_user.role == 'manager')) :
         if count:
             return crud.voice.get_multi_by_manager_count(db=db, manager_id=manager_id, note_created=note_created)
-        voices = crud.voice.get_multi_by_manager(db, manager_id=manager_id, note_created=note_created, skip=skip, limit=limit)
+        voices = crud.voice.get_multi_by_manager(db, manager_id=manager_id, note_created=note_created, skip=skip, limit=limit, cursor=cursor,
+            with_total=bool(envelope))
+        voices = pagination.page_response(response, voices, limit)
     else :
         raise HTTPException(status_code=400, detail="Not enough permissions")
     return voices
 
-@router.get("/assistant/{assistant_id}", response_model=Union[List[schemas.VoiceReduced], int])
+@router.get("/assistant/{assistant_id}", response_model=Union[List[schemas.VoiceReduced], int, schemas.VoiceReducedPage])
 def read_assistant_voices(
     *,
     db: Session = Depends(deps.get_db),
     assistant_id: int,
     skip: int=0,
     limit: int=5,
+    cursor: Optional[str] = Depends(pagination.get_cursor),
+    response: Response,
     count: Optional[bool]=None,
+    envelope: Optional[bool]=None,
     current_user: models.User = Depends(deps.get_current_active_user),
     
 ) -> Any:
@@ -246,21 +374,26 @@ def read_assistant_voices(
     if (crud.user.is_superuser(current_user) or (current_user.id  == assistant_id and current_user.role=='assistant')):
         if count:
             return crud.voice.get_multi_by_assistant_count(db, assistant_id=assistant_id, note_created=note_created)
-        voices = crud.voice.get_multi_by_assistant(db, assistant_id=assistant_id, note_created=note_created, skip=skip, limit=limit)
+        voices = crud.voice.get_multi_by_assistant(db, assistant_id=assistant_id, note_created=note_created, skip=skip, limit=limit, cursor=cursor,
+            with_total=bool(envelope))
+        voices = pagination.page_response(response, voices, limit)
     else :
         raise HTTPException(status_code=400, detail="Not enough permissions")
     return voices
 
 
-@router.get("/patient/{patient_id}", response_model=Union[List[schemas.Voice], int])
+@router.get("/patient/{patient_id}", response_model=Union[List[schemas.Voice], int, schemas.VoicePage])
 def read_patient_voices(
     *,
     db: Session = Depends(deps.get_db),
     patient_id: int,
     skip: int=0,
     limit: int=5,
+    cursor: Optional[str] = Depends(pagination.get_cursor),
+    response: Response,
     note_created: Optional[bool]=None,
     count: Optional[bool]=None,
+    envelope: Optional[bool]=None,
     current_user: models.User = Depends(deps.get_current_active_user),
     
 ) -> Any:
@@ -269,46 +402,151 @@ def read_patient_voices(
     if it's the patient session, it will retrieve all patient voices
     if it's the doctor session , it will retrieve the patient-doctors related voices
     """
+    doctor_id = _patient_voices_doctor_id(db=db, current_user=current_user, patient_id=patient_id)
+    if doctor_id is None:
+        if count:
+            return crud.voice.get_multi_by_patient_count(db, patient_id=patient_id, note_created=note_created)
+        voices = crud.voice.get_multi_by_patient(db, patient_id=patient_id, note_created=note_created, skip=skip, limit=limit, cursor=cursor,
+            with_total=bool(envelope))
+        voices = pagination.page_response(response, voices, limit)
+    else:
+        if count:
+            return crud.voice.get_multi_by_patient_count(db, patient_id=patient_id, doctor_id=doctor_id, note_created=note_created)
+        voices = crud.voice.get_multi_by_patient(db, patient_id=patient_id, doctor_id=doctor_id, note_created=note_created, skip=skip, limit=limit, cursor=cursor,
+            with_total=bool(envelope))
+        voices = pagination.page_response(response, voices, limit)
+    return voices
+
+def _patient_voices_doctor_id(
+    db: Session, current_user: models.User, patient_id: int
+) -> Optional[int]:
+    """
+    The patient can retrieve all his voices, a doctor related to the patient only his own ones.
+    Return the doctor the voices are restricted to, None for all of them
+    """
     #to change after having the relationship crud
     doctor_idx = db.query(DoctorPatient).filter(DoctorPatient.patient_id == patient_id).\
                                         with_entities(DoctorPatient.doctor_id).all()
     doctor_idx = list(chain(*doctor_idx))
 
     if (current_user.id  == patient_id):
-        if count:
-            return crud.voice.get_multi_by_patient_count(db, patient_id=patient_id, note_created=note_created)
-        voices = crud.voice.get_multi_by_patient(db, patient_id=patient_id, note_created=note_created, skip=skip, limit=limit)
+        return None
     elif current_user.role == 'doctor' and current_user.id in doctor_idx:
-        if count:
-            return crud.voice.get_multi_by_patient_count(db, patient_id=patient_id, doctor_id=current_user.id, note_created=note_created)
-        voices = crud.voice.get_multi_by_patient(db, patient_id=patient_id, doctor_id=current_user.id, note_created=note_created, skip=skip, limit=limit)
-    else :
-        raise HTTPException(status_code=400, detail="Not enough permissions")
-    return voices
+        return current_user.id
+    raise HTTPException(status_code=400, detail="Not enough permissions")
 
-@router.post("/", response_model=schemas.Voice)
-async def create_voice(
+@router.get("/patient/{patient_id}/export")
+def export_patient_voices(
     *,
     db: Session = Depends(deps.get_db),
-    voice_input : schemas.VoiceCreateUpload,
+    patient_id: int,
     current_user: models.User = Depends(deps.get_current_active_user),
-    background_tasks: BackgroundTasks
+    storage: StorageBackend = Depends(deps.get_storage),
+    cold_tier: ColdTier = Depends(deps.get_cold_tier),
 ) -> Any:
     """
-    Create new item.
-    Only doctors and super users can create voices
+    Export the patient voices with their notes as a zip archive built while it is sent.
+    Same permissions as the patient voices
     """
-    if voice_input.voice_file_b64 == '':
-        raise HTTPException(
-            status_code=405,
-            detail="The sent voice is empty.",
-        )
-    voice_in = schemas.VoiceCreate(path='', doctor_id=voice_input.doctor_id, patient_id=voice_input.patient_id, title=voice_input.title, remarque=voice_input.remarque)
-    if (current_user.role != 'doctor' or current_user.id != voice_in.doctor_id) and (not current_user.is_superuser):
-        raise HTTPException(
-            status_code=401,
-            detail="You have not the right the right to write a voice.",
-        )
+    doctor_id = _patient_voices_doctor_id(db=db, current_user=current_user, patient_id=patient_id)
+    return StreamingResponse(
+        _export_zip(storage=storage, cold_tier=cold_tier, patient_id=patient_id, doctor_id=doctor_id),
+        media_type='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="patient_{patient_id}_voices.zip"'})
+
+@router.get("/doctor/{doctor_id}/export")
+def export_doctor_voices(
+    *,
+    doctor_id: int,
+    current_user: models.User = Depends(deps.get_current_active_user),
+    storage: StorageBackend = Depends(deps.get_storage),
+    cold_tier: ColdTier = Depends(deps.get_cold_tier),
+) -> Any:
+    """
+    Export the doctor voices with their notes as a zip archive built while it is sent.
+    Only That doctor and a super user can use it
+    """
+    if not (crud.user.is_superuser(current_user) or (current_user.id  == doctor_id and current_user.role=='doctor')):
+        raise HTTPException(status_code=400, detail="Not enough permissions")
+    return StreamingResponse(
+        _export_zip(storage=storage, cold_tier=cold_tier, doctor_id=doctor_id),
+        media_type='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="doctor_{doctor_id}_voices.zip"'})
+
+def _export_batch(
+    db: Session, *, patient_id: Optional[int], doctor_id: Optional[int], after_id: int
+) -> List[Tuple[Voice, Dict[str, Any]]]:
+    """
+    The next voices to export with their manifest entry, without keeping the transaction open
+    """
+    voices = crud.voice.get_multi_for_export(db, patient_id=patient_id, doctor_id=doctor_id,
+        after_id=after_id, limit=100)
+    notes = crud.note.get_multi_by_voice_ids(db, voice_ids=[voice.id for voice in voices])
+    remarques = crud.note.get_remarques_by_note_ids(db, note_ids=[note.id for note in notes])
+    batch = []
+    for voice in voices:
+        entry = jsonable_encoder(schemas.Voice.from_orm(voice), exclude={'path'})
+        entry['notes'] = [
+            dict(jsonable_encoder(schemas.Note.from_orm(note)),
+                remarques=[jsonable_encoder(schemas.RemarqueNote.from_orm(remarque))
+                    for remarque in remarques if remarque.note_id == note.id])
+            for note in notes if note.voice_id == voice.id]
+        entry['file'] = None
+        batch.append((voice, entry))
+    # do not keep the transaction open while the archive is sent
+    db.expunge_all()
+    db.rollback()
+    return batch
+
+async def _export_zip(
+    storage: StorageBackend, cold_tier: ColdTier,
+    patient_id: Optional[int] = None, doctor_id: Optional[int] = None
+) -> AsyncIterator[bytes]:
+    """
+    Write the audio files one by one in the archive and send the written bytes after each chunk,
+    only the manifest of the voices, notes and remarques is kept until the end
+    """
+    db = SessionLocal()
+    buffer = ZipStreamBuffer()
+    manifest = []
+    try:
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            after_id = 0
+            while True:
+                batch = await run_in_threadpool(_export_batch, db, patient_id=patient_id,
+                    doctor_id=doctor_id, after_id=after_id)
+                if not batch:
+                    break
+                after_id = batch[-1][0].id
+
+                for voice, entry in batch:
+                    source = await _audio_source(voice=voice, storage=storage, cold_tier=cold_tier)
+                    size = await source.size(voice.path)
+                    if size is not None:
+                        entry['file'] = f'voices/{voice.id}{Path(voice.path).suffix}'
+                        info = zipfile.ZipInfo(entry['file'], date_time=voice.date_creation.timetuple()[:6])
+                        info.file_size = size
+                        with archive.open(info, 'w') as audio_file:
+                            if size > 0:
+                                async for chunk in source.iter_range(voice.path, start=0, end=size - 1):
+                                    audio_file.write(chunk)
+                                    yield buffer.drain()
+                    manifest.append(entry)
+                    yield buffer.drain()
+
+            archive.writestr('manifest.json', json.dumps({'voices': manifest}, ensure_ascii=False, indent=2),
+                compress_type=zipfile.ZIP_DEFLATED)
+        yield buffer.drain()
+    finally:
+        await run_in_threadpool(db.close)
+
+def _check_voice_creation(
+    db: Session, current_user: models.User, voice_in: schemas.VoiceCreate
+) -> None:
+    """
+    Only doctors and super users can create voices, for a patient related to the doctor
+    """
+    _check_voice_author(current_user=current_user, doctor_id=voice_in.doctor_id)
     #to change after having the relationship crud
     patient = crud.user.get_by_id(db=db, id=voice_in.patient_id)
     if not patient:
@@ -331,21 +569,99 @@ async def create_voice(
                 status_code=405,
                 detail="This patient is not related to doctor, please ask the admin to relate it to the doctor",
             )
-    
-    filename = str(uuid.uuid4())
-    storage_path = list(Path(os.path.abspath(__file__)).parents)[-2]
-    voice_save_path = os.path.abspath(os.path.join(storage_path, 'storage',filename+'_'+voice_input.filename))
-    voice_in.path = voice_save_path
-
-    ## base64 to mp3
-    encoding_str = voice_input.voice_file_b64
-    voice_file = base64.b64decode(encoding_str)
-    ##
-    async with aiofiles.open(voice_save_path, 'wb') as out_file:
-        await out_file.write(voice_file)
-    
-    voice = crud.voice.create_with_doctor(db=db, obj_in=voice_in, date_creation=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-    
+
+
+def _check_voice_author(current_user: models.User, doctor_id: int) -> None:
+    if (current_user.role != 'doctor' or current_user.id != doctor_id) and (not current_user.is_superuser):
+        raise HTTPException(
+            status_code=401,
+            detail="You have not the right the right to write a voice.",
+        )
+
+
+def _check_batch_creation(
+    db: Session, current_user: models.User, voices_in: schemas.VoiceCreateBatch
+) -> None:
+    """
+    Same checks as _check_voice_creation for all the patients of the batch in a single query
+    """
+    _check_voice_author(current_user=current_user, doctor_id=voices_in.doctor_id)
+    patient_ids = sorted({voice_input.patient_id for voice_input in voices_in.voices})
+    patients = {patient.id: patient for patient in
+        crud.user.get_patients_of_doctor(db=db, doctor_id=voices_in.doctor_id, patient_ids=patient_ids)}
+    for patient_id in patient_ids:
+        patient = patients.get(patient_id)
+        if not patient:
+            raise HTTPException(
+                status_code=404,
+                detail=f"No patient with the id {patient_id} is found in the DB",
+            )
+        if patient.role != 'patient':
+            raise HTTPException(
+                status_code=405,
+                detail=f"The id {patient_id} is not related to a patient",
+            )
+        if patient.doctor_id is None:
+            raise HTTPException(
+                status_code=405,
+                detail=f"The patient {patient_id} is not related to doctor, please ask the admin to relate it to the doctor",
+            )
+
+
+async def _create_voice_from_staged(
+    db: Session, storage: StorageBackend, voice_in: schemas.VoiceCreate, staged: staging.StagedBlob
+) -> Voice:
+    """
+    Store the staged file under its content addressed key and create the voice referencing it.
+    The session is used from the threadpool, waiting for the lock must not block the event loop.
+    """
+    transcoded = await run_in_threadpool(_lock_staged_key, db, key=staged.key)
+    if transcoded is None:
+        voice_in.path = await storage.store(staged)
+    else:
+        staging.discard(staged.tmp_path)
+        _use_transcoded_file(voice_in, original_path=staged.key, transcoded=transcoded)
+    return await run_in_threadpool(crud.voice.create_with_doctor, db=db, obj_in=voice_in,
+        date_creation=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+
+def _lock_staged_key(db: Session, key: str) -> Optional[Voice]:
+    """
+    Lock the content addressed key of a staged file. When the same recording was uploaded before
+    and transcoded, a voice of the transcoded file is returned and that file is locked too.
+    """
+    crud.voice.lock_path(db, path=key)
+    transcoded = crud.voice.get_by_original_path(db, original_path=key)
+    if transcoded is None:
+        return None
+    crud.voice.lock_path(db, path=transcoded.path)
+    # its last voice can be deleted before the file was locked
+    if crud.voice.count_by_path(db, path=transcoded.path) == 0:
+        return None
+    return transcoded
+
+
+def _use_transcoded_file(voice_in: schemas.VoiceCreate, original_path: str, transcoded: Voice) -> None:
+    voice_in.path = transcoded.path
+    voice_in.original_path = original_path
+    voice_in.transcoded = True
+    voice_in.duration = transcoded.duration
+    voice_in.sample_rate = transcoded.sample_rate
+
+
+async def _stage_b64(encoded: str, filename: str) -> staging.StagedBlob:
+    try:
+        return await staging.stage_b64(encoded, filename)
+    except ValueError:
+        raise HTTPException(
+            status_code=422,
+            detail="voice_file_b64 need to be a base64 string",
+        )
+
+
+def _notify_voice_created(
+    db: Session, current_user: models.User, voice: Voice, background_tasks: BackgroundTasks
+) -> None:
     msg_title = f'Docteur {current_user.full_name} vient de creer une voice avec #id: {voice.id}'
     msg_body = {'voice_id': voice.id, 'title': voice.title, \
             'doctor_id': voice.doctor_id, 'patient_id': voice.patient_id}
@@ -357,10 +673,348 @@ async def create_voice(
 
     background_tasks.add_task(send_notification_firebase, msg_title=msg_title, \
                                 msg_body=msg_body, to_users=assistants_device)
+
+
+def _schedule_processing(
+    voice: Voice, storage: StorageBackend, background_tasks: BackgroundTasks
+) -> None:
+    """
+    Transcode the stored file after the response is sent, audiofile_by_id serves
+    the transcoded file once it replaced the original.
+    The duration and the waveform peaks are computed afterwards on the served file.
+    """
+    if not voice.transcoded and transcode_available():
+        background_tasks.add_task(transcode_voice, voice.id, storage)
+    if ffmpeg_available():
+        background_tasks.add_task(analyze_voice, voice.id, storage)
+
+
+@router.post("/", response_model=schemas.Voice)
+async def create_voice(
+    *,
+    db: Session = Depends(deps.get_db),
+    voice_input : schemas.VoiceCreateUpload,
+    current_user: models.User = Depends(deps.get_current_active_user),
+    storage: StorageBackend = Depends(deps.get_storage),
+    background_tasks: BackgroundTasks
+) -> Any:
+    """
+    Create new item.
+    Only doctors and super users can create voices
+    """
+    if voice_input.voice_file_b64 == '':
+        raise HTTPException(
+            status_code=405,
+            detail="The sent voice is empty.",
+        )
+    voice_in = schemas.VoiceCreate(path='', doctor_id=voice_input.doctor_id, patient_id=voice_input.patient_id, title=voice_input.title, remarque=voice_input.remarque)
+    await run_in_threadpool(_check_voice_creation, db=db, current_user=current_user, voice_in=voice_in)
+    
+    ## base64 to mp3, decoded and hashed in a thread
+    staged = await _stage_b64(voice_input.voice_file_b64, voice_input.filename)
+    ##
+    voice = await _create_voice_from_staged(db=db, storage=storage, voice_in=voice_in, staged=staged)
+    await run_in_threadpool(_notify_voice_created, db=db, current_user=current_user, voice=voice,
+        background_tasks=background_tasks)
+    _schedule_processing(voice=voice, storage=storage, background_tasks=background_tasks)
     #send_notification_firebase(msg=msg, to_users=assistants_device)
     
     return voice
 
+@router.post("/batch", response_model=List[schemas.Voice])
+async def create_voices_batch(
+    *,
+    db: Session = Depends(deps.get_db),
+    voices_in : schemas.VoiceCreateBatch,
+    current_user: models.User = Depends(deps.get_current_active_user),
+    storage: StorageBackend = Depends(deps.get_storage),
+    background_tasks: BackgroundTasks
+) -> Any:
+    """
+    Create several voices of a doctor at once, e.g. recorded offline.
+    The voices are all created or none of them, the assistants are notified once.
+    Only doctors and super users can create voices
+    """
+    if any(voice_input.voice_file_b64 == '' for voice_input in voices_in.voices):
+        raise HTTPException(
+            status_code=405,
+            detail="The sent voice is empty.",
+        )
+    await run_in_threadpool(_check_batch_creation, db=db, current_user=current_user, voices_in=voices_in)
+
+    staged_voices = []
+    try:
+        for voice_input in voices_in.voices:
+            staged_voices.append(await _stage_b64(voice_input.voice_file_b64, voice_input.filename))
+        # lock in a fixed order, a same recording can be sent twice
+        keys = sorted({staged.key for staged in staged_voices})
+        transcoded_files = {}
+        for key in keys:
+            transcoded = await run_in_threadpool(_lock_staged_key, db, key=key)
+            if transcoded is not None:
+                transcoded_files[key] = transcoded
+        first_staged = {}
+        for staged in staged_voices:
+            first_staged.setdefault(staged.key, staged)
+        await asyncio.gather(*[storage.store(first_staged[key]) for key in keys if key not in transcoded_files])
+
+        objs_in = []
+        for voice_input, staged in zip(voices_in.voices, staged_voices):
+            voice_in = schemas.VoiceCreate(path=staged.key, doctor_id=voices_in.doctor_id,
+                patient_id=voice_input.patient_id, title=voice_input.title, remarque=voice_input.remarque)
+            if staged.key in transcoded_files:
+                _use_transcoded_file(voice_in, original_path=staged.key, transcoded=transcoded_files[staged.key])
+            objs_in.append(voice_in)
+        voices = await run_in_threadpool(crud.voice.create_multi_with_doctor, db=db, objs_in=objs_in,
+            date_creation=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    finally:
+        for staged in staged_voices:
+            staging.discard(staged.tmp_path)
+
+    msg_title = f'Docteur {current_user.full_name} vient de creer {len(voices)} voices'
+    msg_body = {'voice_ids': [voice.id for voice in voices], 'doctor_id': voices_in.doctor_id}
+    assistants_device = await run_in_threadpool(crud.user.get_doctor_assistants_devices, db,
+        doctor_id=voices_in.doctor_id)
+    background_tasks.add_task(send_notification_firebase, msg_title=msg_title, \
+                                msg_body=msg_body, to_users=assistants_device)
+    for voice in voices:
+        _schedule_processing(voice=voice, storage=storage, background_tasks=background_tasks)
+    return voices
+
+@router.post("/stream", response_model=schemas.Voice)
+async def create_voice_stream(
+    *,
+    db: Session = Depends(deps.get_db),
+    request: Request,
+    filename: str,
+    doctor_id: int,
+    patient_id: int,
+    title: Optional[str] = None,
+    remarque: Optional[str] = None,
+    current_user: models.User = Depends(deps.get_current_active_user),
+    storage: StorageBackend = Depends(deps.get_storage),
+    background_tasks: BackgroundTasks
+) -> Any:
+    """
+    Create new voice from the raw audio bytes sent as request body.
+    The body is written to the storage while it is received, without base64 encoding.
+    Only doctors and super users can create voices
+    """
+    voice_in = schemas.VoiceCreate(path='', doctor_id=doctor_id, patient_id=patient_id, title=title, remarque=remarque)
+    await run_in_threadpool(_check_voice_creation, db=db, current_user=current_user, voice_in=voice_in)
+
+    max_bytes = staging.max_voice_bytes()
+    content_length = request.headers.get('content-length')
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail=f"The voice file size should not exceed {settings.VOICE_MAX_SIZE_MB}mb",
+        )
+
+    try:
+        staged = await staging.stage_stream(request.stream(), filename, max_bytes=max_bytes)
+    except staging.VoiceTooLarge:
+        raise HTTPException(
+            status_code=413,
+            detail=f"The voice file size should not exceed {settings.VOICE_MAX_SIZE_MB}mb",
+        )
+    if staged.size == 0:
+        staging.discard(staged.tmp_path)
+        raise HTTPException(
+            status_code=405,
+            detail="The sent voice is empty.",
+        )
+
+    voice = await _create_voice_from_staged(db=db, storage=storage, voice_in=voice_in, staged=staged)
+    await run_in_threadpool(_notify_voice_created, db=db, current_user=current_user, voice=voice,
+        background_tasks=background_tasks)
+    _schedule_processing(voice=voice, storage=storage, background_tasks=background_tasks)
+    return voice
+
+@router.post("/uploads/", response_model=schemas.UploadSession)
+def create_upload_session(
+    *,
+    db: Session = Depends(deps.get_db),
+    session_in: schemas.UploadSessionCreate,
+    current_user: models.User = Depends(deps.get_current_active_user),
+    background_tasks: BackgroundTasks
+) -> Any:
+    """
+    Create a resumable upload session for a voice.
+    The chunks are then sent with PUT /uploads/{session_id} and the voice is created with
+    POST /uploads/{session_id}/finalize.
+    Only doctors and super users can create voices
+    """
+    voice_in = schemas.VoiceCreate(path='', doctor_id=session_in.doctor_id, patient_id=session_in.patient_id,
+        title=session_in.title, remarque=session_in.remarque)
+    _check_voice_creation(db=db, current_user=current_user, voice_in=voice_in)
+
+    if session_in.total_size is not None and session_in.total_size > staging.max_voice_bytes():
+        raise HTTPException(
+            status_code=413,
+            detail=f"The voice file size should not exceed {settings.VOICE_MAX_SIZE_MB}mb",
+        )
+
+    now = datetime.now()
+    session_id = uuid.uuid4().hex
+    upload_session = crud.upload_session.create_with_doctor(db=db, obj_in=session_in, id=session_id,
+        path=staging.upload_session_path(session_id), date_creation=now.strftime('%Y-%m-%d %H:%M:%S'),
+        date_expiration=_upload_session_expiration(now))
+
+    background_tasks.add_task(_remove_expired_upload_sessions, now=now)
+    return upload_session
+
+
+@router.get("/uploads/{session_id}", response_model=schemas.UploadSession)
+def read_upload_session(
+    *,
+    db: Session = Depends(deps.get_db),
+    session_id: str,
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    Retrieve an upload session, its received field is the offset of the next chunk to send.
+    Only the doctor owner of the session and super users can retrieve it
+    """
+    return _get_upload_session(db=db, current_user=current_user, session_id=session_id)
+
+
+@router.put("/uploads/{session_id}", response_model=schemas.UploadSession)
+async def upload_session_chunk(
+    *,
+    db: Session = Depends(deps.get_db),
+    request: Request,
+    session_id: str,
+    offset: int,
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    Write the request body to the upload session at the given offset.
+    The offset must be the received size of the session, otherwise 409 is returned
+    and the client should resume from the received size.
+    Only the doctor owner of the session and super users can upload chunks
+    """
+    upload_session = await run_in_threadpool(_get_upload_session, db=db, current_user=current_user,
+        session_id=session_id)
+    _check_chunk_offset(upload_session=upload_session, offset=offset)
+    max_bytes = staging.max_voice_bytes()
+    if upload_session.total_size is not None:
+        max_bytes = min(max_bytes, upload_session.total_size)
+    filename = upload_session.filename
+    # the session is not locked while the body is received, the chunk is staged first
+    await run_in_threadpool(db.rollback)
+
+    try:
+        chunk = await staging.stage_stream(request.stream(), filename, max_bytes=max_bytes - offset)
+    except staging.VoiceTooLarge:
+        raise HTTPException(
+            status_code=413,
+            detail="The chunk exceeds the size of the upload session",
+        )
+    try:
+        return await run_in_threadpool(_append_chunk, db=db, current_user=current_user,
+            session_id=session_id, offset=offset, chunk=chunk)
+    finally:
+        staging.discard(chunk.tmp_path)
+
+
+def _check_chunk_offset(upload_session: UploadSession, offset: int) -> None:
+    if offset != upload_session.received:
+        raise HTTPException(
+            status_code=409,
+            detail=f"The chunk offset should be {upload_session.received}",
+        )
+
+
+def _append_chunk(
+    db: Session, current_user: models.User, session_id: str, offset: int, chunk: staging.StagedBlob
+) -> UploadSession:
+    """
+    Write a received chunk to the partial file of the session, the session is locked
+    only while its offset is checked again and the chunk is written
+    """
+    upload_session = _get_upload_session(db=db, current_user=current_user, session_id=session_id,
+        for_update=True)
+    try:
+        _check_chunk_offset(upload_session=upload_session, offset=offset)
+        received = staging.write_file_at(chunk.tmp_path, upload_session.path, offset=offset)
+    except BaseException:
+        db.rollback()
+        raise
+    return crud.upload_session.update_received(db=db, db_obj=upload_session, received=received,
+        date_expiration=_upload_session_expiration(datetime.now()))
+
+
+@router.post("/uploads/{session_id}/finalize", response_model=schemas.Voice)
+async def finalize_upload_session(
+    *,
+    db: Session = Depends(deps.get_db),
+    session_id: str,
+    current_user: models.User = Depends(deps.get_current_active_user),
+    storage: StorageBackend = Depends(deps.get_storage),
+    background_tasks: BackgroundTasks
+) -> Any:
+    """
+    Create the voice from a completed upload session.
+    Only the doctor owner of the session and super users can finalize it
+    """
+    upload_session = await run_in_threadpool(_get_upload_session, db=db, current_user=current_user,
+        session_id=session_id, for_update=True)
+    if upload_session.received == 0 or \
+            (upload_session.total_size is not None and upload_session.received != upload_session.total_size):
+        db.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail=f"The upload session is not complete, {upload_session.received} bytes received",
+        )
+
+    voice_in = schemas.VoiceCreate(path='',
+        doctor_id=upload_session.doctor_id, patient_id=upload_session.patient_id,
+        title=upload_session.title, remarque=upload_session.remarque)
+    # the partial file is kept until the voice is committed, the upload can be finalized again on failure
+    staged = await run_in_threadpool(staging.stage_copy, upload_session.path, upload_session.filename)
+    part_path = upload_session.path
+    try:
+        # deleted in the transaction of the voice, a session is finalized only once
+        db.delete(upload_session)
+        voice = await _create_voice_from_staged(db=db, storage=storage, voice_in=voice_in, staged=staged)
+    except BaseException:
+        await run_in_threadpool(db.rollback)
+        raise
+    finally:
+        staging.discard(staged.tmp_path)
+    staging.discard(part_path)
+
+    await run_in_threadpool(_notify_voice_created, db=db, current_user=current_user, voice=voice,
+        background_tasks=background_tasks)
+    _schedule_processing(voice=voice, storage=storage, background_tasks=background_tasks)
+    return voice
+
+
+def _upload_session_expiration(now: datetime) -> str:
+    expiration = now + timedelta(hours=settings.VOICE_UPLOAD_SESSION_EXPIRE_HOURS)
+    return expiration.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _get_upload_session(
+    db: Session, current_user: models.User, session_id: str, for_update: bool = False
+) -> UploadSession:
+    upload_session = crud.upload_session.get_by_session_id(db=db, id=session_id, for_update=for_update)
+    if not upload_session or upload_session.date_expiration < datetime.now():
+        raise HTTPException(status_code=404, detail="No upload session found with this id")
+    if current_user.id != upload_session.doctor_id and not crud.user.is_superuser(current_user):
+        raise HTTPException(status_code=400, detail="Not enough permissions")
+    return upload_session
+
+
+def _remove_expired_upload_sessions(now: datetime) -> None:
+    db = SessionLocal()
+    try:
+        crud.upload_session.remove_expired(db=db, now=now)
+    finally:
+        db.close()
+
+
 @router.put("/{voice_id}", response_model=schemas.Voice)
 def update_voice(
     *,
@@ -391,32 +1045,58 @@ def update_voice(
 
 
 @router.delete("/{id}", response_model=schemas.Voice)
-def delete_voice(
+async def delete_voice(
     *,
     db: Session = Depends(deps.get_db),
     id: int,
     current_user: models.User = Depends(deps.get_current_active_user),
+    storage: StorageBackend = Depends(deps.get_storage),
+    cold_tier: ColdTier = Depends(deps.get_cold_tier),
 ) -> Any:
     """
     Delete a voice.
     Only superuser or doctor owner of that voice can delete it
     """
-    voice = crud.voice.get_by_voice_id(db=db, id=id)
+    voice = await run_in_threadpool(crud.voice.get_by_voice_id, db=db, id=id)
     if not voice:
         raise HTTPException(status_code=404, detail="Voice not found")
     if not crud.user.is_superuser(current_user) and (voice.doctor_id != current_user.id):
         raise HTTPException(status_code=400, detail="Not enough permissions")
     
+    await run_in_threadpool(_remove_voice_notes, db=db, voice=voice)
+    
+    # voices with the same content share the same file
+    voice, path_count = await run_in_threadpool(crud.voice.remove_and_count_path, db=db, id=id)
+    path, cold_path = voice.path, voice.cold_path
+    # the files are removed once the voice is deleted, a failed commit keeps them
+    await run_in_threadpool(db.commit)
+    if path_count == 0:
+        await _remove_unreferenced_files(db=db, storage=storage, cold_tier=cold_tier, path=path, cold_path=cold_path)
+    return voice
+
+
+async def _remove_unreferenced_files(
+    db: Session, storage: StorageBackend, cold_tier: ColdTier, path: str, cold_path: Optional[str]
+) -> None:
+    """
+    Remove the stored files of a path that is not referenced anymore.
+    The path is locked and counted again, a voice with the same content can be created meanwhile
+    """
+    await run_in_threadpool(crud.voice.lock_path, db, path=path)
+    try:
+        if await run_in_threadpool(crud.voice.count_by_path, db, path=path) > 0:
+            return
+        await storage.delete(path)
+        await storage.delete(staging.peaks_key(path))
+        if cold_path:
+            await cold_tier.delete(path, cold_path)
+    finally:
+        await run_in_threadpool(db.rollback)
+
+
+def _remove_voice_notes(db: Session, voice: Voice) -> None:
     notes = crud.note.get_many_by_voice_id(db=db, id=voice.id)
 
     if notes:
         for note in notes:
-            crud.note.remove(db=db, id=note.id)
-    
-    try:
-        os.remove(voice.path)
-    except OSError:
-        pass
-
-    voice = crud.voice.remove(db=db, id=id)
-    return voice
\ No newline at end of file
+            crud.note.remove(db=db, id=note.id)
\ No newline at end of file
@@ -11,6 +11,9 @@ from app.core import security
 from app.core.config import settings
 from app.db.session import SessionLocal
 from app.notification.session import beams_client
+from app.storage.base import StorageBackend
+from app.storage.cold import ColdTier
+from app.storage.session import voice_cold_tier, voice_storage
 
 reusable_oauth2 = OAuth2PasswordBearer(
     tokenUrl=f"{settings.API_V1_STR}/login/access-token"
@@ -28,6 +31,12 @@ def get_beam_pusher() -> any:
     beam_pusher = beams_client
     return beam_pusher
 
+def get_storage() -> StorageBackend:
+    return voice_storage
+
+def get_cold_tier() -> ColdTier:
+    return voice_cold_tier
+
 
 def get_current_user(
     db: Session = Depends(get_db), token: str = Depends(reusable_oauth2)
@@ -0,0 +1,39 @@
+from typing import Any, Dict, List, Optional, Union
+
+from fastapi import HTTPException, Response
+
+from app.crud.pagination import InvalidCursor, Page, decode_cursor, next_cursor
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def get_cursor(cursor: Optional[str] = None) -> Optional[str]:
+    """
+    Cursor of a listing, as returned in the X-Next-Cursor header of the previous page.
+    Without it the listing is paginated with skip.
+    """
+    if cursor is not None:
+        try:
+            decode_cursor(cursor)
+        except InvalidCursor:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    return cursor
+
+
+def set_next_cursor(response: Response, page: List[Any], limit: int) -> None:
+    cursor = next_cursor(page, limit)
+    if cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
+
+
+def page_response(response: Response, page: Union[List[Any], Page], limit: int) -> Union[List[Any], Dict[str, Any]]:
+    """
+    A page with its total (envelope=true) is returned as an object, the cursor of the next page
+    is always sent in the X-Next-Cursor header
+    """
+    if isinstance(page, Page):
+        if page.next_cursor is not None:
+            response.headers[NEXT_CURSOR_HEADER] = page.next_cursor
+        return page._asdict()
+    set_next_cursor(response, page, limit)
+    return page
@@ -0,0 +1,28 @@
+import json
+from typing import Any, Callable
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+
+
+class ThreadpoolJSONRequest(Request):
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            body = await self.body()
+            self._json = await run_in_threadpool(json.loads, body)
+        return self._json
+
+
+class ThreadpoolJSONRoute(APIRoute):
+    """
+    Route whose JSON body is parsed in a thread, the voices are sent as large base64 strings
+    """
+
+    def get_route_handler(self) -> Callable:
+        route_handler = super().get_route_handler()
+
+        async def threadpool_json_route_handler(request: Request) -> Response:
+            return await route_handler(ThreadpoolJSONRequest(request.scope, request.receive))
+
+        return threadpool_json_route_handler
@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.core.config import settings
+from app.db import base  # noqa: F401
+from app.db.session import SessionLocal
+from app.storage import staging
+from app.storage.base import StorageBackend
+from app.storage.cold import ColdTier
+from app.storage.session import voice_cold_tier, voice_storage
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def archive_voice_path(
+    db: Session, storage: StorageBackend, cold_tier: ColdTier, *, path: str, validated_before: datetime
+) -> bool:
+    """
+    Move the file of path to the cold storage and mark its voices as archived
+    """
+    size = await storage.size(path)
+    if not size:
+        logger.warning(f"{path} not found, skipped")
+        return False
+    original = await staging.stage_stream(
+        storage.iter_range(path, start=0, end=size - 1), path, max_bytes=size)
+    try:
+        crud.voice.lock_path(db, path=path)
+        # a voice can have been created with the same file in the meantime
+        if not crud.voice.is_path_archivable(db, path=path, validated_before=validated_before):
+            db.rollback()
+            return False
+        cold_path = await cold_tier.archive(path, original.tmp_path)
+        updated = crud.voice.update_cold_path(db, path=path, cold_path=cold_path)
+        db.commit()
+    finally:
+        staging.discard(original.tmp_path)
+    logger.info(f"{path} archived to {cold_path} ({updated} voices)")
+    crud.voice.lock_path(db, path=path)
+    try:
+        # a voice created with the same file since the commit still plays it from the storage
+        if not crud.voice.count_not_archived_by_path(db, path=path):
+            await storage.delete(path)
+    finally:
+        db.rollback()
+    return True
+
+
+async def archive(*, days: int, batch_size: int, pause: float, dry_run: bool) -> int:
+    db = SessionLocal()
+    validated_before = datetime.now() - timedelta(days=days)
+    archived = 0
+    after_id = 0
+    try:
+        while True:
+            # keyset on the primary key, path only has a hash index
+            voices = crud.voice.get_multi_paths(db, after_id=after_id, limit=batch_size)
+            if not voices:
+                return archived
+            after_id = voices[-1].id
+            paths = crud.voice.get_archivable_paths(
+                db, validated_before=validated_before,
+                paths=sorted({voice.path for voice in voices if voice.cold_path is None}))
+            db.rollback()
+            for path in paths:
+                if dry_run:
+                    logger.info(f"{path} would be archived")
+                elif await archive_voice_path(db, voice_storage, voice_cold_tier,
+                        path=path, validated_before=validated_before):
+                    archived += 1
+            await asyncio.sleep(pause)
+    finally:
+        db.close()
+        await voice_storage.close()
+        await voice_cold_tier.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Move the voices whose note is validated for a while to the cold storage"
+    )
+    parser.add_argument("--days", type=int, default=settings.VOICE_ARCHIVE_AFTER_DAYS,
+        help="archive the voices whose note is validated for more than these days")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--pause", type=float, default=1.0,
+        help="seconds to wait between two batches")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    logger.info("Archiving voices")
+    archived = asyncio.run(archive(days=args.days, batch_size=args.batch_size,
+        pause=args.pause, dry_run=args.dry_run))
+    logger.info(f"{archived} voice files archived")
+
+
+if __name__ == "__main__":
+    main()
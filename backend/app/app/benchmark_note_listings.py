@@ -0,0 +1,106 @@
+import argparse
+import logging
+import time
+from typing import Any, Callable, Optional
+
+from sqlalchemy.orm import Query, Session
+
+from app import crud
+from app.crud.crud_scope_counter import DOCTOR, note_status
+from app.crud.pagination import paginate
+from app.db import base  # noqa: F401
+from app.db.session import SessionLocal
+from app.models.note import Note
+from app.models.scope_counter import ScopeCounter
+from app.models.voice import Voice
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PERMUTATIONS = [(validated, treated) for validated in (None, True, False) for treated in (None, True, False)]
+
+
+def orm_listing(db: Session, doctor_id: int, validated: Optional[bool], treated: Optional[bool]) -> Query:
+    """
+    The notes of a doctor as an ORM query built at each call, as get_multi_by_doctor_id used to
+    """
+    query = db.query(Note).join(Voice, Note.voice_id == Voice.id).filter(Voice.doctor_id == doctor_id)
+    if type(validated) is bool:
+        query = query.filter(Note.validated == validated)
+    if treated == True:
+        query = query.filter(Note.modifier_id.is_not(None))
+    elif treated == False:
+        query = query.filter(Note.modifier_id.is_(None))
+    return query
+
+
+def cached_listing(db: Session, doctor_id: int, validated: Optional[bool], treated: Optional[bool]) -> Query:
+    return crud.note._listing(db, role=DOCTOR, user_id=doctor_id, validated=validated, treated=treated)
+
+
+def per_call(function: Callable[[int, Optional[bool], Optional[bool]], Any], iterations: int) -> float:
+    """
+    Microseconds per call, the calls go through all the filter permutations with changing ids
+    """
+    started = time.perf_counter()
+    for i in range(iterations):
+        validated, treated = PERMUTATIONS[i % len(PERMUTATIONS)]
+        function(i % 50 + 1, validated, treated)
+    return (time.perf_counter() - started) / iterations * 10**6
+
+
+def benchmark(*, iterations: int) -> None:
+    db = SessionLocal()
+    try:
+        # the cache key is what the compiled SQL is looked up with, computing it is the work done
+        # for each call before the statement cache is hit
+        def prepare_query(doctor_id: int, validated: Optional[bool], treated: Optional[bool]) -> Any:
+            return orm_listing(db, doctor_id, validated, treated)._statement_20()._generate_cache_key()
+
+        def prepare_cached(doctor_id: int, validated: Optional[bool], treated: Optional[bool]) -> Any:
+            return cached_listing(db, doctor_id, validated, treated)._statement_20()._generate_cache_key()
+
+        def page_query(doctor_id: int, validated: Optional[bool], treated: Optional[bool]) -> Any:
+            return paginate(orm_listing(db, doctor_id, validated, treated), Note)
+
+        def page_cached(doctor_id: int, validated: Optional[bool], treated: Optional[bool]) -> Any:
+            return crud.note.get_multi_by_doctor_id(db, doctor_id=doctor_id, validated=validated, treated=treated)
+
+        def count_query(doctor_id: int, validated: Optional[bool], treated: Optional[bool]) -> Any:
+            return db.query(ScopeCounter.count).filter(ScopeCounter.scope == DOCTOR,
+                ScopeCounter.scope_id == doctor_id, ScopeCounter.status == note_status(validated, treated)).scalar()
+
+        def count_cached(doctor_id: int, validated: Optional[bool], treated: Optional[bool]) -> int:
+            return crud.note.get_multi_by_doctor_id_count(db, doctor_id=doctor_id, validated=validated,
+                treated=treated)
+
+        functions = (prepare_query, prepare_cached, page_query, page_cached, count_query, count_cached)
+        for function in functions:
+            # fill the statement caches first
+            per_call(function, len(PERMUTATIONS))
+        for name, function in zip(
+            ["listing statement, ORM query", "listing statement, cached query",
+             "first page with the database round trip, ORM query",
+             "first page with the database round trip, cached query",
+             "count with the database round trip, ORM query",
+             "count with the database round trip, lambda statement"],
+            functions
+        ):
+            logger.info(f"{name}: {per_call(function, iterations):.0f} us per call")
+    finally:
+        db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare the per call overhead of the note listings and counts built at each call and reused"
+    )
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    logger.info("Benchmarking the note listings and counts")
+    benchmark(iterations=args.iterations)
+
+
+if __name__ == "__main__":
+    main()
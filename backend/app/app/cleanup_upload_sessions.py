@@ -0,0 +1,27 @@
+import logging
+from datetime import datetime
+
+from app import crud
+from app.db import base  # noqa: F401
+from app.db.session import SessionLocal
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def cleanup() -> int:
+    db = SessionLocal()
+    try:
+        return crud.upload_session.remove_expired(db=db, now=datetime.now())
+    finally:
+        db.close()
+
+
+def main() -> None:
+    logger.info("Removing expired upload sessions")
+    removed = cleanup()
+    logger.info(f"{removed} expired upload sessions removed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import asyncio
+import json
+import re
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Tuple
+
+from app.core.config import settings
+
+
+class AdmissionRejected(Exception):
+    pass
+
+
+class AdmissionController:
+    """
+    Limit the requests handled at the same time by a worker and the bytes they carry.
+    Requests over the limits wait in a bounded queue, in their order of arrival,
+    and are rejected when the queue is full or when they waited for too long.
+    """
+
+    def __init__(
+        self, *, max_concurrent: int, max_inflight_bytes: int, max_queue: int, queue_timeout: float
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_inflight_bytes = max_inflight_bytes
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.inflight_bytes = 0
+        self._waiters: Deque[Tuple[int, 'asyncio.Future[None]']] = deque()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.wait_seconds = 0.0
+
+    def _can_admit(self, nbytes: int) -> bool:
+        # a request larger than the limit is admitted alone
+        return self.active < self.max_concurrent and \
+            (self.active == 0 or self.inflight_bytes + nbytes <= self.max_inflight_bytes)
+
+    def _take(self, nbytes: int) -> None:
+        self.active += 1
+        self.inflight_bytes += nbytes
+        self.admitted += 1
+
+    def _wake(self) -> None:
+        while self._waiters:
+            nbytes, future = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            if not self._can_admit(nbytes):
+                return
+            self._waiters.popleft()
+            self._take(nbytes)
+            future.set_result(None)
+
+    async def acquire(self, nbytes: int) -> None:
+        if not self._waiters and self._can_admit(nbytes):
+            self._take(nbytes)
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected_full += 1
+            raise AdmissionRejected()
+
+        future = asyncio.get_event_loop().create_future()
+        self._waiters.append((nbytes, future))
+        self.queued += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected_timeout += 1
+            raise AdmissionRejected()
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(nbytes)
+            raise
+        finally:
+            self.wait_seconds += time.monotonic() - started
+            # the cancelled waiter may be at the head of the queue
+            self._wake()
+
+    def release(self, nbytes: int) -> None:
+        self.active -= 1
+        self.inflight_bytes -= nbytes
+        self._wake()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'active': self.active,
+            'inflight_bytes': self.inflight_bytes,
+            'waiting': sum(1 for _, future in self._waiters if not future.done()),
+            'admitted': self.admitted,
+            'queued': self.queued,
+            'rejected_full': self.rejected_full,
+            'rejected_timeout': self.rejected_timeout,
+            'wait_seconds': round(self.wait_seconds, 3),
+            'max_concurrent': self.max_concurrent,
+            'max_inflight_bytes': self.max_inflight_bytes,
+            'max_queue': self.max_queue,
+        }
+
+
+class AdmissionMiddleware:
+    """
+    Admit the requests of the given paths before their body is read,
+    the size of a request is its Content-Length or default_bytes without it
+    """
+
+    def __init__(
+        self, app: Callable, *, controller: AdmissionController, methods: Tuple[str, ...],
+        path_regex: str, default_bytes: int, retry_after: int
+    ):
+        self.app = app
+        self.controller = controller
+        self.methods = methods
+        self.path_regex = re.compile(path_regex)
+        self.default_bytes = default_bytes
+        self.retry_after = retry_after
+
+    async def __call__(self, scope: Dict, receive: Callable, send: Callable) -> None:
+        if scope['type'] != 'http' or scope['method'] not in self.methods \
+                or not self.path_regex.fullmatch(scope['path']):
+            await self.app(scope, receive, send)
+            return
+
+        nbytes = self._content_length(scope)
+        try:
+            await self.controller.acquire(nbytes)
+        except AdmissionRejected:
+            await self._reject(send)
+            return
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                self.controller.release(nbytes)
+
+        async def send_and_release(message: Dict) -> None:
+            await send(message)
+            # the background tasks of the response run after its last body message, not in the slot
+            if message['type'] == 'http.response.body' and not message.get('more_body', False):
+                release()
+
+        try:
+            await self.app(scope, receive, send_and_release)
+        finally:
+            release()
+
+    def _content_length(self, scope: Dict) -> int:
+        for name, value in scope['headers']:
+            if name == b'content-length' and value.isdigit():
+                return int(value)
+        return self.default_bytes
+
+    async def _reject(self, send: Callable) -> None:
+        body = json.dumps({'detail': 'Too many voices are being uploaded, please retry later'}).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': 503,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                (b'retry-after', str(self.retry_after).encode()),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+ingest_admission = AdmissionController(
+    max_concurrent=settings.VOICE_INGEST_MAX_CONCURRENT,
+    max_inflight_bytes=settings.VOICE_INGEST_MAX_INFLIGHT_MB * 10**6,
+    max_queue=settings.VOICE_INGEST_MAX_QUEUE,
+    queue_timeout=settings.VOICE_INGEST_QUEUE_TIMEOUT,
+)
+
+# creating voices and receiving upload chunks, not the small metadata requests
+INGEST_PATH_REGEX = settings.API_V1_STR + r'/voices(/|/stream|/batch|/uploads/[^/]+|/uploads/[^/]+/finalize)'
@@ -0,0 +1,36 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """
+    Values kept ttl seconds by a worker, the least recently set are evicted beyond max_size.
+    The endpoints run in a thread pool, the values are changed with a lock held.
+    """
+
+    def __init__(self, *, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._values: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            expires, value = self._values.get(key, (0.0, None))
+            if expires <= time.monotonic():
+                self._values.pop(key, None)
+                return None
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._values[key] = (time.monotonic() + self.ttl, value)
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
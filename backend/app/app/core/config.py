@@ -1,4 +1,5 @@
 import secrets
+from pathlib import Path
 from typing import Any, Dict, List, Optional, Union
 
 from pydantic import AnyUrl, AnyHttpUrl, BaseSettings, EmailStr, HttpUrl, PostgresDsn, validator
@@ -89,6 +90,41 @@ class Settings(BaseSettings):
     PUSHER_NOTIFICATION_SECRET_KEY: str
 
     FIREBASE_API_KEY: str
+
+    # Voices are stored under /app/storage by default
+    VOICE_STORAGE_DIR: str = str(Path(__file__).resolve().parents[2] / "storage")
+    VOICE_MAX_SIZE_MB: int = 20
+    VOICE_UPLOAD_CHUNK_SIZE: int = 64 * 1024
+    VOICE_UPLOAD_SESSION_EXPIRE_HOURS: int = 24
+    # voices are transcoded to opus after the upload when ffmpeg and ffprobe are installed
+    VOICE_TRANSCODE_ENABLED: bool = True
+    VOICE_TRANSCODE_BITRATE: str = "24k"
+    VOICE_TRANSCODE_CONCURRENCY: int = 2
+    VOICE_TRANSCODE_TIMEOUT: int = 300
+    VOICE_PEAKS_PER_SECOND: int = 20
+    # voices whose note is validated for this long are archived by archive_voices.py
+    VOICE_ARCHIVE_AFTER_DAYS: int = 90
+    VOICE_COLD_STORAGE_DIR: Optional[str] = None
+    VOICE_REHYDRATED_CACHE_MB: int = 500
+    # "local" or "s3"
+    VOICE_STORAGE_BACKEND: str = "local"
+    S3_ENDPOINT_URL: Optional[str] = None
+    S3_BUCKET: Optional[str] = None
+    S3_REGION: Optional[str] = None
+    S3_ACCESS_KEY_ID: Optional[str] = None
+    S3_SECRET_ACCESS_KEY: Optional[str] = None
+    S3_MAX_POOL_CONNECTIONS: int = 20
+    # uploads handled at once by a worker, the others wait in a bounded queue or get a 503
+    VOICE_INGEST_MAX_CONCURRENT: int = 8
+    VOICE_INGEST_MAX_INFLIGHT_MB: int = 100
+    VOICE_INGEST_MAX_QUEUE: int = 32
+    VOICE_INGEST_QUEUE_TIMEOUT: float = 10
+    VOICE_INGEST_RETRY_AFTER: int = 5
+    # trigram similarity of the names above which a new patient born the same day is a duplicate
+    PATIENT_DUPLICATE_SIMILARITY: float = 0.6
+    # seconds the dashboard counts of a user are kept by a worker
+    STATS_CACHE_TTL: float = 10
+    STATS_CACHE_MAX_USERS: int = 10000
     
     class Config:
         case_sensitive = True
@@ -2,6 +2,9 @@ from .crud_item import item
 from .crud_user import user
 from .crud_voice import voice
 from .crud_note import note
+from .crud_upload_session import upload_session
+from .crud_pending_work import pending_work
+from .crud_scope_counter import scope_counter
 
 # For a new basic set of CRUD operations you could just do
 
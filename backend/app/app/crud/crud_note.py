@@ -1,10 +1,13 @@
-from typing import List, Optional, Any, Dict, Optional, Union
+from typing import Iterator, List, Optional, Any, Dict, Optional, Tuple, Union
 
 from fastapi.encoders import jsonable_encoder
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Query, Session
 
 from app.crud.base import CRUDBase
-from app.models.note import Note
+from app.crud.crud_scope_counter import ASSISTANT, DOCTOR, PATIENT, note_status, scope_counter
+from app.crud.crud_user import full_name_contains
+from app.crud.pagination import Page, decode_cursor, decode_ranked_cursor, encode_cursor, encode_ranked_cursor, paginate
+from app.models.note import TEXT_SEARCH_CONFIG, Note
 from app.models.remarque_note import RemarqueNote
 from app.models.voice import Voice
 from app.models.user import User
@@ -17,7 +20,16 @@ from app.schemas.note import NoteCreate, NoteUpdate, NotePlus
 from app.schemas.user_doctor import Doctor
 from app.schemas.user_patient import Patient
 
-from sqlalchemy import inspect, and_, or_, not_
+from sqlalchemy import inspect, and_, or_, not_, bindparam, func, select, union, cast, tuple_, Float
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+# up to two fragments of the matched text, the matches are surrounded by <b></b>
+SNIPPET_OPTIONS = 'MaxFragments=2, MaxWords=20, MinWords=8, FragmentDelimiter=" ... "'
+
+MANAGER = 'manager'
+
+# the listings by role and permutation of validated and treated, built once without a session
+note_listings: Dict[Tuple[str, bool, Optional[bool]], Query] = {}
 
 
 class CRUDNote(CRUDBase[Note, NoteCreate, NoteUpdate]):
@@ -27,6 +39,8 @@ class CRUDNote(CRUDBase[Note, NoteCreate, NoteUpdate]):
         obj_in_data = jsonable_encoder(obj_in)
         db_obj = self.model(**obj_in_data, date_creation = date_creation)
         db.add(db_obj)
+        db.flush()
+        scope_counter.add(db, cells=scope_counter.note_cells(db, note=db_obj))
         db.commit()
         db.refresh(db_obj)
         return db_obj
@@ -38,7 +52,19 @@ class CRUDNote(CRUDBase[Note, NoteCreate, NoteUpdate]):
             update_data = obj_in
         else:
             update_data = obj_in.dict(exclude_unset=True)
-        return super().update(db, db_obj=db_obj, obj_in=update_data)
+        if not update_data.keys() & {'validated', 'modifier_id', 'assistant_id', 'voice_id'}:
+            return super().update(db, db_obj=db_obj, obj_in=update_data)
+        # the counters change in the same transaction
+        previous_cells = scope_counter.note_cells(db, note=db_obj)
+        for field in db_obj.__table__.columns:
+            if field.name in update_data:
+                setattr(db_obj, field.name, update_data[field.name])
+        db.add(db_obj)
+        db.flush()
+        scope_counter.change(db, before=previous_cells, after=scope_counter.note_cells(db, note=db_obj))
+        db.commit()
+        db.refresh(db_obj)
+        return db_obj
     
     def get_all(
         self, db: Session
@@ -58,7 +84,15 @@ class CRUDNote(CRUDBase[Note, NoteCreate, NoteUpdate]):
     def search_note(
         self, db: Session, *, user_idx: List[int], content_text: Optional[str]='', \
         date_creation_before: Optional[datetime]='', date_creation_after: Optional[datetime]='',\
-        patient_name: Optional[str]='', validated: Optional[bool]=None, treated: Optional[bool]=None) -> Any:
+        patient_name: Optional[str]='', validated: Optional[bool]=None, treated: Optional[bool]=None,
+        skip: int=0, limit: int=100, cursor: Optional[str]=None) -> Any:
+        """
+        The voices and their note matching content_text, a web search syntax query
+        ("quoted phrases", or, -excluded words) on the note content and the voice title.
+        The best ranked come first, then the most recent, with a snippet of the matched text.
+        Without content_text the most recent come first.
+        With a cursor, made by search_next_cursor, the page starts after the row it was made from.
+        """
 
         if date_creation_before == '':
             date_creation_before = datetime.now().strftime('%Y-%m-%d %H:%M:%S') 
@@ -79,25 +113,23 @@ class CRUDNote(CRUDBase[Note, NoteCreate, NoteUpdate]):
             .join(User, Voice.patient_id == User.id))
 
         # user id condition and patient name
-        sub_filter_condition_1 = or_(Voice.doctor_id.in_(user_idx),
-                            Note.modifier_id.in_(user_idx),
-                            Note.assistant_id.in_(user_idx))
+        if all_elements:
+            sub_filter_condition_1 = True
+        else:
+            sub_filter_condition_1 = or_(Voice.doctor_id.in_(user_idx),
+                                Note.modifier_id.in_(user_idx),
+                                Note.assistant_id.in_(user_idx))
         
 
         filter_condition_1 = and_(sub_filter_condition_1, 
-                        User.full_name.ilike('%'+patient_name+'%'))
+                        full_name_contains(patient_name) if patient_name else True)
         
-        # date and content condition
-        sub_filter_condition = or_(
+        # date condition
+        filter_condition_2 = or_(
                             Note.date_creation.between(date_creation_after, date_creation_before), 
                             Voice.date_creation.between(date_creation_after, date_creation_before)
                             )
 
-        sub_filter_condition_0 = or_(Note.content_txt.ilike('%'+content_text+'%'), 
-                    Voice.title.ilike('%'+content_text+'%'))
-
-        filter_condition_2 = and_(sub_filter_condition_0, sub_filter_condition)
-
         # Treated and validated condition
         if treated == False:
             sub_filter_condition_3 = Note.modifier_id.is_(None)
@@ -118,98 +150,112 @@ class CRUDNote(CRUDBase[Note, NoteCreate, NoteUpdate]):
         filter_condition = and_(filter_condition_1, filter_condition_2)
         filter_condition = and_(filter_condition_3, filter_condition)
 
-        results = (table
-            .filter(filter_condition)
-            .all())
-        
-        return results
-
-
-    def get_multi_by_doctor_id(self, db: Session, *, doctor_id: int, validated: Optional[bool]=None, treated: Optional[bool]=None, skip: int=0, limit: int = 5) -> List[Note]:
-        
-        if type(validated) is bool and treated == True:
-            return (
-            db.query(self.model)
-            .join(Voice, Note.voice_id == Voice.id)
-            .filter(Voice.doctor_id == doctor_id, Note.validated == validated, Note.modifier_id.is_not(None))
-            .offset(skip).limit(limit)
-            .all())
-
-        elif type(validated) is bool and treated == False:
-            return (
-            db.query(self.model)
-            .join(Voice, Note.voice_id == Voice.id)
-            .filter(Voice.doctor_id == doctor_id, Note.validated == validated, Note.modifier_id.is_(None))
-            .offset(skip).limit(limit)
-            .all())
-        elif type(validated) is bool:
-            return (
-            db.query(self.model)
-            .join(Voice, Note.voice_id == Voice.id)
-            .filter(Voice.doctor_id == doctor_id, Note.validated == validated)
-            .offset(skip).limit(limit)
-            .all())
-        elif treated == True:
-            return (
-            db.query(self.model)
-            .join(Voice, Note.voice_id == Voice.id)
-            .filter(Voice.doctor_id == doctor_id, Note.modifier_id.is_not(None))
-            .offset(skip).limit(limit)
-            .all())
-        elif treated == False:
-            return (
-            db.query(self.model)
-            .join(Voice, Note.voice_id == Voice.id)
-            .filter(Voice.doctor_id == doctor_id, Note.modifier_id.is_(None))
-            .offset(skip).limit(limit)
-            .all())
+        table = table.filter(filter_condition)
+        if not content_text or not content_text.strip():
+            table = table.order_by(Voice.date_creation.desc(), Voice.id.desc())
+            if cursor is not None:
+                date_creation, id = decode_cursor(cursor)
+                table = table.filter(tuple_(Voice.date_creation, Voice.id) < tuple_(date_creation, id))
+            else:
+                table = table.offset(skip)
+            return table.limit(limit).all()
+
+        query = func.websearch_to_tsquery(TEXT_SEARCH_CONFIG, content_text)
+        # each side of the union is matched on its own GIN index
+        matching_voices = union(
+            select(Note.voice_id).where(Note.search_vector.op('@@')(query)),
+            select(Voice.id).where(Voice.search_vector.op('@@')(query)))
+        search_vector = Voice.search_vector.op('||')(
+            func.coalesce(Note.search_vector, cast('', TSVECTOR)))
+        # as a double precision the rank of a cursor compares equal to the one of its row
+        rank = cast(func.ts_rank(search_vector, query), Float)
+        table = (table
+            .add_columns(rank.label('rank'))
+            .filter(Voice.id.in_(select(matching_voices.subquery())))
+            .order_by(rank.desc(), Voice.date_creation.desc(), Voice.id.desc()))
+        if cursor is not None:
+            rank_value, date_creation, id = decode_ranked_cursor(cursor)
+            table = table.filter(
+                tuple_(rank, Voice.date_creation, Voice.id) < tuple_(rank_value, date_creation, id))
         else:
-            return (
-                db.query(self.model)
-                .join(Voice, Note.voice_id == Voice.id)
-                .filter(Voice.doctor_id == doctor_id)
-                .offset(skip).limit(limit)
-                .all())
-    
-    def get_multi_by_doctor_id_count(self, db: Session, *, doctor_id: int, validated: Optional[bool]=None, treated: Optional[bool]=None) -> List[Note]:
-        if type(validated) is bool and treated == True:
-            return (
-            db.query(self.model)
-            .join(Voice, Note.voice_id == Voice.id)
-            .filter(Voice.doctor_id == doctor_id, Note.validated == validated, Note.modifier_id.is_not(None))
-            .count())
+            table = table.offset(skip)
+        # the snippets are only made for the rows of the page
+        page = table.limit(limit).subquery()
+        return (db.query(page, func.ts_headline(TEXT_SEARCH_CONFIG,
+                func.coalesce(page.c.content_txt, page.c.title, ''), query, SNIPPET_OPTIONS).label('snippet'))
+            .order_by(page.c.rank.desc(), page.c.date_creation.desc(), page.c.voice_id.desc())
+            .all())
 
-        elif type(validated) is bool and treated == False:
-            return (
-            db.query(self.model)
-            .join(Voice, Note.voice_id == Voice.id)
-            .filter(Voice.doctor_id == doctor_id, Note.validated == validated, Note.modifier_id.is_(None))
-            .count())
-        elif type(validated) is bool:
-            return (
-            db.query(self.model)
-            .join(Voice, Note.voice_id == Voice.id)
-            .filter(Voice.doctor_id == doctor_id, Note.validated == validated)
-            .count())
-        elif treated == True:
-            return (
-            db.query(self.model)
-            .join(Voice, Note.voice_id == Voice.id)
-            .filter(Voice.doctor_id == doctor_id, Note.modifier_id.is_not(None))
-            .count())
+    def search_next_cursor(self, results: List[Any], limit: int) -> Optional[str]:
+        """
+        Cursor of the search page following a full page, None after the last page
+        """
+        if not results or len(results) < limit:
+            return None
+        last = results[-1]
+        if last._mapping.get('rank') is None:
+            return encode_cursor(last.date_creation, last.voice_id)
+        return encode_ranked_cursor(last.rank, last.date_creation, last.voice_id)
+
+    def iter_search_note_pages(self, db: Session, *, batch_size: int=500, **filters: Any) -> Iterator[List[Any]]:
+        """
+        All the results of search_note, by pages of batch_size.
+        The transaction is ended after each page so that a long export does not keep it open.
+        """
+        cursor = None
+        while True:
+            results = self.search_note(db, **filters, limit=batch_size, cursor=cursor)
+            db.rollback()
+            if results:
+                yield results
+            cursor = self.search_next_cursor(results, batch_size)
+            if cursor is None:
+                return
+
+
+    def get_multi_by_doctor_id(self, db: Session, *, doctor_id: int, validated: Optional[bool]=None, treated: Optional[bool]=None, skip: int=0, limit: int = 5, cursor: Optional[str]=None, with_total: bool=False) -> Union[List[Note], Page]:
+        query = self._listing(db, role=DOCTOR, user_id=doctor_id, validated=validated, treated=treated)
+        return paginate(query, Note, skip=skip, limit=limit, cursor=cursor, with_total=with_total)
+
+    def _listing(
+        self, db: Session, *, role: str, user_id: int, validated: Optional[bool], treated: Optional[bool]
+    ) -> Query:
+        """
+        The notes the user sees through their role. The query is built once per role and permutation
+        of the filters, each call copies it with its session and binds the user id and validated.
+        """
+        key = (role, type(validated) is bool, treated if type(treated) is bool else None)
+        listing = note_listings.get(key)
+        if listing is None:
+            listing = Query(self.model)
+            if role == DOCTOR:
+                listing = listing.join(Voice, Note.voice_id == Voice.id).filter(Voice.doctor_id == bindparam('user_id'))
+            elif role == PATIENT:
+                listing = listing.join(Voice, Voice.id == Note.voice_id).filter(Voice.patient_id == bindparam('user_id'))
+            elif role == MANAGER:
+                listing = (listing
+                    .join(AssistantManager, AssistantManager.assistant_id == Note.assistant_id)
+                    .filter(AssistantManager.manager_id == bindparam('user_id')))
+            else:
+                listing = listing.filter(Note.assistant_id == bindparam('user_id'))
+            listing = note_listings[key] = self._filter_validated_treated(listing, validated=validated, treated=treated)
+        return listing.with_session(db).params(user_id=user_id, validated=validated)
+
+    def _filter_validated_treated(self, query: Any, *, validated: Optional[bool], treated: Optional[bool]) -> Any:
+        """
+        Treated notes are the ones modified by the doctor
+        """
+        if type(validated) is bool:
+            query = query.filter(Note.validated == bindparam('validated'))
+        if treated == True:
+            query = query.filter(Note.modifier_id.is_not(None))
         elif treated == False:
-            return (
-            db.query(self.model)
-            .join(Voice, Note.voice_id == Voice.id)
-            .filter(Voice.doctor_id == doctor_id, Note.modifier_id.is_(None))
-            .count())
-        else:
-            return (
-                db.query(self.model)
-                .join(Voice, Note.voice_id == Voice.id)
-                .filter(Voice.doctor_id == doctor_id)
-                .count())
+            query = query.filter(Note.modifier_id.is_(None))
+        return query
 
+    def get_multi_by_doctor_id_count(self, db: Session, *, doctor_id: int, validated: Optional[bool]=None, treated: Optional[bool]=None) -> int:
+        return scope_counter.get(db, scope=DOCTOR, scope_id=doctor_id, status=note_status(validated, treated))
+    
     def get_by_note_id(
         self, db: Session, *, id: int
     ) -> Note:
@@ -257,11 +303,10 @@ class CRUDNote(CRUDBase[Note, NoteCreate, NoteUpdate]):
         )
     
     def get_remarques_by_note_id(
-        self, db: Session, *, id: int, skip: int = 0, limit: int = 20
+        self, db: Session, *, id: int, skip: int = 0, limit: int = 20, cursor: Optional[str] = None
     ) -> List[RemarqueNote]:
-        remarques = db.query(RemarqueNote).filter(RemarqueNote.note_id == id)\
-        .order_by(RemarqueNote.date_creation.desc())\
-        .offset(skip).limit(limit).all()
+        remarques = paginate(db.query(RemarqueNote).filter(RemarqueNote.note_id == id),
+            RemarqueNote, skip=skip, limit=limit, cursor=cursor)
         return remarques
     
     def create_remarque_note(
@@ -292,146 +337,67 @@ class CRUDNote(CRUDBase[Note, NoteCreate, NoteUpdate]):
             .filter(Note.voice_id == id)
             .all()
         )
-    
-    def get_multi_by_manager(
-        self, db: Session, *, manager_id: int, validated: Optional[bool]=None, skip: int=0, limit: int = 5
+
+    def get_multi_by_voice_ids(
+        self, db: Session, *, voice_ids: List[int]
     ) -> List[Note]:
+        return (
+            db.query(self.model)
+            .filter(Note.voice_id.in_(voice_ids))
+            .all()
+        )
 
-        
-        if type(validated) is bool:
-            return (db.query(self.model)
-            .join(AssistantManager, AssistantManager.assistant_id == Note.assistant_id)
-            .filter(AssistantManager.manager_id == manager_id, Note.validated==validated)
-            .offset(skip).limit(limit)
-            .all()) 
-        return (db.query(self.model)
-            .join(AssistantManager, AssistantManager.assistant_id == Note.assistant_id)
-            .filter(AssistantManager.manager_id == manager_id)
-            .offset(skip).limit(limit)
-            .all())
+    def get_remarques_by_note_ids(
+        self, db: Session, *, note_ids: List[int]
+    ) -> List[RemarqueNote]:
+        return (
+            db.query(RemarqueNote)
+            .filter(RemarqueNote.note_id.in_(note_ids))
+            .order_by(RemarqueNote.date_creation)
+            .all()
+        )
+    
+    def get_multi_by_manager(
+        self, db: Session, *, manager_id: int, validated: Optional[bool]=None, skip: int=0, limit: int = 5,
+        cursor: Optional[str]=None, with_total: bool=False
+    ) -> Union[List[Note], Page]:
+        query = self._listing(db, role=MANAGER, user_id=manager_id, validated=validated, treated=None)
+        return paginate(query, Note, skip=skip, limit=limit, cursor=cursor, with_total=with_total)
     
     def get_multi_by_manager_count(
         self, db: Session, *, manager_id: int, validated: Optional[bool]=None
     ) -> int:
-        if type(validated) is bool:
-            return (db.query(self.model)
-            .join(AssistantManager, AssistantManager.assistant_id == Note.assistant_id)
-            .filter(AssistantManager.manager_id == manager_id, Note.validated==validated)
-            .count())
-        if type(validated) is bool:
-            return (db.query(self.model)
-            .join(AssistantManager, AssistantManager.assistant_id == Note.assistant_id)
-            .filter(AssistantManager.manager_id == manager_id, Note.validated==validated)
-            .count())
-        return (db.query(self.model)
-            .join(AssistantManager, AssistantManager.assistant_id == Note.assistant_id)
-            .filter(AssistantManager.manager_id == manager_id)
-            .count())
+        assistant_ids = select(AssistantManager.assistant_id).where(AssistantManager.manager_id == manager_id)
+        return scope_counter.get_sum(db, scope=ASSISTANT, status=note_status(validated, None),
+            scope_ids=assistant_ids)
     
     def get_multi_by_assistant(
-        self, db: Session, *, assistant_id: int, validated: Optional[bool]=None, treated: Optional[bool]=None, skip: int=0, limit: int = 5
-    ) -> List[Note]:
-        if type(validated) is bool and treated == True:
-            return (
-            db.query(self.model)
-            .filter(Note.assistant_id==assistant_id, Note.validated==validated, Note.modifier_id.is_not(None))
-            .offset(skip).limit(limit)
-            .all())
-        elif type(validated) is bool and treated == False:
-            return (
-            db.query(self.model)
-            .filter(Note.assistant_id==assistant_id, Note.validated==validated, Note.modifier_id.is_(None))
-            .offset(skip).limit(limit)
-            .all())
-        elif type(validated) is bool:
-            return (
-            db.query(self.model)
-            .filter(Note.assistant_id==assistant_id, Note.validated==validated)
-            .offset(skip).limit(limit)
-            .all())
-        elif treated == True:
-            return (
-            db.query(self.model)
-            .filter(Note.assistant_id==assistant_id, Note.modifier_id.is_not(None))
-            .offset(skip).limit(limit)
-            .all())
-        elif treated == False:
-            return (
-            db.query(self.model)
-            .filter(Note.assistant_id==assistant_id, Note.modifier_id.is_(None))
-            .offset(skip).limit(limit)
-            .all())
-        else:
-            return (
-                db.query(self.model)
-                .filter(Note.assistant_id==assistant_id)
-                .offset(skip).limit(limit)
-                .all())
+        self, db: Session, *, assistant_id: int, validated: Optional[bool]=None, treated: Optional[bool]=None, skip: int=0, limit: int = 5,
+        cursor: Optional[str]=None, with_total: bool=False
+    ) -> Union[List[Note], Page]:
+        query = self._listing(db, role=ASSISTANT, user_id=assistant_id, validated=validated, treated=treated)
+        return paginate(query, Note, skip=skip, limit=limit, cursor=cursor, with_total=with_total)
     
     def get_multi_by_assistant_count(
         self, db: Session, *, assistant_id: int, validated: Optional[bool]=None, treated: Optional[bool]=None
     ) -> int:
-        if type(validated) is bool and treated == True:
-            return (db.query(self.model)
-            .filter(Note.assistant_id==assistant_id, Note.validated==validated, Note.modifier_id.is_not(None))
-            .count())
-        elif type(validated) is bool and treated == False:
-            return (db.query(self.model)
-            .filter(Note.assistant_id==assistant_id, Note.validated==validated, Note.modifier_id.is_(None))
-            .count())
-        elif type(validated) is bool:
-            return (db.query(self.model)
-            .filter(Note.assistant_id==assistant_id, Note.validated==validated)
-            .count())
-        elif treated == True:
-            return (
-            db.query(self.model)
-            .filter(Note.assistant_id==assistant_id, Note.modifier_id.is_not(None))
-            .count())
-        elif treated == False:
-            return (
-            db.query(self.model)
-            .filter(Note.assistant_id==assistant_id, Note.modifier_id.is_(None))
-            .count())
-        else:
-            return (db.query(self.model)
-                .filter(Note.assistant_id==assistant_id)
-                .count())
+        return scope_counter.get(db, scope=ASSISTANT, scope_id=assistant_id, status=note_status(validated, treated))
     
     def get_multi_by_patient(
-        self, db: Session, *, patient_id: int, validated: Optional[bool]=None, skip: int=0, limit: int = 5
-    ) -> List[Note]:
-        if type(validated) is bool:
-            return (
-            db.query(self.model)
-            .join(Voice, Voice.id == Note.voice_id)
-            .filter(Voice.patient_id==patient_id, Note.validated==validated)
-            .offset(skip).limit(limit)
-            .all())
-        return (
-            db.query(self.model)
-            .join(Voice, Voice.id == Note.voice_id)
-            .filter(Voice.patient_id==patient_id)
-            .offset(skip).limit(limit)
-            .all())
+        self, db: Session, *, patient_id: int, validated: Optional[bool]=None, skip: int=0, limit: int = 5,
+        cursor: Optional[str]=None, with_total: bool=False
+    ) -> Union[List[Note], Page]:
+        query = self._listing(db, role=PATIENT, user_id=patient_id, validated=validated, treated=None)
+        return paginate(query, Note, skip=skip, limit=limit, cursor=cursor, with_total=with_total)
     
     def get_multi_by_patient_count(
         self, db: Session, *, patient_id: int, validated: Optional[bool]=None
     ) -> int:
-        if type(validated) is bool:
-            return (
-            db.query(self.model)
-            .join(Voice, Voice.id == Note.voice_id)
-            .filter(Voice.patient_id==patient_id, Note.validated==validated)
-            .count())
-        return (
-            db.query(self.model)
-            .join(Voice, Voice.id == Note.voice_id)
-            .filter(Voice.patient_id==patient_id)
-            .count())
+        return scope_counter.get(db, scope=PATIENT, scope_id=patient_id, status=note_status(validated, None))
         
     def remove(self, db: Session, *, id: int) -> Note:
         obj = db.query(self.model).get(id)
+        scope_counter.subtract(db, cells=scope_counter.note_cells(db, note=obj))
         db.delete(obj)
         db.commit()
         return obj
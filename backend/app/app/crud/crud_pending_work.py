@@ -0,0 +1,105 @@
+from typing import Any, Iterable, List, Optional
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.models.assistant_manager import AssistantManager
+from app.models.doctor_manager import DoctorManager
+from app.models.pending_work import PendingWork
+from app.models.voice import Voice
+
+# key spaces of the advisory locks
+DOCTOR_LOCK = 1
+MANAGER_LOCK = 2
+
+
+class CRUDPendingWork:
+    """
+    The voices without note of the doctors an assistant works for, one row per assistant and voice.
+    The rows of the voices of a doctor are only changed with the lock of the doctor held,
+    the ones depending on the relationships of a manager with the lock of the manager held first.
+    None of the methods commits, the rows change in the transaction of the voice or relationship.
+    """
+
+    def __init__(self, model: Any):
+        self.model = model
+
+    def lock_doctors(self, db: Session, *, doctor_ids: Iterable[int]) -> None:
+        # in ascending order, two transactions can not wait for each other
+        for doctor_id in sorted(set(doctor_ids)):
+            db.execute(text('SELECT pg_advisory_xact_lock(:space, :id)'), {'space': DOCTOR_LOCK, 'id': doctor_id})
+
+    def lock_manager(self, db: Session, *, manager_id: int) -> None:
+        db.execute(text('SELECT pg_advisory_xact_lock(:space, :id)'), {'space': MANAGER_LOCK, 'id': manager_id})
+
+    def _insert_pending(self, db: Session, *conditions: Any) -> None:
+        """
+        Insert the rows of the voices without note matching conditions
+        """
+        pending = (
+            select(AssistantManager.assistant_id, Voice.id, Voice.doctor_id, Voice.date_creation)
+            .select_from(Voice)
+            .join(DoctorManager, DoctorManager.doctor_id == Voice.doctor_id)
+            .join(AssistantManager, AssistantManager.manager_id == DoctorManager.manager_id)
+            .where(Voice.note_created == False, *conditions)
+            .distinct())
+        db.execute(insert(PendingWork)
+            .from_select(['assistant_id', 'voice_id', 'doctor_id', 'date_creation'], pending)
+            .on_conflict_do_nothing())
+
+    def add_voices(self, db: Session, *, voices: List[Voice]) -> None:
+        """
+        Add the new voices, they must be flushed
+        """
+        if not voices:
+            return
+        self.lock_doctors(db, doctor_ids=[voice.doctor_id for voice in voices])
+        self._insert_pending(db, Voice.id.in_([voice.id for voice in voices]))
+
+    def sync_voice(self, db: Session, *, voice: Voice, previous_doctor_id: Optional[int] = None) -> None:
+        """
+        Update the rows of a flushed voice whose note_created or doctor changed
+        """
+        self.lock_doctors(db, doctor_ids=[voice.doctor_id, previous_doctor_id or voice.doctor_id])
+        db.query(PendingWork).filter(PendingWork.voice_id == voice.id).delete(synchronize_session=False)
+        self._insert_pending(db, Voice.id == voice.id)
+
+    def lock_voice(self, db: Session, *, voice: Voice) -> None:
+        """
+        Lock the rows of a voice about to be deleted, they are deleted with it
+        """
+        self.lock_doctors(db, doctor_ids=[voice.doctor_id])
+
+    def _rebuild(self, db: Session, *, doctor_ids: List[int], assistant_id: Optional[int] = None) -> None:
+        query = db.query(PendingWork).filter(PendingWork.doctor_id.in_(doctor_ids))
+        conditions = [Voice.doctor_id.in_(doctor_ids)]
+        if assistant_id is not None:
+            query = query.filter(PendingWork.assistant_id == assistant_id)
+            conditions.append(AssistantManager.assistant_id == assistant_id)
+        query.delete(synchronize_session=False)
+        self._insert_pending(db, *conditions)
+
+    def refresh_doctor_manager(self, db: Session, *, doctor_id: int, manager_id: int) -> None:
+        """
+        Rebuild the rows of the doctor after a flushed change of a doctor manager relationship
+        """
+        self.lock_manager(db, manager_id=manager_id)
+        self.lock_doctors(db, doctor_ids=[doctor_id])
+        self._rebuild(db, doctor_ids=[doctor_id])
+
+    def refresh_assistant_manager(self, db: Session, *, assistant_id: int, manager_id: int) -> None:
+        """
+        Rebuild the rows of the assistant for the doctors of the manager
+        after a flushed change of an assistant manager relationship
+        """
+        self.lock_manager(db, manager_id=manager_id)
+        doctor_ids = [doctor_id for doctor_id, in db.query(DoctorManager.doctor_id)
+            .filter(DoctorManager.manager_id == manager_id).distinct()]
+        if not doctor_ids:
+            return
+        self.lock_doctors(db, doctor_ids=doctor_ids)
+        self._rebuild(db, doctor_ids=doctor_ids, assistant_id=assistant_id)
+
+
+pending_work = CRUDPendingWork(PendingWork)
@@ -0,0 +1,260 @@
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import and_, func, lambda_stmt, literal, select, text, union_all
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.models.assistant_manager import AssistantManager
+from app.models.doctor_manager import DoctorManager
+from app.models.note import Note
+from app.models.scope_counter import ScopeCounter
+from app.models.voice import Voice
+
+# the role of the user a cell counts for
+DOCTOR = 'doctor'
+PATIENT = 'patient'
+ASSISTANT = 'assistant'
+SCOPES = (DOCTOR, PATIENT, ASSISTANT)
+
+
+def voice_status(note_created: Optional[bool]) -> str:
+    """
+    Status of the cell counting the voices with note_created, all of them when it is None
+    """
+    if type(note_created) is bool:
+        return f'voice:note_created={str(note_created).lower()}'
+    return 'voice'
+
+
+def note_status(validated: Optional[bool], treated: Optional[bool]) -> str:
+    """
+    Status of the cell counting the notes validated and treated, a None filter counts all of them
+    """
+    filters = [f'{name}={str(value).lower()}' for name, value in (('validated', validated), ('treated', treated))
+        if type(value) is bool]
+    return ':'.join(['note', ','.join(filters)]) if filters else 'note'
+
+
+def voice_statuses(note_created: Optional[bool]) -> List[str]:
+    """
+    The cells a voice is counted in, as the listings filtering note_created a NULL matches no filter
+    """
+    return [voice_status(value) for value in {None, note_created}]
+
+
+def note_statuses(validated: Optional[bool], treated: bool) -> List[str]:
+    return [note_status(validated_value, treated_value)
+        for validated_value in {None, validated} for treated_value in (None, treated)]
+
+
+# the roles with a dashboard of their own
+STATS_ROLES = ('doctor', 'patient', 'manager', 'assistant')
+
+# the counts of the dashboard and the status of their cells
+VOICE_STATS = {
+    'voices': voice_status(None),
+    'voices_with_note': voice_status(True),
+    'voices_without_note': voice_status(False),
+}
+NOTE_STATS = {
+    'notes': note_status(None, None),
+    'notes_validated': note_status(True, None),
+    'notes_not_validated': note_status(False, None),
+    'notes_treated': note_status(None, True),
+    'notes_not_treated': note_status(None, False),
+}
+
+
+class CRUDScopeCounter:
+    """
+    The counts of the voice and note listings of a doctor, a patient or an assistant, one row per user
+    and status. The counts of a manager and of the voices of an assistant are sums over the cells of
+    the doctors or assistants they are related to, the relationships change no cell.
+    None of the write methods commits, the cells change in the transaction of the voice or note
+    and stay locked until it ends. The users of the cells are locked as well, a reconcile counting
+    them waits for the cells they are inserting.
+    """
+
+    def __init__(self, model: Any):
+        self.model = model
+
+    def voice_cells(self, *, voice: Voice) -> Counter:
+        cells: Counter = Counter()
+        for scope, scope_id in ((DOCTOR, voice.doctor_id), (PATIENT, voice.patient_id)):
+            if scope_id is not None:
+                cells.update((scope, scope_id, status) for status in voice_statuses(voice.note_created))
+        return cells
+
+    def voice_note_cells(self, db: Session, *, voice: Voice) -> Counter:
+        """
+        The cells counting the notes of the voice, they move with its doctor and patient
+        """
+        cells: Counter = Counter()
+        for note in db.query(Note).filter(Note.voice_id == voice.id):
+            cells.update(self._note_cells(note, doctor_id=voice.doctor_id, patient_id=voice.patient_id))
+        return cells
+
+    def note_cells(self, db: Session, *, note: Note) -> Counter:
+        """
+        The cells counting the note, its doctor and patient are the ones of its voice
+        """
+        voice = db.query(Voice.doctor_id, Voice.patient_id).filter(Voice.id == note.voice_id).first()
+        return self._note_cells(note, doctor_id=voice and voice.doctor_id, patient_id=voice and voice.patient_id)
+
+    def _note_cells(self, note: Note, *, doctor_id: Optional[int], patient_id: Optional[int]) -> Counter:
+        cells: Counter = Counter()
+        statuses = note_statuses(note.validated, note.modifier_id is not None)
+        for scope, scope_id in ((DOCTOR, doctor_id), (PATIENT, patient_id), (ASSISTANT, note.assistant_id)):
+            if scope_id is not None:
+                cells.update((scope, scope_id, status) for status in statuses)
+        return cells
+
+    def add(self, db: Session, *, cells: Counter) -> None:
+        self._apply(db, cells)
+
+    def subtract(self, db: Session, *, cells: Counter) -> None:
+        self._apply(db, Counter({cell: -count for cell, count in cells.items()}))
+
+    def change(self, db: Session, *, before: Counter, after: Counter) -> None:
+        """
+        Move the counts of a flushed change from the cells before it to the ones after it
+        """
+        cells = Counter(after)
+        cells.subtract(before)
+        self._apply(db, cells)
+
+    def _apply(self, db: Session, cells: Counter) -> None:
+        # in the order of the primary key, two transactions can not wait for each other
+        values = [{'scope': scope, 'scope_id': scope_id, 'status': status, 'count': count}
+            for (scope, scope_id, status), count in sorted(cells.items()) if count]
+        if not values:
+            return
+        users = sorted({(value['scope'], value['scope_id']) for value in values})
+        db.execute(
+            text("SELECT pg_advisory_xact_lock(hashtext('scopecounter:' || scope), scope_id) "
+                "FROM unnest(CAST(:scopes AS text[]), CAST(:scope_ids AS integer[])) WITH ORDINALITY "
+                "AS cell(scope, scope_id, position) ORDER BY position"),
+            {'scopes': [scope for scope, _ in users], 'scope_ids': [scope_id for _, scope_id in users]})
+        stmt = insert(self.model).values(values)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[self.model.scope, self.model.scope_id, self.model.status],
+            set_={'count': self.model.count + stmt.excluded.count}))
+
+    def get(self, db: Session, *, scope: str, scope_id: int, status: str) -> int:
+        # the counts of the listings read one cell, the lambda statement is built and compiled once
+        count = db.execute(lambda_stmt(lambda: select(ScopeCounter.count).where(
+            ScopeCounter.scope == scope, ScopeCounter.scope_id == scope_id, ScopeCounter.status == status))).scalar()
+        return count or 0
+
+    def get_sum(self, db: Session, *, scope: str, status: str, scope_ids: Any) -> int:
+        """
+        Sum of the cells of the users selected by scope_ids, a select of one column.
+        A user selected several times is counted as many times, as by a count over the same joins.
+        """
+        ids = scope_ids.subquery()
+        return (
+            db.query(func.coalesce(func.sum(self.model.count), 0))
+            .select_from(ids)
+            .join(self.model, and_(self.model.scope == scope, self.model.scope_id == list(ids.c)[0],
+                self.model.status == status))
+            .scalar())
+
+    def get_stats(self, db: Session, *, role: Optional[str], user_id: int) -> Dict[str, int]:
+        """
+        The counts of VOICE_STATS and NOTE_STATS of the voices and notes the user sees through their role,
+        in one statement summing the cells of the user or of the users they are related to.
+        A None role counts the voices and notes of all the doctors.
+        """
+        user = select(literal(user_id))
+        if role is None:
+            doctors = select(self.model.scope_id).where(self.model.scope == DOCTOR).distinct()
+            voice_scope, voice_ids, note_scope, note_ids = DOCTOR, doctors, DOCTOR, doctors
+        elif role == 'doctor':
+            voice_scope, voice_ids, note_scope, note_ids = DOCTOR, user, DOCTOR, user
+        elif role == 'patient':
+            voice_scope, voice_ids, note_scope, note_ids = PATIENT, user, PATIENT, user
+        elif role == 'manager':
+            voice_scope, voice_ids = DOCTOR, select(DoctorManager.doctor_id).where(DoctorManager.manager_id == user_id)
+            note_scope, note_ids = ASSISTANT, \
+                select(AssistantManager.assistant_id).where(AssistantManager.manager_id == user_id)
+        elif role == 'assistant':
+            # a doctor reached through several managers is counted once
+            voice_scope, voice_ids = DOCTOR, (
+                select(DoctorManager.doctor_id)
+                .join(AssistantManager, AssistantManager.manager_id == DoctorManager.manager_id)
+                .where(AssistantManager.assistant_id == user_id)
+                .distinct())
+            note_scope, note_ids = ASSISTANT, user
+        else:
+            raise ValueError(f"No stats for the role {role}")
+
+        # the cells the voices are counted from are told apart from the ones of the notes by kind,
+        # a doctor or a patient is related to themself twice
+        related = union_all(
+            select(literal('voice').label('kind'), literal(voice_scope).label('scope'),
+                voice_ids.subquery().c[0].label('scope_id')),
+            select(literal('note'), literal(note_scope), note_ids.subquery().c[0])).subquery()
+        counts = [
+            func.coalesce(func.sum(self.model.count).filter(
+                and_(related.c.kind == kind, self.model.status == status)), 0).label(name)
+            for kind, stats in (('voice', VOICE_STATS), ('note', NOTE_STATS)) for name, status in stats.items()]
+        return dict(
+            db.query(*counts)
+            .select_from(related)
+            .outerjoin(self.model, and_(self.model.scope == related.c.scope, self.model.scope_id == related.c.scope_id,
+                self.model.status.in_([*VOICE_STATS.values(), *NOTE_STATS.values()])))
+            .one()._asdict())
+
+    def count_cells(self, db: Session, *, scope: str, min_id: int, max_id: int) -> Counter:
+        """
+        The cells of the users of the scope with an id between min_id and max_id,
+        counted from the voices and the notes
+        """
+        cells: Counter = Counter()
+        voice_scope_id = {DOCTOR: Voice.doctor_id, PATIENT: Voice.patient_id}.get(scope)
+        if voice_scope_id is not None:
+            rows = (
+                db.query(voice_scope_id, Voice.note_created, func.count())
+                .filter(voice_scope_id.between(min_id, max_id))
+                .group_by(voice_scope_id, Voice.note_created))
+            for scope_id, note_created, count in rows:
+                for status in voice_statuses(note_created):
+                    cells[(scope, scope_id, status)] += count
+        note_scope_id = voice_scope_id if voice_scope_id is not None else Note.assistant_id
+        treated = Note.modifier_id.isnot(None)
+        rows = (
+            db.query(note_scope_id, Note.validated, treated, func.count())
+            .select_from(Note)
+            .outerjoin(Voice, Voice.id == Note.voice_id)
+            .filter(note_scope_id.between(min_id, max_id))
+            .group_by(note_scope_id, Note.validated, treated))
+        for scope_id, validated, is_treated, count in rows:
+            for status in note_statuses(validated, is_treated):
+                cells[(scope, scope_id, status)] += count
+        return cells
+
+    def reconcile(self, db: Session, *, scope: str, min_id: int, max_id: int) -> Counter:
+        """
+        Correct the cells of the users of the scope with an id between min_id and max_id, return the
+        corrections. The users and their cells are locked before the voices and notes are counted and
+        the corrections are added to the cells rather than set, the changes committed meanwhile are not lost.
+        """
+        # every id of the range, the cells a writer is about to insert are not read yet
+        db.execute(
+            text("SELECT pg_advisory_xact_lock(hashtext('scopecounter:' || :scope), scope_id) "
+                "FROM generate_series(CAST(:min_id AS integer), CAST(:max_id AS integer)) AS scope_id"),
+            {'scope': scope, 'min_id': min_id, 'max_id': max_id})
+        current = (
+            db.query(self.model.scope_id, self.model.status, self.model.count)
+            .filter(self.model.scope == scope, self.model.scope_id.between(min_id, max_id))
+            .with_for_update()
+            .all())
+        corrections = self.count_cells(db, scope=scope, min_id=min_id, max_id=max_id)
+        corrections.subtract({(scope, scope_id, status): count for scope_id, status, count in current})
+        corrections = Counter({cell: count for cell, count in corrections.items() if count})
+        self._apply(db, corrections)
+        return corrections
+
+
+scope_counter = CRUDScopeCounter(ScopeCounter)
@@ -0,0 +1,85 @@
+import os
+from typing import List, Optional, Set
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.orm import Session
+
+from app.crud.base import CRUDBase
+from app.models.upload_session import UploadSession
+
+from datetime import datetime
+from app.schemas.upload_session import UploadSessionCreate
+
+
+class CRUDUploadSession(CRUDBase[UploadSession, UploadSessionCreate, UploadSessionCreate]):
+    def create_with_doctor(
+        self, db: Session, *, obj_in: UploadSessionCreate, id: str, path: str,
+        date_creation: datetime, date_expiration: datetime
+    ) -> UploadSession:
+        obj_in_data = jsonable_encoder(obj_in)
+        db_obj = self.model(**obj_in_data, id=id, path=path, received=0,
+            date_creation=date_creation, date_expiration=date_expiration)
+        db.add(db_obj)
+        db.commit()
+        db.refresh(db_obj)
+        return db_obj
+
+    def get_by_session_id(
+        self, db: Session, *, id: str, for_update: bool = False
+    ) -> Optional[UploadSession]:
+        query = db.query(self.model).filter(UploadSession.id == id)
+        if for_update:
+            query = query.with_for_update()
+        return query.first()
+
+    def get_existing_ids(
+        self, db: Session, *, ids: List[str]
+    ) -> Set[str]:
+        """
+        The given session ids that still exist, expired or not
+        """
+        if not ids:
+            return set()
+        rows = db.query(UploadSession.id).filter(UploadSession.id.in_(ids)).all()
+        return {row.id for row in rows}
+
+    def update_received(
+        self, db: Session, *, db_obj: UploadSession, received: int, date_expiration: datetime
+    ) -> UploadSession:
+        return super().update(db, db_obj=db_obj,
+            obj_in=dict({'received': received, 'date_expiration': date_expiration}))
+
+    def get_expired(
+        self, db: Session, *, now: datetime, limit: int = 100
+    ) -> List[UploadSession]:
+        return (
+            db.query(self.model)
+            .filter(UploadSession.date_expiration < now)
+            .limit(limit)
+            .all()
+        )
+
+    def remove_expired(
+        self, db: Session, *, now: datetime
+    ) -> int:
+        """
+        Remove the expired sessions and their partial files, return the number of removed sessions
+        """
+        removed = 0
+        while True:
+            sessions = self.get_expired(db, now=now)
+            if not sessions:
+                return removed
+            paths = [session.path for session in sessions]
+            for session in sessions:
+                db.delete(session)
+            db.commit()
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            removed += len(sessions)
+
+
+upload_session = CRUDUploadSession(UploadSession)
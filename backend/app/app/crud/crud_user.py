@@ -1,9 +1,13 @@
-from typing import Any, Dict, Optional, Union, List
+from typing import Any, Dict, Optional, Tuple, Union, List
 
+from sqlalchemy import String, and_, func, or_, select
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Session
 
+from app.core.config import settings
 from app.core.security import get_password_hash, verify_password
 from app.crud.base import CRUDBase
+from app.crud.crud_pending_work import pending_work
 
 from app.models.user import User
 from app.schemas.user import UserCreate, UserUpdate
@@ -24,6 +28,21 @@ from datetime import datetime
 from uuid import uuid4
 
 
+def folded(value: Any) -> Any:
+    """
+    Lowercase and unaccented, the form of the names in ix_user_full_name_trgm
+    """
+    return func.f_unaccent(func.lower(value), type_=String)
+
+
+def full_name_contains(name: str) -> Any:
+    """
+    Condition on the users whose name contains name, accents and case ignored
+    """
+    escaped = name.replace('/', '//').replace('%', '/%').replace('_', '/_')
+    return folded(User.full_name).like(func.concat('%', folded(escaped), '%'), escape='/')
+
+
 class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
     
     def get_by_email(self, db: Session, *, email: str) -> Optional[User]:
@@ -33,10 +52,37 @@ class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
         user = db.query(User).filter(User.id == id).first()
         return user
 
-    def get_by_name_birthday(self, db: Session, *, full_name: str, birth_date: datetime) -> User:
-        user = db.query(User).filter(User.full_name == full_name, 
-                User.birth_date == birth_date).first()
-        return user
+    def get_similar_patients(
+        self, db: Session, *, full_name: str, birth_date: Optional[datetime], limit: int = 5
+    ) -> List[Row]:
+        """
+        Id, name and similarity of the patients born the same day with a similar name, the most similar first.
+        The % operator is answered by the trigram index, the similarity is then checked against the threshold.
+        """
+        name = folded(full_name)
+        similarity = func.similarity(folded(User.full_name), name)
+        return db.query(User.id, User.full_name, User.birth_date, similarity.label('similarity'))\
+            .filter(User.role == 'patient', User.birth_date == birth_date,
+                folded(User.full_name).op('%')(name),
+                similarity >= settings.PATIENT_DUPLICATE_SIMILARITY)\
+            .order_by(similarity.desc(), User.id).limit(limit).all()
+
+    def search_patients(
+        self, db: Session, *, name: str, doctor_id: Optional[int] = None, limit: int = 10
+    ) -> List[Row]:
+        """
+        Autocomplete of the patients of a doctor, or of all the patients without doctor_id.
+        Their name contains name or has a word similar to it, the closest first.
+        """
+        searched = folded(name)
+        similarity = func.word_similarity(searched, folded(User.full_name))
+        query = db.query(User.id, User.full_name, User.birth_date, similarity.label('similarity'))\
+            .filter(User.role == 'patient',
+                or_(full_name_contains(name), folded(User.full_name).op('%>')(searched)))
+        if doctor_id is not None:
+            query = query.filter(User.id.in_(
+                select(DoctorPatient.patient_id).where(DoctorPatient.doctor_id == doctor_id)))
+        return query.order_by(similarity.desc(), User.full_name, User.id).limit(limit).all()
 
     def get_multi_count(
         self, db: Session
@@ -148,6 +194,8 @@ class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
             manager_id=obj_in.manager_id
         )
         db.add(db_obj)
+        db.flush()
+        pending_work.refresh_doctor_manager(db, doctor_id=obj_in.doctor_id, manager_id=obj_in.manager_id)
         db.commit()
         db.refresh(db_obj)
         return db_obj
@@ -160,6 +208,8 @@ class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
         obj = db.query(DoctorManager).filter(DoctorManager.doctor_id==obj_in.doctor_id,
             DoctorManager.manager_id==obj_in.manager_id).first()
         db.delete(obj)
+        db.flush()
+        pending_work.refresh_doctor_manager(db, doctor_id=obj_in.doctor_id, manager_id=obj_in.manager_id)
         db.commit()
         return obj
     
@@ -194,6 +244,8 @@ class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
             manager_id=obj_in.manager_id
         )
         db.add(db_obj)
+        db.flush()
+        pending_work.refresh_assistant_manager(db, assistant_id=obj_in.assistant_id, manager_id=obj_in.manager_id)
         db.commit()
         db.refresh(db_obj)
         return db_obj
@@ -214,6 +266,8 @@ class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
         obj = db.query(AssistantManager).filter(AssistantManager.assistant_id==obj_in.assistant_id,
             AssistantManager.manager_id==obj_in.manager_id).first()
         db.delete(obj)
+        db.flush()
+        pending_work.refresh_assistant_manager(db, assistant_id=obj_in.assistant_id, manager_id=obj_in.manager_id)
         db.commit()
         return obj
     
@@ -253,5 +307,23 @@ class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
         objs = db.query(DoctorManager).join(AssistantManager, DoctorManager.manager_id == AssistantManager.manager_id)\
             .filter(DoctorManager.doctor_id==doctor_id).with_entities(AssistantManager.assistant_id).distinct()
         return objs
+
+    def get_doctor_assistants_devices(self, db: Session, *, doctor_id: int) -> List[str]:
+        objs = db.query(DoctorManager).join(AssistantManager, DoctorManager.manager_id == AssistantManager.manager_id)\
+            .join(User, User.id == AssistantManager.assistant_id)\
+            .filter(DoctorManager.doctor_id==doctor_id, User.firebase_device_token.isnot(None))\
+            .with_entities(User.firebase_device_token).distinct()
+        return [obj.firebase_device_token for obj in objs if obj.firebase_device_token]
+
+    def get_patients_of_doctor(
+        self, db: Session, *, doctor_id: int, patient_ids: List[int]
+    ) -> List[Tuple[int, str, Optional[int]]]:
+        """
+        Id, role and doctor_id if related to the doctor of the given users, in a single query
+        """
+        return db.query(User).outerjoin(DoctorPatient, and_(DoctorPatient.patient_id == User.id,
+                DoctorPatient.doctor_id == doctor_id))\
+            .filter(User.id.in_(patient_ids))\
+            .with_entities(User.id, User.role, DoctorPatient.doctor_id).distinct().all()
     
 user = CRUDUser(User)
@@ -1,13 +1,20 @@
-from typing import List, Optional, Any, Dict, Optional, Union
+from collections import Counter
+from typing import List, Optional, Any, Dict, Optional, Set, Tuple, Union
 
 from fastapi.encoders import jsonable_encoder
+from sqlalchemy import and_, func, not_, select, text
 from sqlalchemy.orm import Session
 
 from app.crud.base import CRUDBase
+from app.crud.crud_pending_work import pending_work
+from app.crud.crud_scope_counter import DOCTOR, PATIENT, scope_counter, voice_status
+from app.crud.pagination import Page, paginate
+from app.models.pending_work import PendingWork
 from app.models.voice import Voice
 from app.models.doctor_manager import DoctorManager
 from app.models.assistant_manager import AssistantManager
 from app.models.doctor_patient import DoctorPatient
+from app.models.note import Note
 
 from datetime import datetime
 from app.schemas.voice import VoiceCreate, VoiceUpdate
@@ -22,9 +29,31 @@ class CRUDVoice(CRUDBase[Voice, VoiceCreate, VoiceUpdate]):
         obj_in_data = jsonable_encoder(obj_in)
         db_obj = self.model(**obj_in_data, date_creation = date_creation)
         db.add(db_obj)
+        db.flush()
+        pending_work.add_voices(db, voices=[db_obj])
+        scope_counter.add(db, cells=scope_counter.voice_cells(voice=db_obj))
         db.commit()
         db.refresh(db_obj)
         return db_obj
+
+    def create_multi_with_doctor(
+        self, db: Session, *, objs_in: List[VoiceCreate], date_creation: datetime
+    ) -> List[Voice]:
+        """
+        Insert the voices in a single transaction, they are reloaded with one query
+        """
+        db_objs = [self.model(**jsonable_encoder(obj_in), date_creation = date_creation) for obj_in in objs_in]
+        db.add_all(db_objs)
+        db.flush()
+        pending_work.add_voices(db, voices=db_objs)
+        cells = Counter()
+        for db_obj in db_objs:
+            cells.update(scope_counter.voice_cells(voice=db_obj))
+        scope_counter.add(db, cells=cells)
+        ids = [db_obj.id for db_obj in db_objs]
+        db.commit()
+        voices = {voice.id: voice for voice in db.query(self.model).filter(Voice.id.in_(ids)).all()}
+        return [voices[id] for id in ids]
     
     def update_voice(
         self, db: Session, *, db_obj: Voice, obj_in: Union[VoiceUpdate, Dict[str, Any]]
@@ -33,8 +62,23 @@ class CRUDVoice(CRUDBase[Voice, VoiceCreate, VoiceUpdate]):
             update_data = obj_in
         else:
             update_data = obj_in.dict(exclude_unset=True)
-        print('update_data', update_data)
-        return super().update(db, db_obj=db_obj, obj_in=update_data)
+        if not update_data.keys() & {'note_created', 'doctor_id', 'patient_id'}:
+            return super().update(db, db_obj=db_obj, obj_in=update_data)
+        # the worklists of the assistants and the counters change in the same transaction
+        previous_doctor_id = db_obj.doctor_id
+        previous_cells = scope_counter.voice_cells(voice=db_obj) + scope_counter.voice_note_cells(db, voice=db_obj)
+        for field in db_obj.__table__.columns:
+            if field.name in update_data:
+                setattr(db_obj, field.name, update_data[field.name])
+        db.add(db_obj)
+        db.flush()
+        if 'note_created' in update_data or 'doctor_id' in update_data:
+            pending_work.sync_voice(db, voice=db_obj, previous_doctor_id=previous_doctor_id)
+        cells = scope_counter.voice_cells(voice=db_obj) + scope_counter.voice_note_cells(db, voice=db_obj)
+        scope_counter.change(db, before=previous_cells, after=cells)
+        db.commit()
+        db.refresh(db_obj)
+        return db_obj
     
     def get_all(
         self, db: Session
@@ -46,30 +90,17 @@ class CRUDVoice(CRUDBase[Voice, VoiceCreate, VoiceUpdate]):
     
     def get_multi_by_doctor_id(
         self, db: Session, *, doctor_id: int, note_created: Optional[bool]=None, skip=0, limit=5,
-    ) -> List[Voice]:
+        cursor: Optional[str]=None, with_total: bool=False
+    ) -> Union[List[Voice], Page]:
+        query = db.query(self.model).filter(Voice.doctor_id == doctor_id)
         if type(note_created) is bool:
-            return (db.query(self.model)
-            .filter(Voice.doctor_id == doctor_id, Voice.note_created == note_created)
-            .offset(skip).limit(limit)
-            .all())
-        return (
-            db.query(self.model)
-            .filter(Voice.doctor_id == doctor_id)
-            .offset(skip).limit(limit)
-            .all()
-        )
+            query = query.filter(Voice.note_created == note_created)
+        return paginate(query, Voice, skip=skip, limit=limit, cursor=cursor, with_total=with_total)
     
     def get_multi_by_doctor_count(
         self, db: Session, *, doctor_id: int, note_created: Optional[bool]=None
     ) -> int:
-        if type(note_created) is bool:
-            return (db.query(self.model)
-            .filter(Voice.doctor_id == doctor_id, Voice.note_created == note_created)
-            .count())
-        return (
-            db.query(self.model)
-            .filter(Voice.doctor_id == doctor_id)
-            .count())
+        return scope_counter.get(db, scope=DOCTOR, scope_id=doctor_id, status=voice_status(note_created))
 
     def get_by_voice_id(
         self, db: Session, *, id: int
@@ -81,118 +112,297 @@ class CRUDVoice(CRUDBase[Voice, VoiceCreate, VoiceUpdate]):
         )
     
     def get_multi_by_manager(
-        self, db: Session, *, manager_id: int, note_created: Optional[bool]=None, skip: int=0, limit: int=5
-    ) -> List[Voice]:
-        if type(note_created) is bool:
-            return (
-            db.query(self.model)
-            .join(DoctorManager, DoctorManager.doctor_id == Voice.doctor_id)
-            .filter(DoctorManager.manager_id == manager_id, Voice.note_created==note_created)
-            .offset(skip).limit(limit)
-            .all())
-        return (
+        self, db: Session, *, manager_id: int, note_created: Optional[bool]=None, skip: int=0, limit: int=5,
+        cursor: Optional[str]=None, with_total: bool=False
+    ) -> Union[List[Voice], Page]:
+        query = (
             db.query(self.model)
             .join(DoctorManager, DoctorManager.doctor_id == Voice.doctor_id)
-            .filter(DoctorManager.manager_id == manager_id)
-            .offset(skip).limit(limit)
-            .all()
-        )
+            .filter(DoctorManager.manager_id == manager_id))
+        if type(note_created) is bool:
+            query = query.filter(Voice.note_created==note_created)
+        return paginate(query, Voice, skip=skip, limit=limit, cursor=cursor, with_total=with_total)
     
     def get_multi_by_manager_count(
         self, db: Session, *, manager_id: int, note_created: Optional[bool]=None
     ) -> int:
-        if type(note_created) is bool:
-            return (
-            db.query(self.model)
-            .join(DoctorManager, DoctorManager.doctor_id == Voice.doctor_id)
-            .filter(DoctorManager.manager_id == manager_id, Voice.note_created==note_created)
-            .count())
-        return (
-            db.query(self.model)
-            .join(DoctorManager, DoctorManager.doctor_id == Voice.doctor_id)
-            .filter(DoctorManager.manager_id == manager_id)
-            .count()
-        )
+        doctor_ids = select(DoctorManager.doctor_id).where(DoctorManager.manager_id == manager_id)
+        return scope_counter.get_sum(db, scope=DOCTOR, status=voice_status(note_created), scope_ids=doctor_ids)
     
     def get_multi_by_assistant(
-        self, db: Session, *, assistant_id: int, note_created: Optional[bool]=None, skip: int=0, limit: int=5
-    ) -> List[Voice]:
-        if type(note_created) is bool:
-            return (
+        self, db: Session, *, assistant_id: int, note_created: Optional[bool]=None, skip: int=0, limit: int=5,
+        cursor: Optional[str]=None, with_total: bool=False
+    ) -> Union[List[Voice], Page]:
+        if note_created == False:
+            # the worklist of the assistant, read in the order of its index
+            query = (
+                db.query(self.model)
+                .join(PendingWork, PendingWork.voice_id == Voice.id)
+                .filter(PendingWork.assistant_id == assistant_id))
+            return paginate(query, Voice, skip=skip, limit=limit, cursor=cursor, with_total=with_total,
+                key=(PendingWork.date_creation, PendingWork.voice_id))
+        query = (
             db.query(self.model)
             .join(DoctorManager, DoctorManager.doctor_id == Voice.doctor_id)
             .join(AssistantManager, AssistantManager.manager_id == DoctorManager.manager_id)
-            .filter(AssistantManager.assistant_id == assistant_id, Voice.note_created==note_created)
-            .offset(skip).limit(limit)
-            .all())
-        return (
-            db.query(self.model)
-            .join(DoctorManager, DoctorManager.doctor_id == Voice.doctor_id)
-            .join(AssistantManager, AssistantManager.manager_id == DoctorManager.manager_id)
-            .filter(AssistantManager.assistant_id == assistant_id)
-            .offset(skip).limit(limit)
-            .all()
-        )
+            .filter(AssistantManager.assistant_id == assistant_id))
+        if type(note_created) is bool:
+            query = query.filter(Voice.note_created==note_created)
+        return paginate(query, Voice, skip=skip, limit=limit, cursor=cursor, with_total=with_total)
     
     def get_multi_by_assistant_count(
         self, db: Session, *, assistant_id: int, note_created: Optional[bool]=None
     ) -> int:
-        if type(note_created) is bool:
+        if note_created == False:
             return (
-            db.query(self.model)
-            .join(DoctorManager, DoctorManager.doctor_id == Voice.doctor_id)
-            .join(AssistantManager, AssistantManager.manager_id == DoctorManager.manager_id)
-            .filter(AssistantManager.assistant_id == assistant_id, Voice.note_created==note_created)
-            .count())
-        return (
-            db.query(self.model)
-            .join(DoctorManager, DoctorManager.doctor_id == Voice.doctor_id)
+            db.query(func.count())
+            .select_from(PendingWork)
+            .filter(PendingWork.assistant_id == assistant_id)
+            .scalar())
+        doctor_ids = (
+            select(DoctorManager.doctor_id)
             .join(AssistantManager, AssistantManager.manager_id == DoctorManager.manager_id)
-            .filter(AssistantManager.assistant_id == assistant_id)
-            .count()
-        )
+            .where(AssistantManager.assistant_id == assistant_id))
+        return scope_counter.get_sum(db, scope=DOCTOR, status=voice_status(note_created), scope_ids=doctor_ids)
     
     def get_multi_by_patient(
-        self, db: Session, *, patient_id: int, doctor_id: Optional[int]=None ,note_created: Optional[bool]=None, skip: int=0, limit: int=5
-    ) -> List[Voice]:
+        self, db: Session, *, patient_id: int, doctor_id: Optional[int]=None ,note_created: Optional[bool]=None, skip: int=0, limit: int=5,
+        cursor: Optional[str]=None, with_total: bool=False
+    ) -> Union[List[Voice], Page]:
+        query = db.query(self.model).filter(Voice.patient_id==patient_id)
         if type(note_created) is bool and type(doctor_id) is int:
-            return (
-            db.query(self.model)
-            .filter(Voice.patient_id==patient_id, Voice.doctor_id==doctor_id, Voice.note_created==note_created)
-            .offset(skip).limit(limit)
-            .all())
+            query = query.filter(Voice.doctor_id==doctor_id, Voice.note_created==note_created)
         elif type(note_created) is bool:
-            return (
-            db.query(self.model)
-            .filter(Voice.patient_id==patient_id, Voice.note_created==note_created)
-            .offset(skip).limit(limit)
-            .all())
-        else:
-            return (db.query(self.model)
-            .filter(Voice.patient_id==patient_id)
-            .offset(skip).limit(limit)
-            .all())
+            query = query.filter(Voice.note_created==note_created)
+        return paginate(query, Voice, skip=skip, limit=limit, cursor=cursor, with_total=with_total)
     
     def get_multi_by_patient_count(
         self, db: Session, *, patient_id: int, doctor_id: Optional[int]=None ,note_created: Optional[bool]=None
     ) -> int:
         if type(note_created) is bool and type(doctor_id) is int:
+            # a range of ix_voice_patient_id_doctor_id, the counters are not kept per doctor and patient
             return (
             db.query(self.model)
             .filter(Voice.patient_id==patient_id, Voice.doctor_id==doctor_id, Voice.note_created==note_created)
             .count())
-        elif type(note_created) is bool:
-            return (
+        return scope_counter.get(db, scope=PATIENT, scope_id=patient_id, status=voice_status(note_created))
+    
+    def lock_path(
+        self, db: Session, *, path: str
+    ) -> None:
+        """
+        Lock the stored file of the voices until the end of the transaction,
+        voices with the same content share the same path
+        """
+        db.execute(text('SELECT pg_advisory_xact_lock(hashtext(:path))'), {'path': path})
+
+    def get_by_original_path(
+        self, db: Session, *, original_path: str
+    ) -> Optional[Voice]:
+        """
+        A voice whose uploaded file was original_path and has been transcoded
+        """
+        return (
             db.query(self.model)
-            .filter(Voice.patient_id==patient_id, Voice.note_created==note_created)
+            .filter(Voice.original_path == original_path)
+            .first())
+
+    def count_by_path(
+        self, db: Session, *, path: str
+    ) -> int:
+        return (
+            db.query(self.model)
+            .filter(Voice.path == path)
             .count())
-        else:
-            return (db.query(self.model)
-            .filter(Voice.patient_id==patient_id)
+
+    def count_not_archived_by_path(
+        self, db: Session, *, path: str
+    ) -> int:
+        return (
+            db.query(self.model)
+            .filter(Voice.path == path, Voice.cold_path.is_(None))
             .count())
-    
+
+    def get_multi_for_export(
+        self, db: Session, *, patient_id: Optional[int] = None, doctor_id: Optional[int] = None,
+        after_id: int = 0, limit: int = 100
+    ) -> List[Voice]:
+        query = db.query(self.model).filter(Voice.id > after_id)
+        if patient_id is not None:
+            query = query.filter(Voice.patient_id == patient_id)
+        if doctor_id is not None:
+            query = query.filter(Voice.doctor_id == doctor_id)
+        return query.order_by(Voice.id).limit(limit).all()
+
+    def get_existing_paths(
+        self, db: Session, *, paths: List[str]
+    ) -> Set[str]:
+        """
+        The given paths that are referenced by at least one voice
+        """
+        if not paths:
+            return set()
+        rows = (
+            db.query(Voice.path)
+            .filter(Voice.path.in_(paths))
+            .distinct()
+            .all())
+        return {row.path for row in rows}
+
+    def get_multi_paths(
+        self, db: Session, *, after_id: int = 0, limit: int = 100
+    ) -> List[Tuple[int, str, Optional[str]]]:
+        """
+        Ids and paths of the voices ordered by id, without loading the whole rows
+        """
+        return (
+            db.query(Voice.id, Voice.path, Voice.cold_path)
+            .filter(Voice.id > after_id)
+            .order_by(Voice.id)
+            .limit(limit)
+            .all())
+
+    def get_multi_unsharded(
+        self, db: Session, *, after_id: int = 0, limit: int = 100
+    ) -> List[Voice]:
+        """
+        Voices stored before the sharded layout of the storage, ordered by id
+        """
+        return (
+            db.query(self.model)
+            .filter(Voice.id > after_id, not_(Voice.path.like('blobs/%/%/%')))
+            .order_by(Voice.id)
+            .limit(limit)
+            .all())
+
+    def update_path(
+        self, db: Session, *, path: str, new_path: str
+    ) -> int:
+        """
+        Point every voice stored at path to new_path without committing
+        """
+        return (
+            db.query(self.model)
+            .filter(Voice.path == path)
+            .update({Voice.path: new_path}, synchronize_session=False))
+
+    def update_transcoded_path(
+        self, db: Session, *, path: str, new_path: str
+    ) -> int:
+        """
+        Point every voice stored at path to its transcoded file new_path without committing,
+        the audio information of the previous file is cleared and path is kept as their original path
+        """
+        values = {Voice.path: new_path, Voice.transcoded: True}
+        if new_path != path:
+            values.update({Voice.original_path: path, Voice.duration: None, Voice.sample_rate: None})
+        return (
+            db.query(self.model)
+            .filter(Voice.path == path)
+            .update(values, synchronize_session=False))
+
+    def update_audio_info(
+        self, db: Session, *, path: str, duration: float, sample_rate: Optional[int]
+    ) -> int:
+        """
+        Set the audio information of every voice stored at path without committing
+        """
+        return (
+            db.query(self.model)
+            .filter(Voice.path == path)
+            .update({Voice.duration: duration, Voice.sample_rate: sample_rate},
+                synchronize_session=False))
+
+    def get_multi_not_analyzed(
+        self, db: Session, *, after_id: int = 0, limit: int = 100
+    ) -> List[Voice]:
+        return (
+            db.query(self.model)
+            .filter(Voice.id > after_id, Voice.duration.is_(None), Voice.cold_path.is_(None))
+            .order_by(Voice.id)
+            .limit(limit)
+            .all())
+
+    def get_multi_not_transcoded(
+        self, db: Session, *, after_id: int = 0, limit: int = 100
+    ) -> List[Voice]:
+        return (
+            db.query(self.model)
+            .filter(Voice.id > after_id, Voice.transcoded.isnot(True), Voice.cold_path.is_(None))
+            .order_by(Voice.id)
+            .limit(limit)
+            .all())
+
+    def _archivable_paths_query(self, db: Session, *, validated_before: datetime) -> Any:
+        """
+        Paths not archived yet whose voices all have a note validated before validated_before,
+        the note date of modification is the date of its validation
+        """
+        validated = and_(Note.validated.is_(True),
+            func.coalesce(Note.date_modification, Note.date_creation) < validated_before)
+        return (
+            db.query(Voice.path)
+            .outerjoin(Note, Note.voice_id == Voice.id)
+            .group_by(Voice.path)
+            .having(func.bool_and(func.coalesce(validated, False)))
+            .having(func.bool_or(Voice.cold_path.is_(None))))
+
+    def get_archivable_paths(
+        self, db: Session, *, validated_before: datetime, paths: List[str]
+    ) -> List[str]:
+        """
+        The archivable paths among paths, each one is looked up with the path index
+        """
+        if not paths:
+            return []
+        rows = (
+            self._archivable_paths_query(db, validated_before=validated_before)
+            .filter(Voice.path.in_(paths))
+            .order_by(Voice.path)
+            .all())
+        return [row.path for row in rows]
+
+    def is_path_archivable(
+        self, db: Session, *, path: str, validated_before: datetime
+    ) -> bool:
+        return (
+            self._archivable_paths_query(db, validated_before=validated_before)
+            .filter(Voice.path == path)
+            .first()) is not None
+
+    def update_cold_path(
+        self, db: Session, *, path: str, cold_path: str
+    ) -> int:
+        """
+        Mark every voice stored at path as archived at cold_path without committing
+        """
+        return (
+            db.query(self.model)
+            .filter(Voice.path == path)
+            .update({Voice.cold_path: cold_path}, synchronize_session=False))
+
+    def remove_and_count_path(
+        self, db: Session, *, id: int
+    ) -> Tuple[Voice, int]:
+        """
+        Delete the voice without committing and return it with the number of voices
+        still referencing its path. The path stays locked until the caller commits.
+        """
+        obj = db.query(self.model).get(id)
+        self.lock_path(db, path=obj.path)
+        # its rows in the worklists are deleted with it
+        pending_work.lock_voice(db, voice=obj)
+        # its notes are deleted before it
+        scope_counter.subtract(db, cells=scope_counter.voice_cells(voice=obj))
+        db.delete(obj)
+        db.flush()
+        return obj, self.count_by_path(db, path=obj.path)
+
     def remove(self, db: Session, *, id: int) -> Voice:
         obj = db.query(self.model).get(id)
+        pending_work.lock_voice(db, voice=obj)
+        # its notes are deleted before it
+        scope_counter.subtract(db, cells=scope_counter.voice_cells(voice=obj))
         db.delete(obj)
         db.commit()
         return obj
@@ -0,0 +1,129 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, NamedTuple, Optional, Tuple, Union
+
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import Query, aliased
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class Page(NamedTuple):
+    items: List[Any]
+    # number of rows of the whole listing, not only of the page
+    total: int
+    next_cursor: Optional[str]
+
+
+def encode_cursor(date_creation: datetime, id: int) -> str:
+    """
+    Opaque token of the position after a row in the (date_creation, id) order
+    """
+    return _encode_position([date_creation.isoformat(), id])
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        date_creation, id = _decode_position(cursor)
+        return datetime.fromisoformat(date_creation), int(id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(cursor) from e
+
+
+def encode_ranked_cursor(rank: float, date_creation: datetime, id: int) -> str:
+    """
+    Opaque token of the position after a row in the (rank, date_creation, id) order of a search
+    """
+    return _encode_position([rank, date_creation.isoformat(), id])
+
+
+def decode_ranked_cursor(cursor: str) -> Tuple[float, datetime, int]:
+    try:
+        rank, date_creation, id = _decode_position(cursor)
+        return float(rank), datetime.fromisoformat(date_creation), int(id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(cursor) from e
+
+
+def _encode_position(position: List[Any]) -> str:
+    encoded = json.dumps(position, separators=(',', ':'))
+    return base64.urlsafe_b64encode(encoded.encode()).decode().rstrip('=')
+
+
+def _decode_position(cursor: str) -> Any:
+    return json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+
+
+def paginate(
+    query: Query, model: Any, *, skip: int = 0, limit: int = 5, cursor: Optional[str] = None,
+    with_total: bool = False, key: Optional[Tuple[Any, Any]] = None
+) -> Union[List[Any], Page]:
+    """
+    Most recent rows first, ties on date_creation are ordered by id so that pages are stable.
+    With a cursor the page starts after the row it was made from and skip is ignored,
+    the rows before it are not scanned as with an offset.
+    With with_total a Page is returned, its total is computed by the query of the page.
+    key are the columns ordered on instead of the date_creation and id of model,
+    a joined table holding the same values in an index
+    """
+    date_creation_column, id_column = key or (model.date_creation, model.id)
+    if with_total:
+        return _paginate_with_total(query, model, skip=skip, limit=limit, cursor=cursor,
+            key=(date_creation_column, id_column))
+    query = query.order_by(date_creation_column.desc(), id_column.desc())
+    if cursor is not None:
+        date_creation, id = decode_cursor(cursor)
+        return query.filter(
+            tuple_(date_creation_column, id_column) < tuple_(date_creation, id)).limit(limit).all()
+    return query.offset(skip).limit(limit).all()
+
+
+def _paginate_with_total(
+    query: Query, model: Any, *, skip: int, limit: int, cursor: Optional[str], key: Tuple[Any, Any]
+) -> Page:
+    """
+    The rows of the listing are counted by a window function in a subquery,
+    the cursor is applied around it so that the total is the one of the whole listing.
+    The subquery is ordered by key so that the page is read in the order of its index.
+    """
+    date_creation_column, id_column = key
+    listing = (
+        query.add_columns(date_creation_column.label('key_date_creation'), id_column.label('key_id'),
+            func.count().over().label('total'))
+        .order_by(date_creation_column.desc(), id_column.desc())
+        .subquery())
+    entity = aliased(model, listing)
+    page_query = (
+        query.session.query(entity, listing.c.total)
+        .order_by(listing.c.key_date_creation.desc(), listing.c.key_id.desc()))
+    if cursor is not None:
+        date_creation, id = decode_cursor(cursor)
+        page_query = page_query.filter(
+            tuple_(listing.c.key_date_creation, listing.c.key_id) < tuple_(date_creation, id))
+    else:
+        page_query = page_query.offset(skip)
+    rows = page_query.limit(limit).all()
+    items = [row[0] for row in rows]
+
+    if rows:
+        total = rows[0].total
+    elif cursor is None and skip == 0:
+        total = 0
+    else:
+        # past the last page the total can not be read from the rows
+        total = query.count()
+    if cursor is None and skip + len(items) >= total:
+        return Page(items=items, total=total, next_cursor=None)
+    return Page(items=items, total=total, next_cursor=next_cursor(items, limit))
+
+
+def next_cursor(page: List[Any], limit: int) -> Optional[str]:
+    """
+    Cursor of the page following a full page, None after the last page
+    """
+    if not page or len(page) < limit:
+        return None
+    return encode_cursor(page[-1].date_creation, page[-1].id)
@@ -8,4 +8,7 @@ from app.models.assistant_manager import AssistantManager
 from app.models.doctor_manager import DoctorManager
 from app.models.doctor_patient import DoctorPatient
 from app.models.remarque_note import RemarqueNote
+from app.models.upload_session import UploadSession
 
+from app.models.pending_work import PendingWork
+from app.models.scope_counter import ScopeCounter
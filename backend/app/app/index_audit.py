@@ -0,0 +1,116 @@
+import argparse
+import logging
+from typing import List
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.db import base  # noqa: F401
+from app.db.session import SessionLocal
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+INDEX_USAGE = text("""
+    SELECT s.relname AS table_name, s.indexrelname AS index_name, s.idx_scan,
+        pg_relation_size(s.indexrelid) AS size, i.indisunique OR i.indisprimary AS is_unique,
+        i.indisvalid AS is_valid
+    FROM pg_stat_user_indexes s JOIN pg_index i ON i.indexrelid = s.indexrelid
+    ORDER BY s.relname, s.indexrelname
+""")
+
+TABLE_SCANS = text("""
+    SELECT relname AS table_name, seq_scan, seq_tup_read, COALESCE(idx_scan, 0) AS idx_scan,
+        n_live_tup
+    FROM pg_stat_user_tables
+    ORDER BY seq_tup_read DESC
+""")
+
+STATEMENTS_COLUMNS = text("""
+    SELECT column_name FROM information_schema.columns
+    WHERE table_name = 'pg_stat_statements' AND column_name IN ('total_exec_time', 'total_time')
+""")
+
+STATEMENTS = """
+    SELECT query, calls, {total_time} AS total_time, rows
+    FROM pg_stat_statements
+    WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+        AND query ~* '^\\s*select'
+    ORDER BY {total_time} DESC
+    LIMIT :limit
+"""
+
+
+def report_indexes(db: Session) -> List[str]:
+    """
+    Log the scans and the size of each index, return the unused ones that are not needed
+    for a constraint
+    """
+    unused = []
+    for row in db.execute(INDEX_USAGE):
+        logger.info(f"{row.table_name}.{row.index_name}: {row.idx_scan} scans, {row.size // 1024} kB"
+            f"{'' if row.is_valid else ' INVALID'}")
+        if not row.is_valid or (row.idx_scan == 0 and not row.is_unique):
+            unused.append(row.index_name)
+    return unused
+
+
+def report_tables(db: Session, *, min_rows: int) -> List[str]:
+    """
+    Return the tables of at least min_rows rows read by sequential scans more than by index scans,
+    their queries are the candidates for a missing index
+    """
+    candidates = []
+    for row in db.execute(TABLE_SCANS):
+        logger.info(f"{row.table_name}: {row.seq_scan} sequential scans reading {row.seq_tup_read} rows,"
+            f" {row.idx_scan} index scans, {row.n_live_tup} rows")
+        if row.n_live_tup >= min_rows and row.seq_scan > row.idx_scan:
+            candidates.append(row.table_name)
+    return candidates
+
+
+def report_statements(db: Session, *, limit: int) -> None:
+    """
+    Log the select statements taking the most time, pg_stat_statements must be loaded
+    """
+    columns = db.execute(STATEMENTS_COLUMNS).scalars().all()
+    if not columns:
+        logger.info("pg_stat_statements is not installed, no statements to report")
+        return
+    # the column was renamed in PostgreSQL 13
+    total_time = 'total_exec_time' if 'total_exec_time' in columns else 'total_time'
+    for row in db.execute(text(STATEMENTS.format(total_time=total_time)), {'limit': limit}):
+        query = ' '.join(row.query.split())
+        logger.info(f"{row.total_time:.0f} ms in {row.calls} calls, {row.rows} rows: {query[:300]}")
+
+
+def audit(*, min_rows: int, statements: int) -> None:
+    db = SessionLocal()
+    try:
+        unused = report_indexes(db)
+        candidates = report_tables(db, min_rows=min_rows)
+        report_statements(db, limit=statements)
+        for index_name in unused:
+            logger.warning(f"index {index_name} is unused or invalid")
+        for table_name in candidates:
+            logger.warning(f"table {table_name} is mostly read by sequential scans, an index may be missing")
+    finally:
+        db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Report the usage of the indexes and the tables and statements that may miss one"
+    )
+    parser.add_argument("--min-rows", type=int, default=1000,
+        help="smaller tables are not reported as missing an index")
+    parser.add_argument("--statements", type=int, default=20,
+        help="number of the most expensive statements to report")
+    args = parser.parse_args()
+
+    logger.info("Auditing the indexes")
+    audit(min_rows=args.min_rows, statements=args.statements)
+
+
+if __name__ == "__main__":
+    main()
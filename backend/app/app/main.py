@@ -2,12 +2,26 @@ from fastapi import FastAPI
 from starlette.middleware.cors import CORSMiddleware
 
 from app.api.api_v1.api import api_router
+from app.api.pagination import NEXT_CURSOR_HEADER
+from app.core.admission import INGEST_PATH_REGEX, AdmissionMiddleware, ingest_admission
 from app.core.config import settings
+from app.storage.session import voice_cold_tier, voice_storage
 
 app = FastAPI(
     title=settings.PROJECT_NAME, openapi_url=f"{settings.API_V1_STR}/openapi.json"
 )
 
+# uploads are admitted before their body is read, the others are let through.
+# Added first so that the CORS middleware wraps its rejections
+app.add_middleware(
+    AdmissionMiddleware,
+    controller=ingest_admission,
+    methods=("POST", "PUT"),
+    path_regex=INGEST_PATH_REGEX,
+    default_bytes=settings.VOICE_MAX_SIZE_MB * 10**6,
+    retry_after=settings.VOICE_INGEST_RETRY_AFTER,
+)
+
 # Set all CORS enabled origins
 if settings.BACKEND_CORS_ORIGINS:
     app.add_middleware(
@@ -16,6 +30,13 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=[NEXT_CURSOR_HEADER],
     )
 
 app.include_router(api_router, prefix=settings.API_V1_STR)
+
+
+@app.on_event("shutdown")
+async def close_voice_storage() -> None:
+    await voice_storage.close()
+    await voice_cold_tier.close()
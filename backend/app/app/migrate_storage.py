@@ -0,0 +1,104 @@
+import argparse
+import asyncio
+import logging
+import os
+from typing import List
+
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.db import base  # noqa: F401
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.storage import staging
+from app.storage.base import StorageBackend
+from app.storage.local import LocalStorage
+from app.storage.session import voice_storage
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# voices stored before the content addressed layout are always on the local volume
+legacy_storage = LocalStorage(settings.VOICE_STORAGE_DIR)
+
+
+async def migrate_voice_path(db: Session, storage: StorageBackend, *, path: str) -> bool:
+    """
+    Copy the file of path to its sharded content addressed key and point the voices to it.
+    The old file is left in place and must be removed once the transaction is committed.
+    """
+    old_file = legacy_storage.resolve(path)
+    if not os.path.isfile(old_file):
+        logger.warning(f"{path} not found, skipped")
+        return False
+    staged = staging.stage_copy(old_file, path)
+    key = staged.key
+
+    # lock in a fixed order, delete_voice and create_voice lock the same paths
+    for locked_path in sorted({path, key}):
+        crud.voice.lock_path(db, path=locked_path)
+    await storage.store(staged)
+    updated = crud.voice.update_path(db, path=path, new_path=key)
+    logger.info(f"{path} -> {key} ({updated} voices)")
+    return True
+
+
+async def migrate(
+    storage: StorageBackend, *, batch_size: int, pause: float, grace: float, dry_run: bool
+) -> int:
+    db = SessionLocal()
+    migrated = 0
+    after_id = 0
+    try:
+        while True:
+            voices = crud.voice.get_multi_unsharded(db, after_id=after_id, limit=batch_size)
+            if not voices:
+                return migrated
+            after_id = voices[-1].id
+            paths = sorted({voice.path for voice in voices})
+            if dry_run:
+                for path in paths:
+                    logger.info(f"{path} would be migrated")
+                db.rollback()
+                continue
+
+            old_files: List[str] = []
+            for path in paths:
+                if await migrate_voice_path(db, storage, path=path):
+                    old_files.append(path)
+                # one transaction per file, the locks are not held for the whole batch
+                db.commit()
+            migrated += len(old_files)
+
+            # requests that read the old path just before the commit can still open it
+            await asyncio.sleep(grace)
+            for old_file in old_files:
+                await legacy_storage.delete(old_file)
+            await asyncio.sleep(pause)
+    finally:
+        db.close()
+        await storage.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Move the voices to the sharded content addressed storage layout "
+        "of the configured storage backend"
+    )
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--pause", type=float, default=1.0,
+        help="seconds to wait between two batches")
+    parser.add_argument("--grace", type=float, default=5.0,
+        help="seconds to wait before removing the old files of a batch")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    logger.info("Migrating voices storage")
+    migrated = asyncio.run(migrate(voice_storage, batch_size=args.batch_size, pause=args.pause,
+        grace=args.grace, dry_run=args.dry_run))
+    logger.info(f"{migrated} voice files migrated")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 from typing import TYPE_CHECKING
 
-from sqlalchemy import Column, ForeignKey, Integer, String
+from sqlalchemy import Column, ForeignKey, Integer, String, Index
 from sqlalchemy.orm import relationship, backref
 
 from app.db.base_class import Base
@@ -10,6 +10,12 @@ if TYPE_CHECKING:
 
 
 class AssistantManager(Base):
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     assistant_id = Column(Integer, ForeignKey("user.id"))
-    manager_id = Column(Integer, ForeignKey("user.id"))
\ No newline at end of file
+    manager_id = Column(Integer, ForeignKey("user.id"))
+
+    # looked up from both sides
+    __table_args__ = (
+        Index('ix_assistantmanager_assistant_id_manager_id', 'assistant_id', 'manager_id'),
+        Index('ix_assistantmanager_manager_id_assistant_id', 'manager_id', 'assistant_id'),
+    )
@@ -1,6 +1,6 @@
 from typing import TYPE_CHECKING
 
-from sqlalchemy import Column, ForeignKey, Integer, String
+from sqlalchemy import Column, ForeignKey, Integer, String, Index
 from sqlalchemy.orm import relationship, backref
 
 from app.db.base_class import Base
@@ -10,7 +10,13 @@ if TYPE_CHECKING:
 
 
 class DoctorManager(Base):
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
 
     doctor_id = Column(Integer, ForeignKey("user.id"))
     manager_id = Column(Integer, ForeignKey("user.id"))
+
+    # looked up from both sides
+    __table_args__ = (
+        Index('ix_doctormanager_doctor_id_manager_id', 'doctor_id', 'manager_id'),
+        Index('ix_doctormanager_manager_id_doctor_id', 'manager_id', 'doctor_id'),
+    )
@@ -1,6 +1,6 @@
 from typing import TYPE_CHECKING
 
-from sqlalchemy import Column, ForeignKey, Integer, String
+from sqlalchemy import Column, ForeignKey, Integer, String, Index
 from sqlalchemy.orm import relationship, backref
 
 from app.db.base_class import Base
@@ -10,7 +10,13 @@ if TYPE_CHECKING:
 
 
 class DoctorPatient(Base):
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
 
     doctor_id = Column(Integer, ForeignKey("user.id"))
     patient_id = Column(Integer, ForeignKey("user.id"))
+
+    # looked up from both sides
+    __table_args__ = (
+        Index('ix_doctorpatient_doctor_id_patient_id', 'doctor_id', 'patient_id'),
+        Index('ix_doctorpatient_patient_id_doctor_id', 'patient_id', 'doctor_id'),
+    )
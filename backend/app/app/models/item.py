@@ -10,7 +10,7 @@ if TYPE_CHECKING:
 
 
 class Item(Base):
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     title = Column(String, index=True)
     description = Column(String, index=True)
     #owner_id = Column(Integer, ForeignKey("user.id"))
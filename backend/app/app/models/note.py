@@ -1,6 +1,7 @@
 from typing import TYPE_CHECKING
 
-from sqlalchemy import Column, ForeignKey, Integer, String, Boolean, DateTime
+from sqlalchemy import Column, FetchedValue, ForeignKey, Integer, String, Boolean, DateTime, Index
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import relationship, backref
 
 from app.db.base_class import Base
@@ -10,11 +11,16 @@ if TYPE_CHECKING:
     from .user import User  # noqa: F401
     from .voice import Voice  # noqa: F401
 
+# french stemming of the unaccented words, created by a migration
+TEXT_SEARCH_CONFIG = 'french_unaccent'
+
 
 class Note(Base):
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
 
-    content_txt = Column(String, index=True)
+    content_txt = Column(String)
+    # setweight(to_tsvector(content_txt), 'B'), written by a trigger created by a migration
+    search_vector = Column(TSVECTOR, server_default=FetchedValue(), server_onupdate=FetchedValue())
     validated = Column(Boolean(), default=False)
     
     voice_id = Column(Integer, ForeignKey("voice.id"))
@@ -26,4 +32,11 @@ class Note(Base):
     modifier_id = Column(Integer, ForeignKey("user.id"), nullable=True)
                     
     date_creation = Column(DateTime, nullable= False)
-    date_modification = Column(DateTime, nullable= True)
\ No newline at end of file
+    date_modification = Column(DateTime, nullable= True)
+
+    __table_args__ = (
+        Index('ix_note_assistant_id_validated_modifier_id', 'assistant_id', 'validated', 'modifier_id'),
+        # a voice has a single note
+        Index('ix_note_voice_id', 'voice_id', unique=True),
+        Index('ix_note_search_vector', 'search_vector', postgresql_using='gin'),
+    )
\ No newline at end of file
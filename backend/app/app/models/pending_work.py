@@ -0,0 +1,25 @@
+from typing import TYPE_CHECKING
+
+from sqlalchemy import Column, ForeignKey, Integer, DateTime, Index
+
+from app.db.base_class import Base
+
+if TYPE_CHECKING:
+    from .user import User  # noqa: F401
+    from .voice import Voice  # noqa: F401
+
+
+# a voice without note in the worklist of an assistant reaching its doctor through a manager,
+# maintained by crud.pending_work in the transactions changing the voices and the relationships
+class PendingWork(Base):
+    assistant_id = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), primary_key=True)
+    voice_id = Column(Integer, ForeignKey("voice.id", ondelete="CASCADE"), primary_key=True)
+    doctor_id = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    # the one of the voice, the worklist is ordered by it
+    date_creation = Column(DateTime(), nullable=False)
+
+    __table_args__ = (
+        Index('ix_pendingwork_assistant_id_date_creation', 'assistant_id', 'date_creation', 'voice_id'),
+        Index('ix_pendingwork_voice_id', 'voice_id'),
+        Index('ix_pendingwork_doctor_id_assistant_id', 'doctor_id', 'assistant_id'),
+    )
@@ -1,6 +1,6 @@
 from typing import TYPE_CHECKING
 
-from sqlalchemy import Column, ForeignKey, Integer, String, Boolean, DateTime
+from sqlalchemy import Column, ForeignKey, Integer, String, Boolean, DateTime, Index
 from sqlalchemy.orm import relationship, backref
 
 from app.db.base_class import Base
@@ -12,13 +12,17 @@ if TYPE_CHECKING:
 
 
 class RemarqueNote(Base):
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     
-    remarque = Column(String, index=True)
+    remarque = Column(String)
     seen = Column(Boolean(), default=False)
     
     note_id = Column(Integer, ForeignKey("note.id"))
     note = relationship("Note", foreign_keys=[note_id], backref=backref("note", uselist=False))
 
     creator_id = Column(Integer, ForeignKey("user.id"), nullable=False)
-    date_creation = Column(DateTime, nullable= False)
\ No newline at end of file
+    date_creation = Column(DateTime, nullable= False)
+
+    __table_args__ = (
+        Index('ix_remarquenote_note_id', 'note_id', 'date_creation', 'id'),
+    )
\ No newline at end of file
@@ -0,0 +1,12 @@
+from sqlalchemy import Column, ForeignKey, Integer, String
+
+from app.db.base_class import Base
+
+
+# number of voices or notes of a user (as doctor, patient or assistant) having a status,
+# maintained by crud.scope_counter in the transactions changing the voices and the notes
+class ScopeCounter(Base):
+    scope = Column(String, primary_key=True)
+    scope_id = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), primary_key=True)
+    status = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
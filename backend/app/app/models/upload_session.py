@@ -0,0 +1,26 @@
+from typing import TYPE_CHECKING
+
+from sqlalchemy import Column, ForeignKey, Integer, String, DateTime
+
+from app.db.base_class import Base
+
+if TYPE_CHECKING:
+    from .user import User  # noqa: F401
+
+
+class UploadSession(Base):
+    id = Column(String, primary_key=True)
+
+    path = Column(String, nullable=False)
+    filename = Column(String, nullable=False)
+    title = Column(String, nullable=True)
+    remarque = Column(String, nullable=True)
+
+    doctor_id = Column(Integer, ForeignKey("user.id"))
+    patient_id = Column(Integer, ForeignKey("user.id"))
+
+    total_size = Column(Integer, nullable=True)
+    received = Column(Integer, nullable=False, default=0)
+
+    date_creation = Column(DateTime(), nullable=False)
+    date_expiration = Column(DateTime(), nullable=False, index=True)
@@ -1,6 +1,6 @@
 from typing import TYPE_CHECKING
 
-from sqlalchemy import Boolean, Column, Integer, String, DateTime
+from sqlalchemy import Boolean, Column, Integer, String, DateTime, Index, func
 from sqlalchemy.orm import relationship
 
 from app.db.base_class import Base
@@ -10,10 +10,10 @@ if TYPE_CHECKING:
 
 
 class User(Base):
-    id = Column(Integer, primary_key=True, index=True)
-    full_name = Column(String, index=True)
+    id = Column(Integer, primary_key=True)
+    full_name = Column(String)
     email = Column(String, unique=True, index=True, nullable=False)
-    birth_date = Column(DateTime, nullable=True)
+    birth_date = Column(DateTime, nullable=True, index=True)
     role = Column(String, nullable=True)
     hashed_password = Column(String, nullable=False)
     is_active = Column(Boolean(), default=True)
@@ -22,4 +22,9 @@ class User(Base):
     profile_bs64 = Column(String, nullable=True)
     firebase_device_token = Column(String, nullable=True)
     #items = relationship("Item", back_populates="owner")
-    
+
+    # lowercase and unaccented names searched by trigrams, f_unaccent is created by a migration
+    __table_args__ = (
+        Index('ix_user_full_name_trgm', func.f_unaccent(func.lower(full_name)).label('full_name_folded'),
+            postgresql_using='gin', postgresql_ops={'full_name_folded': 'gin_trgm_ops'}),
+    )
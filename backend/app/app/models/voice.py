@@ -1,6 +1,7 @@
 from typing import TYPE_CHECKING
 
-from sqlalchemy import Column, ForeignKey, Integer, String, Boolean, DateTime, Boolean
+from sqlalchemy import Column, FetchedValue, ForeignKey, Integer, String, Boolean, DateTime, Boolean, Float, Index
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import relationship
 
 from app.db.base_class import Base
@@ -10,12 +11,25 @@ if TYPE_CHECKING:
 
 
 class Voice(Base):
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     
-    path = Column(String, index=True, nullable=False)
-    title = Column(String, index=True, nullable=True)
-    remarque = Column(String, index=True, nullable=True)
+    path = Column(String, nullable=False)
+    title = Column(String, nullable=True)
+    # setweight(to_tsvector(title), 'A'), written by a trigger created by a migration,
+    # the title weighs more than the content of the note in the search ranking
+    search_vector = Column(TSVECTOR, server_default=FetchedValue(), server_onupdate=FetchedValue())
+    remarque = Column(String, nullable=True)
     note_created = Column(Boolean(), default=False)
+    # the stored file has been transcoded to the compact speech format
+    transcoded = Column(Boolean(), default=False)
+    # content addressed key of the uploaded file before it was transcoded, a new upload
+    # of the same recording reuses the transcoded file
+    original_path = Column(String, nullable=True)
+    # seconds, computed after the upload with the waveform peaks sidecar of the file
+    duration = Column(Float(), nullable=True)
+    sample_rate = Column(Integer, nullable=True)
+    # set once the file is archived in the cold storage and removed from the voice storage
+    cold_path = Column(String, nullable=True)
     
     doctor_id = Column(Integer, ForeignKey("user.id"))
     doctor = relationship("User", foreign_keys=[doctor_id], backref="voices")
@@ -24,4 +38,14 @@ class Voice(Base):
     patient = relationship("User", foreign_keys=[patient_id])
                     
     date_creation = Column(DateTime(), nullable= False)
-    folder_id = Column(String, nullable= True)
\ No newline at end of file
+    folder_id = Column(String, nullable= True)
+
+    # the listings filter on these columns and are ordered by (date_creation, id)
+    __table_args__ = (
+        Index('ix_voice_doctor_id_note_created', 'doctor_id', 'note_created', 'date_creation', 'id'),
+        Index('ix_voice_patient_id_doctor_id', 'patient_id', 'doctor_id', 'date_creation', 'id'),
+        # the path is only compared for equality
+        Index('ix_voice_path_hash', 'path', postgresql_using='hash'),
+        Index('ix_voice_original_path_hash', 'original_path', postgresql_using='hash'),
+        Index('ix_voice_search_vector', 'search_vector', postgresql_using='gin'),
+    )
\ No newline at end of file
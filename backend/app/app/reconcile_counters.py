@@ -0,0 +1,57 @@
+import argparse
+import logging
+import time
+
+from sqlalchemy import func
+
+from app import crud
+from app.crud.crud_scope_counter import SCOPES
+from app.db import base  # noqa: F401
+from app.db.session import SessionLocal
+from app.models.user import User
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def reconcile(*, batch_size: int, pause: float) -> int:
+    """
+    Count the voices and notes of the users again and correct their counters, batch_size users
+    at a time with a transaction per batch. Return the number of corrected counters.
+    """
+    db = SessionLocal()
+    corrected = 0
+    try:
+        max_id = db.query(func.max(User.id)).scalar() or 0
+        db.rollback()
+        for scope in SCOPES:
+            for min_id in range(0, max_id + 1, batch_size):
+                corrections = crud.scope_counter.reconcile(
+                    db, scope=scope, min_id=min_id, max_id=min_id + batch_size - 1)
+                db.commit()
+                for (_, scope_id, status), count in sorted(corrections.items()):
+                    logger.warning(f"{scope} {scope_id} {status}: corrected by {count:+d}")
+                corrected += len(corrections)
+                time.sleep(pause)
+    finally:
+        db.close()
+    return corrected
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Check the counters of the voice and note listings against the voices and notes"
+    )
+    parser.add_argument("--batch-size", type=int, default=1000,
+        help="number of users whose counters are checked in a transaction")
+    parser.add_argument("--pause", type=float, default=0.1,
+        help="seconds to wait between two batches")
+    args = parser.parse_args()
+
+    logger.info("Reconciling the counters")
+    corrected = reconcile(batch_size=args.batch_size, pause=args.pause)
+    logger.info(f"{corrected} counters corrected")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+from typing import AsyncIterator, List
+
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.core.config import settings
+from app.db import base  # noqa: F401
+from app.db.session import SessionLocal
+from app.storage import staging
+from app.storage.base import StorageBackend, StoredFile
+from app.storage.cold import ColdTier
+from app.storage.local import LocalStorage
+from app.storage.session import voice_cold_tier, voice_storage
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PEAKS_SUFFIX = staging.peaks_key('')
+
+
+def audio_key(key: str) -> str:
+    """
+    Key of the audio file a stored file belongs to, sidecars belong to their audio file
+    """
+    if key.endswith(PEAKS_SUFFIX):
+        return key[:-len(PEAKS_SUFFIX)]
+    return key
+
+
+async def remove_orphans(
+    db: Session, storage: StorageBackend, stored_files: List[StoredFile], *, purge: bool
+) -> int:
+    """
+    Report the stored files referenced by no voice and remove them if purge is set
+    """
+    existing = crud.voice.get_existing_paths(
+        db, paths=sorted({audio_key(stored_file.key) for stored_file in stored_files}))
+    db.rollback()
+    orphans = 0
+    for stored_file in stored_files:
+        key = audio_key(stored_file.key)
+        if key in existing:
+            continue
+        if purge:
+            # a voice referencing the file can be created until the lock is held
+            crud.voice.lock_path(db, path=key)
+            if crud.voice.count_by_path(db, path=key) > 0:
+                db.rollback()
+                continue
+            await storage.delete(stored_file.key)
+            db.commit()
+        orphans += 1
+        logger.warning(f"orphan {stored_file.key} ({stored_file.size} bytes){' removed' if purge else ''}")
+    return orphans
+
+
+async def reconcile_files(
+    db: Session, storage: StorageBackend, stored_files: AsyncIterator[StoredFile], *,
+    batch_size: int, pause: float, grace: float, purge: bool
+) -> int:
+    """
+    Walk the stored files by batches and look for the ones referenced by no voice.
+    Files more recent than grace seconds are skipped, they can belong to a voice being created.
+    """
+    orphans = 0
+    batch: List[StoredFile] = []
+    async for stored_file in stored_files:
+        if time.time() - stored_file.modified < grace:
+            continue
+        batch.append(stored_file)
+        if len(batch) >= batch_size:
+            orphans += await remove_orphans(db, storage, batch, purge=purge)
+            batch = []
+            await asyncio.sleep(pause)
+    if batch:
+        orphans += await remove_orphans(db, storage, batch, purge=purge)
+    return orphans
+
+
+async def iter_legacy_files(local_storage: LocalStorage) -> AsyncIterator[StoredFile]:
+    """
+    Files stored before the content addressed layout, at the top of the local voice storage.
+    Their voices reference them by their absolute path.
+    """
+    try:
+        entries = sorted(os.scandir(local_storage.root), key=lambda entry: entry.name)
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if entry.is_file(follow_symlinks=False):
+            stat = entry.stat()
+            yield StoredFile(key=local_storage.resolve(entry.name), size=stat.st_size, modified=stat.st_mtime)
+
+
+def upload_session_id(key: str) -> str:
+    """
+    Id of the upload session of a partial file uploads/<session id>.part
+    """
+    name = os.path.basename(key)
+    return name[:-len(staging.PART_SUFFIX)] if name.endswith(staging.PART_SUFFIX) else ''
+
+
+async def reconcile_uploads(db: Session, *, grace: float, purge: bool) -> int:
+    """
+    Report the partial files of resumable uploads whose session does not exist anymore
+    """
+    local_storage = LocalStorage(settings.VOICE_STORAGE_DIR)
+    part_files = [part_file async for part_file in local_storage.iter_files('uploads/')
+        if time.time() - part_file.modified >= grace]
+    existing = crud.upload_session.get_existing_ids(
+        db, ids=sorted({upload_session_id(part_file.key) for part_file in part_files}))
+    db.rollback()
+    leftovers = 0
+    for part_file in part_files:
+        if upload_session_id(part_file.key) in existing:
+            continue
+        if purge:
+            await local_storage.delete(part_file.key)
+        leftovers += 1
+        logger.warning(f"upload leftover {part_file.key} ({part_file.size} bytes){' removed' if purge else ''}")
+    return leftovers
+
+
+async def reconcile_staging(*, max_age: float, purge: bool) -> int:
+    """
+    Report the files left in the staging directory by interrupted uploads
+    """
+    local_storage = LocalStorage(settings.VOICE_STORAGE_DIR)
+    leftovers = 0
+    async for stored_file in local_storage.iter_files('tmp/'):
+        if time.time() - stored_file.modified < max_age:
+            continue
+        if purge:
+            await local_storage.delete(stored_file.key)
+        leftovers += 1
+        logger.warning(f"staging leftover {stored_file.key} ({stored_file.size} bytes){' removed' if purge else ''}")
+    return leftovers
+
+
+async def reconcile_voices(
+    db: Session, storage: StorageBackend, cold_tier: ColdTier, *, batch_size: int, pause: float
+) -> int:
+    """
+    Walk the voices by batches of ids and report the ones whose stored file is missing,
+    the file of archived voices is looked for in the cold storage
+    """
+    missing = 0
+    after_id = 0
+    while True:
+        voices = crud.voice.get_multi_paths(db, after_id=after_id, limit=batch_size)
+        db.rollback()
+        if not voices:
+            return missing
+        after_id = voices[-1].id
+        exists = {}
+        for voice in voices:
+            path = voice.cold_path or voice.path
+            if path not in exists:
+                exists[path] = await (cold_tier.storage if voice.cold_path else storage).exists(path)
+            if not exists[path]:
+                missing += 1
+                logger.warning(f"voice {voice.id} file missing: {path}")
+        await asyncio.sleep(pause)
+
+
+async def reconcile(
+    *, batch_size: int, pause: float, grace: float, staging_age: float, purge: bool
+) -> None:
+    db = SessionLocal()
+    try:
+        orphans = await reconcile_files(db, voice_storage, voice_storage.iter_files('blobs/'),
+            batch_size=batch_size, pause=pause, grace=grace, purge=purge)
+        logger.info(f"{orphans} orphan files {'removed' if purge else 'found'}")
+        # voices stored before the content addressed layout are always on the local volume
+        local_storage = LocalStorage(settings.VOICE_STORAGE_DIR)
+        legacy_orphans = await reconcile_files(db, local_storage, iter_legacy_files(local_storage),
+            batch_size=batch_size, pause=pause, grace=grace, purge=purge)
+        logger.info(f"{legacy_orphans} orphan legacy files {'removed' if purge else 'found'}")
+        leftovers = await reconcile_uploads(db, grace=grace, purge=purge)
+        logger.info(f"{leftovers} upload leftovers {'removed' if purge else 'found'}")
+        leftovers = await reconcile_staging(max_age=staging_age, purge=purge)
+        logger.info(f"{leftovers} staging leftovers {'removed' if purge else 'found'}")
+        missing = await reconcile_voices(db, voice_storage, voice_cold_tier,
+            batch_size=batch_size, pause=pause)
+        logger.info(f"{missing} voices with a missing file")
+    finally:
+        db.close()
+        await voice_storage.close()
+        await voice_cold_tier.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Report the stored files referenced by no voice, the partial files of removed upload sessions "
+            "and the voices whose file is missing"
+    )
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.5,
+        help="seconds to wait between two batches")
+    parser.add_argument("--grace", type=float, default=3600,
+        help="files modified less than these seconds ago are not reported")
+    parser.add_argument("--staging-age", type=float, default=86400,
+        help="staging files older than these seconds are reported")
+    parser.add_argument("--purge", action="store_true",
+        help="remove the orphan files, the upload leftovers and the staging leftovers")
+    args = parser.parse_args()
+
+    logger.info("Reconciling voices storage")
+    asyncio.run(reconcile(batch_size=args.batch_size, pause=args.pause, grace=args.grace,
+        staging_age=args.staging_age, purge=args.purge))
+
+
+if __name__ == "__main__":
+    main()
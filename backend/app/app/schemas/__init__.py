@@ -5,11 +5,14 @@ from .user import User, UserCreate, UserInDB, UserUpdate, Role
 from .user_assistant import Assistant, AssistantCreate, AssistantInDB, AssistantUpdate
 from .user_doctor import Doctor, DoctorCreate, DoctorInDB, DoctorUpdate
 from .user_manager import Manager, ManagerCreate, ManagerInDB, ManagerUpdate
+from .user_patient import PatientMatch
 
-from .voice import Voice, VoiceReduced, VoiceCreate, VoiceCreateUpload, AudioFileVoice, VoiceInDB, VoiceUpdate
-from .note import Note, NoteCreate, NoteInDB, NoteUpdate, NotePlus
+from .voice import Voice, VoiceReduced, VoiceCreate, VoiceCreateUpload, VoiceCreateBatch, AudioFileVoice, VoiceInDB, VoiceUpdate, VoicePeaks, VoicePage, VoiceReducedPage
+from .upload_session import UploadSession, UploadSessionCreate, UploadSessionInDB
+from .note import Note, NoteCreate, NoteInDB, NoteUpdate, NotePlus, NotePage
 from .remarque_note import RemarqueNote, RemarqueNoteCreate, RemarqueNoteInDB, RemarqueNoteUpdate
 from .search_result import Search
+from .stats import Stats
 
 from .doctor_manager import DoctorManager, DoctorManagerCreate, DoctorManagerInDB, DoctorManagerUpdate
 from .doctor_patient import DoctorPatient, DoctorPatientCreate, DoctorPatientInDB, DoctorPatientUpdate
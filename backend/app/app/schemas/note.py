@@ -1,4 +1,4 @@
-from typing import Optional, Union
+from typing import List, Optional, Union
 
 from pydantic import BaseModel
 from datetime import datetime
@@ -51,6 +51,12 @@ class Note(NoteInDBBase):
 class NoteInDB(NoteInDBBase):
     pass
 
+# A page of notes with the size of the whole listing
+class NotePage(BaseModel):
+    items : List[Note]
+    total : int
+    next_cursor : Optional[str] = None
+
 # Note with informations
 class NotePlus(NoteInDBBase):
     doctor_fullname : Optional[str]=''
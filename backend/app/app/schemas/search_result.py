@@ -22,5 +22,8 @@ class Search(BaseModel):
 	assistant_id: Optional[int]
 	modifier_id: Optional[int]
 	note_date_modification: Optional[datetime]
+	# only set when searching a text
+	rank: Optional[float]
+	snippet: Optional[str]
 	class Config:
 		orm_mode = True
\ No newline at end of file
@@ -0,0 +1,16 @@
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+# the counts of the dashboard of a user, the voices and notes they see through their role
+class Stats(BaseModel):
+    role: Optional[str] = None
+    voices: int = 0
+    voices_with_note: int = 0
+    voices_without_note: int = 0
+    notes: int = 0
+    notes_validated: int = 0
+    notes_not_validated: int = 0
+    notes_treated: int = 0
+    notes_not_treated: int = 0
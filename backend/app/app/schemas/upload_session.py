@@ -0,0 +1,40 @@
+from typing import Optional
+
+from pydantic import BaseModel
+from datetime import datetime
+
+
+# Shared properties
+class UploadSessionBase(BaseModel):
+    filename : str
+    doctor_id : int
+    patient_id : int
+    title: Optional[str] = None
+    remarque : Optional[str] = None
+    total_size : Optional[int] = None
+
+
+# Properties to receive on session creation
+class UploadSessionCreate(UploadSessionBase):
+    pass
+
+
+# Properties shared by models stored in DB
+class UploadSessionInDBBase(UploadSessionBase):
+    id: str
+    received : int = 0
+    date_creation : datetime
+    date_expiration : datetime
+
+    class Config:
+        orm_mode = True
+
+
+# Properties to return to client
+class UploadSession(UploadSessionInDBBase):
+    pass
+
+
+# Properties properties stored in DB
+class UploadSessionInDB(UploadSessionInDBBase):
+    path : str
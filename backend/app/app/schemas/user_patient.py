@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import Optional
 
 from pydantic import BaseModel, EmailStr, Field
@@ -37,3 +38,11 @@ class PatientInDB(UserInDB, PatientBase):
     pass
 
 
+class PatientMatch(BaseModel):
+    id: int
+    full_name: Optional[str]
+    birth_date: Optional[datetime]
+    similarity: float
+
+    class Config:
+        orm_mode = True
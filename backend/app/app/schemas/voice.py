@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 import base64
 
 from pydantic import BaseModel, validator, ValidationError
@@ -14,10 +14,9 @@ class VoiceBase(BaseModel):
 
 
 # Properties to receive on item creation
-class VoiceCreateUpload(VoiceBase):
+class VoiceUploadFile(VoiceBase):
     voice_file_b64 : str
     filename : str
-    doctor_id : int
     patient_id : int
     title: Optional[str] = None
     folder_id: Optional[str] = None
@@ -25,15 +24,37 @@ class VoiceCreateUpload(VoiceBase):
 
     @validator('voice_file_b64')
     def validator_voice_file_b64(cls, value):
-        decoded_string = base64.b64encode(base64.b64decode(value))
-        decoded_string = str(decoded_string, 'ascii', 'ignore')
+        # check the size before decoding so that oversized payloads are rejected early
         size_mb = (3*len(value)/4)/10**6
-        if decoded_string != value:
-            raise ValidationError('voice_file_b64 need to be a base64 string')
         if size_mb > 20:
             raise ValidationError('voice_file_b64 file size hsould not exceed 20mb')
+        # the body is validated on the event loop, the base64 string is checked
+        # while it is decoded in a thread (see staging.iter_b64_decode)
         return value
 
+class VoiceCreateUpload(VoiceUploadFile):
+    doctor_id : int
+
+# Recordings of a doctor queued offline and sent together
+class VoiceCreateBatch(VoiceBase):
+    doctor_id : int
+    voices : List[VoiceUploadFile]
+
+    @validator('voices')
+    def validator_voices(cls, value):
+        if not value:
+            raise ValueError('voices should not be empty')
+        if len(value) > 10:
+            raise ValueError('voices should not contain more than 10 voices')
+        return value
+
+class VoicePeaks(BaseModel):
+    duration : float
+    sample_rate : Optional[int] = None
+    peaks_per_second : int
+    # loudest sample of each interval, from 0 to 255
+    peaks : List[int]
+
 class AudioFileVoice(BaseModel):
     voice_file_b64 : str
 
@@ -54,6 +75,11 @@ class VoiceCreate(VoiceBase):
     patient_id : int
     title: Optional[str] = None
     remarque : Optional[str] = None
+    # set when the recording was already uploaded and its transcoded file is reused
+    original_path : Optional[str] = None
+    transcoded : bool = False
+    duration : Optional[float] = None
+    sample_rate : Optional[int] = None
 
 
 # Properties to receive on item update
@@ -72,6 +98,8 @@ class VoiceInDBBase(VoiceBase):
     remarque: Optional[str]=None
     date_creation : datetime
     note_created : bool = False
+    duration: Optional[float] = None
+    sample_rate: Optional[int] = None
 
     class Config:
         orm_mode = True
@@ -83,6 +111,8 @@ class VoiceInDBBaseReduced(VoiceBase):
     title: Optional[str]=None
     date_creation : datetime
     note_created : bool = False
+    duration: Optional[float] = None
+    sample_rate: Optional[int] = None
 
     class Config:
         orm_mode = True
@@ -97,3 +127,14 @@ class VoiceReduced(VoiceInDBBaseReduced):
 # Properties properties stored in DB
 class VoiceInDB(VoiceInDBBase):
     pass
+
+# A page of voices with the size of the whole listing
+class VoicePage(BaseModel):
+    items : List[Voice]
+    total : int
+    next_cursor : Optional[str] = None
+
+class VoiceReducedPage(BaseModel):
+    items : List[VoiceReduced]
+    total : int
+    next_cursor : Optional[str] = None
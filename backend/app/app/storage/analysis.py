@@ -0,0 +1,155 @@
+import json
+import logging
+import subprocess
+from array import array
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app import crud
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.storage import staging
+from app.storage.base import StorageBackend
+from app.storage.transcode import run_in_ffmpeg_executor
+
+logger = logging.getLogger(__name__)
+
+# the audio is decoded at a low rate, enough for a waveform overview
+PEAKS_DECODE_RATE = 8000
+
+
+class AudioInfo(NamedTuple):
+    duration: float
+    sample_rate: Optional[int]
+    peaks: bytes
+
+
+def probe_sample_rate(path: str) -> Optional[int]:
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-select_streams', 'a:0', '-show_entries', 'stream=sample_rate',
+         '-of', 'json', path],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=settings.VOICE_TRANSCODE_TIMEOUT)
+    try:
+        return int(json.loads(result.stdout.decode())['streams'][0]['sample_rate'])
+    except (ValueError, KeyError, IndexError):
+        return None
+
+
+def compute_peaks(path: str) -> Optional[AudioInfo]:
+    """
+    Decode the audio to mono 16 bits samples and keep the loudest sample of each bucket.
+    The duration is counted from the decoded samples, the headers of some files are wrong.
+    """
+    bucket_size = PEAKS_DECODE_RATE // settings.VOICE_PEAKS_PER_SECOND
+    process = subprocess.Popen(
+        ['ffmpeg', '-nostdin', '-v', 'error', '-i', path, '-vn', '-ac', '1',
+         '-ar', str(PEAKS_DECODE_RATE), '-f', 's16le', '-'],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    peaks: List[int] = []
+    samples = 0
+    pending = b''
+    try:
+        while True:
+            data = process.stdout.read(bucket_size * 2 * 256)
+            if not data:
+                break
+            pending += data
+            # keep an even number of bytes and complete buckets for the next read
+            usable = len(pending) - len(pending) % (bucket_size * 2)
+            peaks.extend(_bucket_peaks(pending[:usable], bucket_size))
+            samples += usable // 2
+            pending = pending[usable:]
+        process.wait(timeout=settings.VOICE_TRANSCODE_TIMEOUT)
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+    pending = pending[:len(pending) - len(pending) % 2]
+    if pending:
+        peaks.extend(_bucket_peaks(pending, bucket_size))
+        samples += len(pending) // 2
+    if process.returncode != 0 or samples == 0:
+        return None
+    return AudioInfo(duration=samples / PEAKS_DECODE_RATE, sample_rate=probe_sample_rate(path),
+        peaks=bytes(peaks))
+
+
+def _bucket_peaks(data: bytes, bucket_size: int) -> List[int]:
+    samples = array('h')
+    samples.frombytes(data)
+    peaks = []
+    for start in range(0, len(samples), bucket_size):
+        bucket = samples[start:start + bucket_size]
+        peak = max(max(bucket), -min(bucket))
+        peaks.append(min(255, peak * 255 // 32767))
+    return peaks
+
+
+async def analyze_voice(voice_id: int, storage: StorageBackend) -> bool:
+    """
+    Store the duration, the sample rate and the waveform peaks of a voice,
+    the voices sharing the same stored file get the same values.
+    The session is used from the threadpool, waiting for the lock must not block the event loop.
+    """
+    db = SessionLocal()
+    original = None
+    peaks_file = None
+    try:
+        path = await run_in_threadpool(_path_to_analyze, db, voice_id=voice_id)
+        if path is None:
+            return False
+        size = await storage.size(path)
+        if not size:
+            logger.warning(f"the audio file of voice {voice_id} not found, not analyzed")
+            return False
+
+        original = await staging.stage_stream(
+            storage.iter_range(path, start=0, end=size - 1), path, max_bytes=size)
+        info = await run_in_ffmpeg_executor(compute_peaks, original.tmp_path)
+        if info is None:
+            logger.warning(f"the audio file of voice {voice_id} can not be decoded, not analyzed")
+            return False
+
+        peaks_file = await staging.stage_bytes(info.peaks, path)
+        if not await run_in_threadpool(_lock_path, db, path=path):
+            # deleted or transcoded while it was analyzed
+            return False
+        try:
+            await storage.save(staging.peaks_key(path), peaks_file.tmp_path)
+            await run_in_threadpool(_commit_audio_info, db, path=path, info=info)
+        except BaseException:
+            await run_in_threadpool(db.rollback)
+            raise
+        return True
+    finally:
+        if original is not None:
+            staging.discard(original.tmp_path)
+        if peaks_file is not None:
+            staging.discard(peaks_file.tmp_path)
+        await run_in_threadpool(db.close)
+
+
+def _path_to_analyze(db: Session, *, voice_id: int) -> Optional[str]:
+    voice = crud.voice.get_by_voice_id(db, id=voice_id)
+    path = voice.path if voice and voice.duration is None else None
+    # do not keep the transaction open while ffmpeg runs
+    db.rollback()
+    return path
+
+
+def _lock_path(db: Session, *, path: str) -> bool:
+    """
+    Lock the stored file, False is returned if it is not referenced anymore
+    """
+    crud.voice.lock_path(db, path=path)
+    if crud.voice.count_by_path(db, path=path) == 0:
+        db.rollback()
+        return False
+    return True
+
+
+def _commit_audio_info(db: Session, *, path: str, info: AudioInfo) -> None:
+    crud.voice.update_audio_info(db, path=path, duration=info.duration, sample_rate=info.sample_rate)
+    db.commit()
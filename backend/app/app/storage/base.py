@@ -0,0 +1,75 @@
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, NamedTuple, Optional
+
+from app.storage.staging import StagedBlob, discard
+
+
+class StoredFile(NamedTuple):
+    key: str
+    size: int
+    # unix timestamp of the last modification
+    modified: float
+
+
+class StorageBackend(ABC):
+    """
+    Where the voice files are stored, keys are relative paths like blobs/ab/cd/<sha256>.mp3
+    """
+
+    async def exists(self, key: str) -> bool:
+        return await self.size(key) is not None
+
+    @abstractmethod
+    async def size(self, key: str) -> Optional[int]:
+        """
+        Size in bytes of the stored file, None if it does not exist
+        """
+
+    @abstractmethod
+    async def save(self, key: str, path: str) -> None:
+        """
+        Store the local file at path under key, the local file can be moved or copied
+        """
+
+    @abstractmethod
+    def iter_range(self, key: str, *, start: int, end: int) -> AsyncIterator[bytes]:
+        """
+        Read the bytes start to end (included) of the stored file by chunks
+        """
+
+    @abstractmethod
+    def iter_files(self, prefix: str) -> AsyncIterator[StoredFile]:
+        """
+        List the stored files whose key starts with prefix, one by one without loading the whole listing
+        """
+
+    async def read(self, key: str) -> bytes:
+        chunks = []
+        size = await self.size(key)
+        if size:
+            async for chunk in self.iter_range(key, start=0, end=size - 1):
+                chunks.append(chunk)
+        return b''.join(chunks)
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        """
+        Remove the stored file, nothing is done if it does not exist
+        """
+
+    async def close(self) -> None:
+        pass
+
+    async def store(self, staged: StagedBlob) -> str:
+        """
+        Store a staged file under its content addressed key and return the key.
+        If the same content is already stored the staged file is dropped.
+        Must be called while holding the lock of the key (see crud.voice.lock_path)
+        so that a concurrent delete of the last reference can not remove the blob.
+        """
+        if await self.exists(staged.key):
+            discard(staged.tmp_path)
+        else:
+            await self.save(staged.key, staged.tmp_path)
+            discard(staged.tmp_path)
+        return staged.key
@@ -0,0 +1,104 @@
+import gzip
+import os
+import shutil
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.storage import staging
+from app.storage.base import StorageBackend
+from app.storage.local import LocalStorage
+
+COLD_PREFIX = 'cold/'
+COMPRESSED_SUFFIX = '.gz'
+
+
+def _compress_file(path: str, compressed_path: str) -> bool:
+    """
+    Compress the file at path to compressed_path by chunks, return False if it is not worth it
+    """
+    with open(path, 'rb') as in_file, gzip.open(compressed_path, 'wb') as out_file:
+        shutil.copyfileobj(in_file, out_file, settings.VOICE_UPLOAD_CHUNK_SIZE)
+    # encoded audio barely compresses, it is then archived as it is
+    return os.path.getsize(compressed_path) < os.path.getsize(path) * 0.95
+
+
+def _decompress_file(compressed_path: str, path: str) -> None:
+    with gzip.open(compressed_path, 'rb') as in_file, open(path, 'wb') as out_file:
+        shutil.copyfileobj(in_file, out_file, settings.VOICE_UPLOAD_CHUNK_SIZE)
+
+
+class ColdTier:
+    """
+    Voices archived in a cold storage, compressed when it is worth it.
+    They are rehydrated on demand in a small local cache, the least recently played are evicted.
+    """
+
+    def __init__(self, storage: StorageBackend, *, cache_dir: str, cache_max_bytes: int):
+        self.storage = storage
+        self.cache = LocalStorage(cache_dir)
+        self.cache_max_bytes = cache_max_bytes
+
+    async def archive(self, key: str, path: str) -> str:
+        """
+        Store the local file at path as the cold copy of key and return the cold key,
+        the local file can be moved
+        """
+        compressed_path = path + COMPRESSED_SUFFIX
+        try:
+            if await run_in_threadpool(_compress_file, path, compressed_path):
+                cold_key = COLD_PREFIX + key + COMPRESSED_SUFFIX
+                await self.storage.save(cold_key, compressed_path)
+            else:
+                cold_key = COLD_PREFIX + key
+                await self.storage.save(cold_key, path)
+        finally:
+            staging.discard(compressed_path)
+        return cold_key
+
+    async def rehydrate(self, key: str, cold_key: str) -> bool:
+        """
+        Make sure the rehydrated file of key is in the cache, return False if the cold copy is missing
+        """
+        cached_path = self.cache.resolve(key)
+        if os.path.isfile(cached_path):
+            # the modification time orders the cache from the least recently played
+            os.utime(cached_path)
+            return True
+        size = await self.storage.size(cold_key)
+        if size is None:
+            return False
+        staged = await staging.stage_stream(
+            self.storage.iter_range(cold_key, start=0, end=size - 1), key, max_bytes=size)
+        try:
+            if cold_key.endswith(COMPRESSED_SUFFIX):
+                decompressed_path = staged.tmp_path + '.raw'
+                try:
+                    await run_in_threadpool(_decompress_file, staged.tmp_path, decompressed_path)
+                    await self.cache.save(key, decompressed_path)
+                finally:
+                    staging.discard(decompressed_path)
+            else:
+                await self.cache.save(key, staged.tmp_path)
+        finally:
+            staging.discard(staged.tmp_path)
+        await self.evict(keep=key)
+        return True
+
+    async def evict(self, *, keep: str) -> None:
+        cached_files = [cached_file async for cached_file in self.cache.iter_files('')]
+        total = sum(cached_file.size for cached_file in cached_files)
+        for cached_file in sorted(cached_files, key=lambda cached_file: cached_file.modified):
+            if total <= self.cache_max_bytes:
+                return
+            if cached_file.key == keep:
+                continue
+            await self.cache.delete(cached_file.key)
+            total -= cached_file.size
+
+    async def delete(self, key: str, cold_key: str) -> None:
+        await self.storage.delete(cold_key)
+        await self.cache.delete(key)
+
+    async def close(self) -> None:
+        await self.storage.close()
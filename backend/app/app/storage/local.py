@@ -0,0 +1,71 @@
+import os
+import shutil
+from typing import AsyncIterator, Iterator, Optional
+
+import aiofiles
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.storage.base import StorageBackend, StoredFile
+
+
+class LocalStorage(StorageBackend):
+    """
+    Voice files stored on a local or shared volume
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def resolve(self, key: str) -> str:
+        """
+        Absolute path of a stored file.
+        Voices stored before the content addressed layout have an absolute path as key.
+        """
+        return os.path.abspath(os.path.join(self.root, key))
+
+    async def size(self, key: str) -> Optional[int]:
+        path = self.resolve(key)
+        if not os.path.isfile(path):
+            return None
+        return os.path.getsize(path)
+
+    async def save(self, key: str, path: str) -> None:
+        target = self.resolve(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # a copy when the staging directory is on another volume
+        await run_in_threadpool(shutil.move, path, target)
+
+    async def iter_range(self, key: str, *, start: int, end: int) -> AsyncIterator[bytes]:
+        remaining = end - start + 1
+        async with aiofiles.open(self.resolve(key), 'rb') as in_file:
+            await in_file.seek(start)
+            while remaining > 0:
+                chunk = await in_file.read(min(settings.VOICE_UPLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    async def delete(self, key: str) -> None:
+        try:
+            os.remove(self.resolve(key))
+        except OSError:
+            pass
+
+    async def iter_files(self, prefix: str) -> AsyncIterator[StoredFile]:
+        for stored_file in self._walk(prefix.rstrip('/')):
+            yield stored_file
+
+    def _walk(self, relative_dir: str) -> Iterator[StoredFile]:
+        try:
+            entries = sorted(os.scandir(self.resolve(relative_dir)), key=lambda entry: entry.name)
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            key = os.path.join(relative_dir, entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                yield from self._walk(key)
+            elif entry.is_file(follow_symlinks=False):
+                stat = entry.stat()
+                yield StoredFile(key=key, size=stat.st_size, modified=stat.st_mtime)
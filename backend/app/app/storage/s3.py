@@ -0,0 +1,95 @@
+import asyncio
+from contextlib import AsyncExitStack
+from typing import Any, AsyncIterator, Optional
+
+from app.core.config import settings
+from app.storage.base import StorageBackend, StoredFile
+
+try:
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+    from botocore.exceptions import ClientError
+except ImportError:  # pragma: no cover
+    get_session = None
+
+
+class S3Storage(StorageBackend):
+    """
+    Voice files stored in an S3 compatible bucket (AWS S3, MinIO, ...).
+    A single client is created per process, its connections are pooled.
+    """
+
+    def __init__(
+        self, *, bucket: str, endpoint_url: Optional[str] = None, region: Optional[str] = None,
+        access_key_id: Optional[str] = None, secret_access_key: Optional[str] = None,
+        max_pool_connections: int = 20
+    ):
+        if get_session is None:
+            raise RuntimeError("aiobotocore is required for the s3 storage backend, install the s3 extra")
+        self.bucket = bucket
+        self.client_kwargs = dict(
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key,
+            config=AioConfig(max_pool_connections=max_pool_connections),
+        )
+        self._client: Any = None
+        self._exit_stack: Optional[AsyncExitStack] = None
+        self._lock = asyncio.Lock()
+
+    async def client(self) -> Any:
+        if self._client is None:
+            async with self._lock:
+                if self._client is None:
+                    exit_stack = AsyncExitStack()
+                    self._client = await exit_stack.enter_async_context(
+                        get_session().create_client('s3', **self.client_kwargs))
+                    self._exit_stack = exit_stack
+        return self._client
+
+    async def close(self) -> None:
+        if self._exit_stack is not None:
+            await self._exit_stack.aclose()
+        self._client = None
+        self._exit_stack = None
+
+    async def size(self, key: str) -> Optional[int]:
+        client = await self.client()
+        try:
+            response = await client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return response['ContentLength']
+
+    async def save(self, key: str, path: str) -> None:
+        client = await self.client()
+        with open(path, 'rb') as in_file:
+            await client.put_object(Bucket=self.bucket, Key=key, Body=in_file)
+
+    async def iter_range(self, key: str, *, start: int, end: int) -> AsyncIterator[bytes]:
+        client = await self.client()
+        response = await client.get_object(Bucket=self.bucket, Key=key, Range=f'bytes={start}-{end}')
+        body = response['Body']
+        try:
+            while True:
+                chunk = await body.read(settings.VOICE_UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+    async def delete(self, key: str) -> None:
+        client = await self.client()
+        await client.delete_object(Bucket=self.bucket, Key=key)
+
+    async def iter_files(self, prefix: str) -> AsyncIterator[StoredFile]:
+        client = await self.client()
+        paginator = client.get_paginator('list_objects_v2')
+        async for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for stored_object in page.get('Contents', []):
+                yield StoredFile(key=stored_object['Key'], size=stored_object['Size'],
+                    modified=stored_object['LastModified'].timestamp())
@@ -0,0 +1,35 @@
+import os
+
+from app.core.config import settings
+from app.storage.base import StorageBackend
+from app.storage.cold import ColdTier
+from app.storage.local import LocalStorage
+
+
+def create_storage() -> StorageBackend:
+    if settings.VOICE_STORAGE_BACKEND == "s3":
+        from app.storage.s3 import S3Storage
+        return S3Storage(
+            bucket=settings.S3_BUCKET,
+            endpoint_url=settings.S3_ENDPOINT_URL,
+            region=settings.S3_REGION,
+            access_key_id=settings.S3_ACCESS_KEY_ID,
+            secret_access_key=settings.S3_SECRET_ACCESS_KEY,
+            max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+        )
+    return LocalStorage(settings.VOICE_STORAGE_DIR)
+
+
+def create_cold_tier(storage: StorageBackend) -> ColdTier:
+    # without a cold volume the archives are kept under cold/ in the voice storage,
+    # e.g. with a bucket lifecycle rule moving cold/ to a cheaper storage class
+    cold_storage = storage
+    if settings.VOICE_COLD_STORAGE_DIR:
+        cold_storage = LocalStorage(settings.VOICE_COLD_STORAGE_DIR)
+    return ColdTier(cold_storage,
+        cache_dir=os.path.join(settings.VOICE_STORAGE_DIR, 'rehydrated'),
+        cache_max_bytes=settings.VOICE_REHYDRATED_CACHE_MB * 10**6)
+
+
+voice_storage = create_storage()
+voice_cold_tier = create_cold_tier(voice_storage)
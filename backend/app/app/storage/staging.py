@@ -0,0 +1,210 @@
+import base64
+import hashlib
+import os
+import re
+import shutil
+import uuid
+from typing import AsyncIterator, Iterator, NamedTuple
+
+import aiofiles
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+
+
+# partial files of the resumable upload sessions, uploads/<session id>.part
+PART_SUFFIX = '.part'
+# base64 characters decoded at once, a multiple of 4. A chunk takes a few milliseconds,
+# about the switch interval of the GIL, the event loop gets it back without waiting long.
+B64_DECODE_CHUNK_SIZE = 1024 * 1024
+
+
+class VoiceTooLarge(Exception):
+    pass
+
+
+class StagedBlob(NamedTuple):
+    """
+    A file written in the staging directory, not yet moved to its content addressed key
+    """
+    tmp_path: str
+    key: str
+    size: int
+
+
+def max_voice_bytes() -> int:
+    return settings.VOICE_MAX_SIZE_MB * 10**6
+
+
+def blob_key(sha256: str, filename: str) -> str:
+    """
+    Content addressed key of a voice, the extension of the client filename is kept
+    so that the media type of the audio can still be guessed.
+    """
+    extension = os.path.splitext(os.path.basename(filename))[1].lower()
+    if not re.fullmatch(r'\.[a-z0-9]{1,8}', extension):
+        extension = ''
+    # fan out on the first bytes of the hash to keep directories small
+    return os.path.join('blobs', sha256[:2], sha256[2:4], sha256 + extension)
+
+
+def peaks_key(key: str) -> str:
+    """
+    Key of the sidecar holding the waveform peaks of a stored file, one unsigned byte per peak
+    """
+    return key + '.peaks'
+
+
+def is_sharded_key(key: str) -> bool:
+    return re.fullmatch(r'blobs/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.[a-z0-9]{1,8})?', key) is not None
+
+
+def _staging_path() -> str:
+    staging_dir = os.path.join(settings.VOICE_STORAGE_DIR, 'tmp')
+    os.makedirs(staging_dir, exist_ok=True)
+    return os.path.join(staging_dir, uuid.uuid4().hex)
+
+
+async def stage_stream(
+    chunks: AsyncIterator[bytes], filename: str, *, max_bytes: int
+) -> StagedBlob:
+    """
+    Write the chunks to the staging directory as they arrive while hashing them.
+    Raise VoiceTooLarge as soon as max_bytes is exceeded, the partial file is removed.
+    """
+    tmp_path = _staging_path()
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(tmp_path, 'wb') as out_file:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise VoiceTooLarge(filename)
+                sha256.update(chunk)
+                await out_file.write(chunk)
+    except BaseException:
+        discard(tmp_path)
+        raise
+    return StagedBlob(tmp_path=tmp_path, key=blob_key(sha256.hexdigest(), filename), size=size)
+
+
+async def stage_bytes(data: bytes, filename: str) -> StagedBlob:
+    tmp_path = _staging_path()
+    async with aiofiles.open(tmp_path, 'wb') as out_file:
+        await out_file.write(data)
+    # hashlib releases the GIL on large buffers, the event loop keeps running
+    sha256 = await run_in_threadpool(_sha256_hex, data)
+    return StagedBlob(tmp_path=tmp_path, key=blob_key(sha256, filename), size=len(data))
+
+
+def _sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def iter_b64_decode(encoded: str) -> Iterator[bytes]:
+    """
+    Decode a base64 voice by chunks and check that it is a canonical base64 string, raise ValueError otherwise.
+    A thread decoding a large voice hands the GIL back between two chunks.
+    """
+    chunk_size = B64_DECODE_CHUNK_SIZE
+    for start in range(0, len(encoded), chunk_size):
+        chunk = encoded[start:start + chunk_size]
+        # the padding is only allowed at the end of the string
+        if start + chunk_size < len(encoded) and chunk.endswith('='):
+            raise ValueError('voice_file_b64 need to be a base64 string')
+        decoded = base64.b64decode(chunk, validate=True)
+        if base64.b64encode(decoded).decode('ascii') != chunk:
+            raise ValueError('voice_file_b64 need to be a base64 string')
+        yield decoded
+
+
+def decode_b64(encoded: str) -> bytes:
+    return b''.join(iter_b64_decode(encoded))
+
+
+def _stage_b64_file(encoded: str, filename: str) -> StagedBlob:
+    tmp_path = _staging_path()
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, 'wb') as out_file:
+            for decoded in iter_b64_decode(encoded):
+                size += len(decoded)
+                sha256.update(decoded)
+                out_file.write(decoded)
+    except BaseException:
+        discard(tmp_path)
+        raise
+    return StagedBlob(tmp_path=tmp_path, key=blob_key(sha256.hexdigest(), filename), size=size)
+
+
+async def stage_b64(encoded: str, filename: str) -> StagedBlob:
+    """
+    Decode, hash and write a base64 voice in a thread, raise ValueError if it is not valid base64
+    """
+    return await run_in_threadpool(_stage_b64_file, encoded, filename)
+
+
+def file_sha256(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as in_file:
+        for chunk in iter(lambda: in_file.read(settings.VOICE_UPLOAD_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def stage_file(path: str, filename: str) -> StagedBlob:
+    """
+    Hash a file already written in the storage, e.g. a completed upload session
+    """
+    return StagedBlob(tmp_path=path, key=blob_key(file_sha256(path), filename),
+        size=os.path.getsize(path))
+
+
+def stage_copy(path: str, filename: str) -> StagedBlob:
+    """
+    Stage a copy of a file that must be left in place, a hard link is used when possible
+    """
+    tmp_path = _staging_path()
+    try:
+        os.link(path, tmp_path)
+    except OSError:
+        shutil.copyfile(path, tmp_path)
+    return stage_file(tmp_path, filename)
+
+
+def discard(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def upload_session_path(session_id: str) -> str:
+    """
+    Path of the partial file of a resumable upload session
+    """
+    uploads_dir = os.path.join(settings.VOICE_STORAGE_DIR, 'uploads')
+    os.makedirs(uploads_dir, exist_ok=True)
+    return os.path.abspath(os.path.join(uploads_dir, session_id + PART_SUFFIX))
+
+
+def write_file_at(src_path: str, path: str, *, offset: int) -> int:
+    """
+    Write the file at src_path to path starting at offset and return the new size of path.
+    Anything after offset is overwritten, on error the file is truncated back to offset.
+    """
+    size = offset
+    mode = 'r+b' if os.path.exists(path) else 'wb'
+    with open(src_path, 'rb') as in_file, open(path, mode) as out_file:
+        out_file.seek(offset)
+        try:
+            for chunk in iter(lambda: in_file.read(settings.VOICE_UPLOAD_CHUNK_SIZE), b''):
+                out_file.write(chunk)
+                size += len(chunk)
+        except BaseException:
+            out_file.truncate(offset)
+            raise
+        out_file.truncate(size)
+    return size
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app import crud
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.storage import staging
+from app.storage.base import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+TRANSCODED_EXTENSION = '.ogg'
+
+# ffmpeg is cpu bound, only a few jobs run at the same time per process. The waiting jobs are queued
+# in their own pool, they hold no thread of the threadpool the endpoints and the sessions run in
+ffmpeg_executor = ThreadPoolExecutor(max_workers=settings.VOICE_TRANSCODE_CONCURRENCY, thread_name_prefix='ffmpeg')
+
+
+async def run_in_ffmpeg_executor(func: Callable[..., T], *args: Any) -> T:
+    return await asyncio.get_running_loop().run_in_executor(ffmpeg_executor, func, *args)
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which('ffmpeg') is not None and shutil.which('ffprobe') is not None
+
+
+def transcode_available() -> bool:
+    return settings.VOICE_TRANSCODE_ENABLED and ffmpeg_available()
+
+
+def probe_duration(path: str) -> Optional[float]:
+    """
+    Duration in seconds of an audio file, None if it can not be decoded
+    """
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', path],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=settings.VOICE_TRANSCODE_TIMEOUT)
+    try:
+        return float(result.stdout.decode().strip())
+    except ValueError:
+        return None
+
+
+def transcode_file(in_path: str, out_path: str) -> bool:
+    """
+    Encode the audio of in_path to mono opus tuned for speech, return False if ffmpeg failed
+    """
+    result = subprocess.run(
+        ['ffmpeg', '-nostdin', '-v', 'error', '-y', '-i', in_path,
+         '-vn', '-map_metadata', '-1', '-ac', '1',
+         '-c:a', 'libopus', '-b:a', settings.VOICE_TRANSCODE_BITRATE, '-application', 'voip',
+         '-f', 'ogg', out_path],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=settings.VOICE_TRANSCODE_TIMEOUT)
+    if result.returncode != 0:
+        logger.warning(f"ffmpeg failed for {in_path}: {result.stderr.decode(errors='ignore')[-500:]}")
+        return False
+    return True
+
+
+def _same_duration(original: Optional[float], transcoded: Optional[float]) -> bool:
+    if not original or not transcoded:
+        return False
+    return abs(original - transcoded) <= max(0.5, original * 0.02)
+
+
+def _transcode_staged(in_path: str) -> Optional[staging.StagedBlob]:
+    """
+    Transcode a local copy of a voice and check it before it replaces the original.
+    None is returned when the transcoded file is not usable or not smaller.
+    """
+    out_path = in_path + TRANSCODED_EXTENSION
+    try:
+        if transcode_file(in_path, out_path) \
+                and _same_duration(probe_duration(in_path), probe_duration(out_path)) \
+                and os.path.getsize(out_path) < os.path.getsize(in_path):
+            return staging.stage_file(out_path, 'voice' + TRANSCODED_EXTENSION)
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"transcoding {in_path} failed: {e}")
+    staging.discard(out_path)
+    return None
+
+
+async def transcode_voice(voice_id: int, storage: StorageBackend) -> bool:
+    """
+    Replace the stored file of a voice by its compact speech encoding.
+    The original is kept until the transcoded file is stored and checked, then every voice
+    sharing the original points to the transcoded file and the original is removed.
+    The session is used from the threadpool, waiting for the locks must not block the event loop.
+    """
+    db = SessionLocal()
+    original = None
+    staged = None
+    try:
+        path = await run_in_threadpool(_path_to_transcode, db, voice_id=voice_id)
+        if path is None:
+            return False
+        size = await storage.size(path)
+        if not size:
+            logger.warning(f"the audio file of voice {voice_id} not found, not transcoded")
+            return False
+
+        original = await staging.stage_stream(
+            storage.iter_range(path, start=0, end=size - 1), path, max_bytes=size)
+        staged = await run_in_ffmpeg_executor(_transcode_staged, original.tmp_path)
+        if staged is None:
+            # the original is kept, it is not transcoded again
+            await run_in_threadpool(_commit_transcoded_path, db, path=path, new_path=path)
+            return False
+
+        if not await run_in_threadpool(_lock_transcoded_paths, db, path=path, new_path=staged.key):
+            # deleted while it was transcoded
+            return False
+        try:
+            key = await storage.store(staged)
+            staged = None
+            updated = await run_in_threadpool(_commit_transcoded_path, db, path=path, new_path=key)
+        except BaseException:
+            await run_in_threadpool(db.rollback)
+            raise
+        # no voice references the original anymore, new uploads of it are mapped to the transcoded file
+        await storage.delete(path)
+        await storage.delete(staging.peaks_key(path))
+        logger.info(f"{path} transcoded to {key} ({updated} voices)")
+        return True
+    finally:
+        if original is not None:
+            staging.discard(original.tmp_path)
+        if staged is not None:
+            staging.discard(staged.tmp_path)
+        await run_in_threadpool(db.close)
+
+
+def _path_to_transcode(db: Session, *, voice_id: int) -> Optional[str]:
+    voice = crud.voice.get_by_voice_id(db, id=voice_id)
+    path = voice.path if voice and not voice.transcoded else None
+    # do not keep the transaction open while ffmpeg runs
+    db.rollback()
+    return path
+
+
+def _lock_transcoded_paths(db: Session, *, path: str, new_path: str) -> bool:
+    """
+    Lock the original and the transcoded files, False is returned if the original is not referenced anymore
+    """
+    # lock in a fixed order, delete_voice and create_voice lock the same paths
+    for locked_path in sorted({path, new_path}):
+        crud.voice.lock_path(db, path=locked_path)
+    if crud.voice.count_by_path(db, path=path) == 0:
+        db.rollback()
+        return False
+    return True
+
+
+def _commit_transcoded_path(db: Session, *, path: str, new_path: str) -> int:
+    updated = crud.voice.update_transcoded_path(db, path=path, new_path=new_path)
+    db.commit()
+    return updated
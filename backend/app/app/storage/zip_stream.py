@@ -0,0 +1,25 @@
+import io
+from typing import List
+
+
+class ZipStreamBuffer(io.RawIOBase):
+    """
+    Unseekable file for zipfile.ZipFile, the written bytes are collected until they are drained.
+    zipfile then writes the sizes of the entries after their data so nothing is rewritten.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:  # type: ignore
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
@@ -0,0 +1,25 @@
+from typing import Dict
+
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.core.config import settings
+from app.schemas.user import UserCreate
+from app.tests.utils.user import user_authentication_headers
+from app.tests.utils.utils import random_email, random_lower_string
+
+
+def test_read_stats_me_superuser(client: TestClient, superuser_token_headers: Dict[str, str]) -> None:
+    r = client.get(f"{settings.API_V1_STR}/stats/me", headers=superuser_token_headers)
+    assert r.status_code == 200
+    stats = r.json()
+    assert stats["voices"] == stats["voices_with_note"] + stats["voices_without_note"]
+
+
+def test_read_stats_me_without_dashboard(client: TestClient, db: Session) -> None:
+    email, password = random_email(), random_lower_string()
+    crud.user.create(db, obj_in=UserCreate(email=email, password=password, role="admin"))
+    headers = user_authentication_headers(client=client, email=email, password=password)
+    r = client.get(f"{settings.API_V1_STR}/stats/me", headers=headers)
+    assert r.status_code == 403
@@ -0,0 +1,465 @@
+import asyncio
+import base64
+import io
+import json
+import os
+import time
+import zipfile
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.api import deps, pagination
+from app.api.api_v1.endpoints import voices
+from app.core.config import settings
+from app.crud.crud_scope_counter import scope_counter
+from app.main import app
+from app.models.user import User
+from app.models.voice import Voice
+from app.schemas.doctor_patient import DoctorPatientCreate
+from app.schemas.user import UserCreate
+from app.storage import analysis, staging, transcode
+from app.storage.local import LocalStorage
+from app.tests.utils.user import user_authentication_headers
+from app.tests.utils.utils import random_email, random_lower_string
+
+
+class VoiceAuthor(NamedTuple):
+    doctor: User
+    patient: User
+    headers: Dict[str, str]
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch) -> LocalStorage:
+    """
+    Voices stored in a temporary directory, not transcoded nor analyzed
+    """
+    monkeypatch.setattr(settings, "VOICE_STORAGE_DIR", str(tmp_path))
+    monkeypatch.setattr(voices, "transcode_available", lambda: False)
+    monkeypatch.setattr(voices, "ffmpeg_available", lambda: False)
+    storage = LocalStorage(str(tmp_path))
+    app.dependency_overrides[deps.get_storage] = lambda: storage
+    yield storage
+    app.dependency_overrides.pop(deps.get_storage)
+
+
+@pytest.fixture
+def notifications(monkeypatch) -> List[Dict[str, Any]]:
+    sent: List[Dict[str, Any]] = []
+    monkeypatch.setattr(voices, "send_notification_firebase", lambda **kwargs: sent.append(kwargs))
+    return sent
+
+
+def create_user(db: Session, role: str, password: str = "") -> User:
+    return crud.user.create(db, obj_in=UserCreate(email=random_email(), password=password or random_lower_string(),
+        role=role))
+
+
+@pytest.fixture
+def author(client: TestClient, db: Session) -> VoiceAuthor:
+    password = random_lower_string()
+    doctor = create_user(db, "doctor", password)
+    patient = create_user(db, "patient")
+    crud.user.create_doctor_patient(db, obj_in=DoctorPatientCreate(doctor_id=doctor.id, patient_id=patient.id))
+    headers = user_authentication_headers(client=client, email=doctor.email, password=password)
+    return VoiceAuthor(doctor=doctor, patient=patient, headers=headers)
+
+
+def stream_voice(client: TestClient, author: VoiceAuthor, data: bytes, **params: Any) -> Any:
+    params = dict(filename="voice.mp3", doctor_id=author.doctor.id, patient_id=author.patient.id, **params)
+    return client.post(f"{settings.API_V1_STR}/voices/stream", headers=author.headers, params=params, data=data)
+
+
+def test_create_voice_stream(
+    client: TestClient, author: VoiceAuthor, storage: LocalStorage, notifications: list
+) -> None:
+    data = os.urandom(3 * settings.VOICE_UPLOAD_CHUNK_SIZE + 1)
+    r = stream_voice(client, author, data, title="Consultation")
+    assert r.status_code == 200
+    voice = r.json()
+    assert voice["title"] == "Consultation"
+    assert voice["doctor_id"] == author.doctor.id
+    assert voice["path"].endswith(".mp3")
+    with open(storage.resolve(voice["path"]), "rb") as f:
+        assert f.read() == data
+    assert os.listdir(os.path.join(storage.root, "tmp")) == []
+
+
+def test_create_voice_stream_rejected(
+    client: TestClient, db: Session, author: VoiceAuthor, storage: LocalStorage, notifications: list, monkeypatch
+) -> None:
+    monkeypatch.setattr(settings, "VOICE_MAX_SIZE_MB", 1)
+    assert stream_voice(client, author, os.urandom(10**6 + 1)).status_code == 413
+    assert stream_voice(client, author, b"").status_code == 405
+
+    other_doctor = create_user(db, "doctor")
+    r = stream_voice(client, author._replace(doctor=other_doctor), b"abc")
+    assert r.status_code == 401
+    assert os.listdir(os.path.join(storage.root, "tmp")) == []
+    assert not os.path.exists(os.path.join(storage.root, "blobs"))
+
+
+def test_audio_by_id_range(
+    client: TestClient, db: Session, author: VoiceAuthor, storage: LocalStorage, notifications: list
+) -> None:
+    data = os.urandom(1000)
+    voice_id = stream_voice(client, author, data).json()["id"]
+    url = f"{settings.API_V1_STR}/voices/audio/{voice_id}"
+
+    r = client.get(url, headers=author.headers)
+    assert r.status_code == 200
+    assert r.content == data
+    assert r.headers["content-type"] == "audio/mpeg"
+    assert r.headers["accept-ranges"] == "bytes"
+
+    r = client.get(url, headers=dict(author.headers, Range="bytes=100-199"))
+    assert r.status_code == 206
+    assert r.content == data[100:200]
+    assert r.headers["content-range"] == "bytes 100-199/1000"
+    r = client.get(url, headers=dict(author.headers, Range="bytes=-10"))
+    assert r.content == data[-10:]
+    r = client.get(url, headers=dict(author.headers, Range="bytes=990-2000"))
+    assert r.headers["content-range"] == "bytes 990-999/1000"
+    # several ranges are not supported, the whole file is sent
+    assert client.get(url, headers=dict(author.headers, Range="bytes=0-1,5-6")).content == data
+    r = client.get(url, headers=dict(author.headers, Range="bytes=1000-"))
+    assert r.status_code == 416
+    assert r.headers["content-range"] == "bytes */1000"
+
+    password = random_lower_string()
+    other_doctor = create_user(db, "doctor", password)
+    headers = user_authentication_headers(client=client, email=other_doctor.email, password=password)
+    assert client.get(url, headers=headers).status_code == 400
+
+
+def test_audiofile_by_id(
+    client: TestClient, author: VoiceAuthor, storage: LocalStorage, notifications: list
+) -> None:
+    data = os.urandom(1000)
+    voice_id = stream_voice(client, author, data).json()["id"]
+    r = client.get(f"{settings.API_V1_STR}/voices/audiofile/{voice_id}", headers=author.headers)
+    assert r.status_code == 200
+    assert base64.b64decode(r.json()["voice_file_b64"]) == data
+    assert client.get(f"{settings.API_V1_STR}/voices/audiofile/0", headers=author.headers).status_code == 404
+
+
+def test_delete_voice_shared_file(
+    client: TestClient, db: Session, author: VoiceAuthor, storage: LocalStorage, notifications: list
+) -> None:
+    data = os.urandom(100)
+    first, second = [stream_voice(client, author, data).json() for _ in range(2)]
+    assert first["path"] == second["path"]
+    path = storage.resolve(first["path"])
+
+    r = client.delete(f"{settings.API_V1_STR}/voices/{first['id']}", headers=author.headers)
+    assert r.status_code == 200
+    assert r.json()["id"] == first["id"]
+    assert os.path.isfile(path)
+    r = client.delete(f"{settings.API_V1_STR}/voices/{second['id']}", headers=author.headers)
+    assert r.status_code == 200
+    assert not os.path.exists(path)
+    db.expire_all()
+    assert crud.voice.count_by_path(db, path=first["path"]) == 0
+
+
+def test_upload_after_transcode_reuses_transcoded_file(
+    client: TestClient, db: Session, author: VoiceAuthor, storage: LocalStorage, notifications: list, monkeypatch
+) -> None:
+    def fake_transcode(in_path: str) -> staging.StagedBlob:
+        with open(in_path, "rb") as in_file, open(in_path + ".ogg", "wb") as out_file:
+            out_file.write(b"OggS" + in_file.read()[:10])
+        return staging.stage_file(in_path + ".ogg", "voice.ogg")
+
+    monkeypatch.setattr(transcode, "_transcode_staged", fake_transcode)
+    data = os.urandom(100)
+    original = stream_voice(client, author, data).json()
+    assert asyncio.run(transcode.transcode_voice(original["id"], storage))
+    db.expire_all()
+    transcoded = crud.voice.get_by_voice_id(db, id=original["id"])
+    assert transcoded.path.endswith(".ogg")
+    assert transcoded.original_path == original["path"]
+    assert not os.path.exists(storage.resolve(original["path"]))
+
+    # a retry of the same recording is mapped to the transcoded file
+    retry = stream_voice(client, author, data).json()
+    assert retry["path"] == transcoded.path
+    assert crud.voice.get_by_voice_id(db, id=retry["id"]).transcoded
+    assert not os.path.exists(storage.resolve(original["path"]))
+    assert not asyncio.run(transcode.transcode_voice(retry["id"], storage))
+
+
+def test_peaks_by_id(
+    client: TestClient, author: VoiceAuthor, storage: LocalStorage, notifications: list, monkeypatch
+) -> None:
+    monkeypatch.setattr(analysis, "compute_peaks",
+        lambda path: analysis.AudioInfo(duration=1.5, sample_rate=44100, peaks=bytes([0, 128, 255])))
+    voice_id = stream_voice(client, author, os.urandom(100)).json()["id"]
+    url = f"{settings.API_V1_STR}/voices/peaks/{voice_id}"
+    assert client.get(url, headers=author.headers).status_code == 404
+
+    assert asyncio.run(analysis.analyze_voice(voice_id, storage))
+    r = client.get(url, headers=author.headers)
+    assert r.status_code == 200
+    assert r.json() == {"duration": 1.5, "sample_rate": 44100,
+        "peaks_per_second": settings.VOICE_PEAKS_PER_SECOND, "peaks": [0, 128, 255]}
+    assert not asyncio.run(analysis.analyze_voice(voice_id, storage))
+
+
+def create_upload_session(client: TestClient, author: VoiceAuthor, **fields: Any) -> Dict[str, Any]:
+    data = dict(filename="voice.mp3", doctor_id=author.doctor.id, patient_id=author.patient.id, **fields)
+    r = client.post(f"{settings.API_V1_STR}/voices/uploads/", headers=author.headers, json=data)
+    assert r.status_code == 200
+    return r.json()
+
+
+def upload_chunk(client: TestClient, author: VoiceAuthor, session_id: str, offset: int, data: bytes) -> Any:
+    return client.put(f"{settings.API_V1_STR}/voices/uploads/{session_id}", headers=author.headers,
+        params={"offset": offset}, data=data)
+
+
+def test_read_doctor_voices_pages(
+    client: TestClient, author: VoiceAuthor, storage: LocalStorage, notifications: list
+) -> None:
+    voice_ids = [stream_voice(client, author, os.urandom(100)).json()["id"] for _ in range(3)]
+    url = f"{settings.API_V1_STR}/voices/doctor/{author.doctor.id}"
+
+    r = client.get(url, headers=author.headers, params=dict(limit=2))
+    assert [voice["id"] for voice in r.json()] == voice_ids[:0:-1]
+    cursor = r.headers[pagination.NEXT_CURSOR_HEADER]
+    r = client.get(url, headers=author.headers, params=dict(limit=2, cursor=cursor))
+    assert [voice["id"] for voice in r.json()] == voice_ids[:1]
+    assert pagination.NEXT_CURSOR_HEADER not in r.headers
+    assert client.get(url, headers=author.headers, params=dict(cursor="zzz")).status_code == 400
+
+    r = client.get(url, headers=author.headers, params=dict(limit=2, envelope=True))
+    page = r.json()
+    assert [voice["id"] for voice in page["items"]] == voice_ids[:0:-1]
+    assert page["total"] == 3
+    assert page["next_cursor"] == r.headers[pagination.NEXT_CURSOR_HEADER] == cursor
+    page = client.get(url, headers=author.headers, params=dict(limit=2, cursor=cursor, envelope=True)).json()
+    assert page == dict(items=page["items"], total=3, next_cursor=None)
+    assert [voice["id"] for voice in page["items"]] == voice_ids[:1]
+
+
+def test_export_doctor_voices(
+    client: TestClient, author: VoiceAuthor, storage: LocalStorage, notifications: list
+) -> None:
+    data = os.urandom(1000)
+    created = [stream_voice(client, author, content).json() for content in (data, b"abc")]
+    voice_ids = [voice["id"] for voice in created]
+    os.remove(storage.resolve(created[1]["path"]))
+
+    r = client.get(f"{settings.API_V1_STR}/voices/doctor/{author.doctor.id}/export", headers=author.headers)
+    assert r.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(r.content))
+    manifest = json.loads(archive.read("manifest.json"))
+    assert [voice["id"] for voice in manifest["voices"]] == voice_ids
+    # the missing file is listed without its audio
+    assert [voice["file"] for voice in manifest["voices"]] == [f"voices/{voice_ids[0]}.mp3", None]
+    assert archive.read(f"voices/{voice_ids[0]}.mp3") == data
+
+
+async def asgi_request(method: str, path: str, *, headers: Dict[str, str], body: bytes = b"") -> Tuple[int, bytes]:
+    """
+    Call the app on the running event loop, the body is received by chunks like from a server
+    """
+    chunk_size = 64 * 1024
+    chunks = [body[start:start + chunk_size] for start in range(0, len(body), chunk_size)] or [b""]
+    messages: List[dict] = []
+
+    async def receive() -> dict:
+        if not chunks:
+            return {"type": "http.disconnect"}
+        await asyncio.sleep(0)
+        chunk = chunks.pop(0)
+        return {"type": "http.request", "body": chunk, "more_body": bool(chunks)}
+
+    async def send(message: dict) -> None:
+        messages.append(message)
+
+    headers = dict(headers, **{"content-length": str(len(body))})
+    scope = {
+        "type": "http", "http_version": "1.1", "method": method, "scheme": "http", "path": path,
+        "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+        "server": ("testserver", 80), "client": ("testclient", 50000),
+    }
+    await app(scope, receive, send)
+    return messages[0]["status"], b"".join(message.get("body", b"") for message in messages[1:])
+
+
+def test_get_latency_during_uploads(
+    author: VoiceAuthor, storage: LocalStorage, notifications: list
+) -> None:
+    """
+    Large base64 voices are received, decoded, hashed and stored while requests are served
+    on the same event loop
+    """
+    body = json.dumps(dict(voice_file_b64=base64.b64encode(os.urandom(15 * 10**6)).decode(),
+        filename="voice.mp3", doctor_id=author.doctor.id, patient_id=author.patient.id)).encode()
+    headers = dict(author.headers, **{"content-type": "application/json"})
+    path = f"{settings.API_V1_STR}/openapi.json"
+
+    async def run() -> List[float]:
+        latencies: List[float] = []
+        uploading = True
+
+        async def poll() -> None:
+            while uploading:
+                started = time.monotonic()
+                await asyncio.sleep(0.005)
+                assert (await asgi_request("GET", path, headers={}))[0] == 200
+                latencies.append(time.monotonic() - started - 0.005)
+
+        await asgi_request("GET", path, headers={})
+        poller = asyncio.ensure_future(poll())
+        responses = await asyncio.gather(*[
+            asgi_request("POST", f"{settings.API_V1_STR}/voices/", headers=headers, body=body) for _ in range(4)])
+        uploading = False
+        await poller
+        assert [status for status, _ in responses] == [200] * 4
+        assert len({json.loads(content)["path"] for _, content in responses}) == 1
+        return latencies
+
+    latencies = asyncio.run(run())
+    assert len(latencies) > 10
+    # decoding the four voices on the event loop blocks it for several hundred milliseconds
+    assert max(latencies) < 0.2
+
+
+def batch_voice(patient: User, data: bytes, **fields: Any) -> Dict[str, Any]:
+    return dict(voice_file_b64=base64.b64encode(data).decode(), filename="voice.mp3", patient_id=patient.id, **fields)
+
+
+def test_create_voices_batch(
+    client: TestClient, db: Session, author: VoiceAuthor, storage: LocalStorage, notifications: list, monkeypatch
+) -> None:
+    other_patient = create_user(db, "patient")
+    crud.user.create_doctor_patient(db, obj_in=DoctorPatientCreate(doctor_id=author.doctor.id,
+        patient_id=other_patient.id))
+    # the patients of the batch are checked with a single query
+    checked = []
+    get_patients_of_doctor = crud.user.get_patients_of_doctor
+    monkeypatch.setattr(crud.user, "get_patients_of_doctor",
+        lambda **kwargs: checked.append(kwargs["patient_ids"]) or get_patients_of_doctor(**kwargs))
+
+    data = [os.urandom(1000), os.urandom(1000)]
+    r = client.post(f"{settings.API_V1_STR}/voices/batch", headers=author.headers, json=dict(
+        doctor_id=author.doctor.id, voices=[
+            batch_voice(author.patient, data[0], title="first"),
+            batch_voice(other_patient, data[1]),
+            # a recording sent twice shares its file
+            batch_voice(author.patient, data[0], title="again")]))
+    assert r.status_code == 200
+    created = r.json()
+    assert checked == [sorted([author.patient.id, other_patient.id])]
+    assert [voice["title"] for voice in created] == ["first", None, "again"]
+    assert [voice["patient_id"] for voice in created] == [author.patient.id, other_patient.id, author.patient.id]
+    assert created[0]["path"] == created[2]["path"]
+    for voice, content in zip(created, data + data[:1]):
+        with open(storage.resolve(voice["path"]), "rb") as f:
+            assert f.read() == content
+    assert len(notifications) == 1
+    assert notifications[0]["msg_body"]["voice_ids"] == [voice["id"] for voice in created]
+
+
+def test_create_voices_batch_all_or_nothing(
+    client: TestClient, db: Session, author: VoiceAuthor, storage: LocalStorage, notifications: list, monkeypatch
+) -> None:
+    unrelated_patient = create_user(db, "patient")
+    missing_patient = User(id=10**9)
+    for patient, status_code in ((unrelated_patient, 405), (missing_patient, 404)):
+        r = client.post(f"{settings.API_V1_STR}/voices/batch", headers=author.headers, json=dict(
+            doctor_id=author.doctor.id, voices=[batch_voice(author.patient, b"abc"), batch_voice(patient, b"def")]))
+        assert r.status_code == status_code
+    assert not os.path.exists(os.path.join(storage.root, "blobs"))
+
+    def fail(db: Session, **kwargs: Any) -> None:
+        raise RuntimeError("counters unavailable")
+
+    # the voices are already flushed when the counters fail
+    monkeypatch.setattr(scope_counter, "add", fail)
+    with pytest.raises(RuntimeError):
+        client.post(f"{settings.API_V1_STR}/voices/batch", headers=author.headers, json=dict(
+            doctor_id=author.doctor.id, voices=[batch_voice(author.patient, b"abc"), batch_voice(author.patient, b"def")]))
+    db.expire_all()
+    assert db.query(Voice).filter(Voice.doctor_id == author.doctor.id).count() == 0
+    assert notifications == []
+    assert os.listdir(os.path.join(storage.root, "tmp")) == []
+
+
+def test_upload_session_resume(
+    client: TestClient, db: Session, author: VoiceAuthor, storage: LocalStorage, notifications: list
+) -> None:
+    data = os.urandom(1000)
+    upload_session = create_upload_session(client, author, title="Consultation", total_size=len(data))
+    assert upload_session["received"] == 0
+    session_id = upload_session["id"]
+
+    assert upload_chunk(client, author, session_id, 0, data[:400]).json()["received"] == 400
+    # a chunk sent again after a lost response is refused, the client resumes from the received size
+    r = upload_chunk(client, author, session_id, 0, data[:400])
+    assert r.status_code == 409
+    received = client.get(f"{settings.API_V1_STR}/voices/uploads/{session_id}", headers=author.headers).json()
+    assert received["received"] == 400
+    r = client.post(f"{settings.API_V1_STR}/voices/uploads/{session_id}/finalize", headers=author.headers)
+    assert r.status_code == 409
+    assert upload_chunk(client, author, session_id, 400, data[400:] + b"x").status_code == 413
+    assert upload_chunk(client, author, session_id, 400, data[400:]).json()["received"] == len(data)
+
+    r = client.post(f"{settings.API_V1_STR}/voices/uploads/{session_id}/finalize", headers=author.headers)
+    assert r.status_code == 200
+    voice = r.json()
+    assert voice["title"] == "Consultation"
+    with open(storage.resolve(voice["path"]), "rb") as f:
+        assert f.read() == data
+    assert os.listdir(os.path.join(storage.root, "uploads")) == []
+    db.expire_all()
+    assert crud.upload_session.get_by_session_id(db, id=session_id) is None
+    r = client.post(f"{settings.API_V1_STR}/voices/uploads/{session_id}/finalize", headers=author.headers)
+    assert r.status_code == 404
+
+
+def test_upload_session_kept_when_finalize_fails(
+    client: TestClient, db: Session, author: VoiceAuthor, storage: LocalStorage, notifications: list, monkeypatch
+) -> None:
+    session_id = create_upload_session(client, author)["id"]
+    upload_chunk(client, author, session_id, 0, b"abcdef")
+
+    def fail(*args: Any, **kwargs: Any) -> None:
+        raise RuntimeError("database unavailable")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(crud.voice, "create_with_doctor", fail)
+        with pytest.raises(RuntimeError):
+            client.post(f"{settings.API_V1_STR}/voices/uploads/{session_id}/finalize", headers=author.headers)
+    db.expire_all()
+    assert crud.upload_session.get_by_session_id(db, id=session_id).received == 6
+
+    r = client.post(f"{settings.API_V1_STR}/voices/uploads/{session_id}/finalize", headers=author.headers)
+    assert r.status_code == 200
+    with open(storage.resolve(r.json()["path"]), "rb") as f:
+        assert f.read() == b"abcdef"
+
+
+def test_upload_session_expired(
+    client: TestClient, db: Session, author: VoiceAuthor, storage: LocalStorage
+) -> None:
+    session_id = create_upload_session(client, author)["id"]
+    upload_chunk(client, author, session_id, 0, b"abc")
+    upload_session = crud.upload_session.get_by_session_id(db, id=session_id)
+    part_path = upload_session.path
+    assert os.path.isfile(part_path)
+    upload_session.date_expiration = datetime.now() - timedelta(minutes=1)
+    db.commit()
+
+    assert client.get(f"{settings.API_V1_STR}/voices/uploads/{session_id}", headers=author.headers).status_code == 404
+    assert upload_chunk(client, author, session_id, 3, b"def").status_code == 404
+    assert crud.upload_session.remove_expired(db, now=datetime.now()) >= 1
+    assert crud.upload_session.get_by_session_id(db, id=session_id) is None
+    assert not os.path.exists(part_path)
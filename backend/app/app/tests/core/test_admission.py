@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from app import main
+from app.core.admission import AdmissionController, AdmissionMiddleware, AdmissionRejected
+
+
+def _controller(**kwargs) -> AdmissionController:
+    limits = dict(max_concurrent=2, max_inflight_bytes=100, max_queue=1, queue_timeout=0.2)
+    limits.update(kwargs)
+    return AdmissionController(**limits)
+
+
+def test_admission_queue_and_reject() -> None:
+    async def run() -> None:
+        controller = _controller()
+        await controller.acquire(10)
+        await controller.acquire(10)
+        waiter = asyncio.ensure_future(controller.acquire(10))
+        await asyncio.sleep(0)
+        assert controller.stats()["waiting"] == 1
+        # the queue is full
+        with pytest.raises(AdmissionRejected):
+            await controller.acquire(10)
+        controller.release(10)
+        await waiter
+        assert controller.active == 2
+        # nobody releases before the timeout
+        with pytest.raises(AdmissionRejected):
+            await controller.acquire(10)
+        stats = controller.stats()
+        assert stats["admitted"] == 3
+        assert stats["rejected_full"] == 1
+        assert stats["rejected_timeout"] == 1
+        assert stats["waiting"] == 0
+
+    asyncio.run(run())
+
+
+def test_admission_inflight_bytes() -> None:
+    async def run() -> None:
+        controller = _controller(max_concurrent=10, max_queue=5)
+        # larger than the limit but alone
+        await controller.acquire(150)
+        waiter = asyncio.ensure_future(controller.acquire(60))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        controller.release(150)
+        await waiter
+        assert controller.inflight_bytes == 60
+        # admitted in their order of arrival
+        first = asyncio.ensure_future(controller.acquire(50))
+        second = asyncio.ensure_future(controller.acquire(10))
+        await asyncio.sleep(0)
+        assert not first.done() and not second.done()
+        controller.release(60)
+        await asyncio.gather(first, second)
+        assert controller.inflight_bytes == 60
+
+    asyncio.run(run())
+
+
+def test_admission_released_before_background_tasks() -> None:
+    controller = _controller()
+    active_in_task = []
+
+    async def upload(request: Request) -> JSONResponse:
+        await request.body()
+        return JSONResponse({"active": controller.active},
+            background=BackgroundTask(lambda: active_in_task.append(controller.active)))
+
+    app = Starlette(routes=[Route("/upload", upload, methods=["POST"])])
+    admitted = AdmissionMiddleware(app, controller=controller, methods=("POST",), path_regex="/upload",
+        default_bytes=10, retry_after=1)
+    with TestClient(admitted) as client:
+        r = client.post("/upload", data=b"abc")
+    assert r.json() == {"active": 1}
+    assert active_in_task == [0]
+    assert controller.inflight_bytes == 0
+
+
+def test_rejected_upload_has_cors_headers() -> None:
+    controller = _controller(max_concurrent=1, max_queue=0)
+
+    async def upload(request: Request) -> JSONResponse:
+        return JSONResponse({})
+
+    origin = "http://dashboard.example.com"
+    app = Starlette(routes=[Route("/upload", upload, methods=["POST"])])
+    # in the order of main.py, the CORS middleware wraps the rejections
+    admitted = CORSMiddleware(AdmissionMiddleware(app, controller=controller, methods=("POST",),
+        path_regex="/upload", default_bytes=10, retry_after=7), allow_origins=[origin])
+    asyncio.run(controller.acquire(10))
+    with TestClient(admitted) as client:
+        r = client.post("/upload", headers={"Origin": origin}, data=b"abc")
+    assert r.status_code == 503
+    assert r.headers["retry-after"] == "7"
+    assert r.headers["access-control-allow-origin"] == origin
+
+
+def test_cors_middleware_wraps_admission() -> None:
+    middleware = [entry.cls for entry in main.app.user_middleware]
+    assert AdmissionMiddleware in middleware
+    if CORSMiddleware in middleware:
+        assert middleware.index(CORSMiddleware) < middleware.index(AdmissionMiddleware)
@@ -0,0 +1,72 @@
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Tuple
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.index_audit import report_indexes, report_statements, report_tables
+
+
+@contextmanager
+def captured_statements(db: Session) -> Iterator[List[Tuple[str, Any]]]:
+    statements: List[Tuple[str, Any]] = []
+
+    def capture(conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool) -> None:
+        statements.append((statement, parameters))
+
+    engine = db.get_bind()
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+
+def query_plan(db: Session, call: Callable[[], Any]) -> str:
+    """
+    Plan of the last select run by call. The tables of the tests are small, sequential scans
+    are disabled so that the plan shows the index the query can be served by.
+    """
+    with captured_statements(db) as statements:
+        call()
+    statement, parameters = [(statement, parameters) for statement, parameters in statements
+        if statement.lstrip().upper().startswith("SELECT")][-1]
+    db.execute(text("SET LOCAL enable_seqscan = off"))
+    plan = db.connection().exec_driver_sql("EXPLAIN " + statement, parameters).fetchall()
+    db.rollback()
+    return "\n".join(row[0] for row in plan)
+
+
+def test_listings_use_their_index(db: Session) -> None:
+    plan = query_plan(db, lambda: crud.voice.get_multi_by_doctor_id(db, doctor_id=1, note_created=False))
+    assert "ix_voice_doctor_id_note_created" in plan
+    plan = query_plan(db, lambda: crud.voice.get_multi_by_patient(db, patient_id=2, doctor_id=1,
+        note_created=True))
+    assert "ix_voice_patient_id_doctor_id" in plan
+    plan = query_plan(db, lambda: crud.note.get_remarques_by_note_id(db, id=1))
+    assert "ix_remarquenote_note_id" in plan
+    plan = query_plan(db, lambda: crud.user.get_doctor_assistants(db, doctor_id=1).all())
+    assert "ix_doctormanager_doctor_id_manager_id" in plan
+    assert "ix_assistantmanager_manager_id_assistant_id" in plan
+
+
+def test_index_audit(db: Session) -> None:
+    unused = report_indexes(db)
+    # the primary keys and the unique indexes are needed for their constraint
+    assert "voice_pkey" not in unused
+    assert "ix_note_voice_id" not in unused
+    assert report_tables(db, min_rows=10**9) == []
+    report_statements(db, limit=5)
+    db.rollback()
+
+
+def test_text_lookups_use_their_index(db: Session) -> None:
+    # the path is only compared for equality, by a hash index
+    plan = query_plan(db, lambda: crud.voice.count_by_path(db, path="blobs/aa/aa/a.mp3"))
+    assert "ix_voice_path_hash" in plan
+    plan = query_plan(db, lambda: crud.voice.get_existing_paths(db, paths=["blobs/aa/aa/a.mp3", "b.mp3"]))
+    assert "ix_voice_path_hash" in plan
+    # ILIKE '%...%' on the patient names, by a trigram index
+    plan = query_plan(db, lambda: crud.note.search_note(db, user_idx=[], patient_name="dupont"))
+    assert "ix_user_full_name_trgm" in plan
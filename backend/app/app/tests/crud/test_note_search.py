@@ -0,0 +1,75 @@
+from datetime import datetime
+
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.models.note import Note
+from app.models.voice import Voice
+from app.schemas.user import UserCreate
+from app.tests.utils.utils import random_email, random_lower_string
+
+
+def test_search_note_ranks_and_highlights(db: Session) -> None:
+    doctor, patient = [
+        crud.user.create(db, obj_in=UserCreate(email=random_email(), password=random_lower_string(),
+            full_name=random_lower_string(), role=role))
+        for role in ("doctor", "patient")
+    ]
+    title_match = Voice(path=random_lower_string(), title="Douleurs", doctor_id=doctor.id,
+        patient_id=patient.id, date_creation=datetime(2021, 1, 1))
+    content_match = Voice(path=random_lower_string(), title="Consultation", doctor_id=doctor.id,
+        patient_id=patient.id, date_creation=datetime(2021, 1, 2), note_created=True)
+    other = Voice(path=random_lower_string(), title="Controle", doctor_id=doctor.id,
+        patient_id=patient.id, date_creation=datetime(2021, 1, 3))
+    db.add_all([title_match, content_match, other])
+    db.commit()
+    db.add(Note(content_txt="Le patient signale une douleur thoracique depuis hier.",
+        voice_id=content_match.id, assistant_id=doctor.id, date_creation=datetime(2021, 1, 2)))
+    db.commit()
+
+    results = crud.note.search_note(db, user_idx=[doctor.id], content_text="douleur")
+    assert [result.voice_id for result in results] == [title_match.id, content_match.id]
+    assert results[0].rank > results[1].rank
+    assert "<b>douleur</b>" in results[1].snippet
+
+    results = crud.note.search_note(db, user_idx=[doctor.id], content_text="douleur -thoracique")
+    assert [result.voice_id for result in results] == [title_match.id]
+
+    results = crud.note.search_note(db, user_idx=[doctor.id], limit=2)
+    assert [result.voice_id for result in results] == [other.id, content_match.id]
+
+    first_page = crud.note.search_note(db, user_idx=[doctor.id], content_text="douleur", limit=1)
+    cursor = crud.note.search_next_cursor(first_page, 1)
+    second_page = crud.note.search_note(db, user_idx=[doctor.id], content_text="douleur", limit=1, cursor=cursor)
+    assert [result.voice_id for result in first_page + second_page] == [title_match.id, content_match.id]
+    pages = list(crud.note.iter_search_note_pages(db, user_idx=[doctor.id], batch_size=2))
+    assert [[result.voice_id for result in page] for page in pages] == \
+        [[other.id, content_match.id], [title_match.id]]
+
+
+def test_search_vector_follows_the_writes(db: Session) -> None:
+    doctor, patient = [
+        crud.user.create(db, obj_in=UserCreate(email=random_email(), password=random_lower_string(),
+            full_name=random_lower_string(), role=role))
+        for role in ("doctor", "patient")
+    ]
+    voice = Voice(path=random_lower_string(), title="Vertiges", doctor_id=doctor.id, patient_id=patient.id,
+        date_creation=datetime(2021, 1, 1))
+    db.add(voice)
+    db.commit()
+    note = Note(content_txt="Acouphenes persistants", voice_id=voice.id, assistant_id=doctor.id,
+        date_creation=datetime(2021, 1, 1))
+    db.add(note)
+    db.commit()
+
+    def found(content_text: str) -> bool:
+        return [result.voice_id for result in
+            crud.note.search_note(db, user_idx=[doctor.id], content_text=content_text)] == [voice.id]
+
+    # the vectors are written by the triggers of the tables
+    assert found("vertige") and found("acouphene")
+    voice.title = "Migraine"
+    note.content_txt = "Nausees"
+    db.commit()
+    assert found("migraine") and found("nausee")
+    assert not found("vertige") and not found("acouphene")
@@ -0,0 +1,107 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.crud.crud_note import note_listings
+from app.crud.pagination import (
+    InvalidCursor, decode_cursor, decode_ranked_cursor, encode_cursor, encode_ranked_cursor, next_cursor
+)
+from app.models.pending_work import PendingWork
+from app.schemas.assistant_manager import AssistantManagerCreate
+from app.schemas.doctor_manager import DoctorManagerCreate
+from app.schemas.note import NoteCreate
+from app.schemas.user import UserCreate
+from app.schemas.voice import VoiceCreate
+from app.tests.utils.utils import random_email, random_lower_string
+
+
+def test_cursor_round_trip() -> None:
+    date_creation = datetime(2021, 3, 4, 5, 6, 7, 890)
+    cursor = encode_cursor(date_creation, 42)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (date_creation, 42)
+
+
+def test_ranked_cursor_round_trip() -> None:
+    date_creation = datetime(2021, 3, 4, 5, 6, 7, 890)
+    cursor = encode_ranked_cursor(0.6079270839691162, date_creation, 42)
+    assert decode_ranked_cursor(cursor) == (0.6079270839691162, date_creation, 42)
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+    with pytest.raises(InvalidCursor):
+        decode_ranked_cursor(encode_cursor(date_creation, 42))
+
+
+@pytest.mark.parametrize("cursor", ["", "zzz", encode_cursor(datetime(2021, 1, 1), 1)[:-2], "WzEsMl0"])
+def test_invalid_cursor(cursor: str) -> None:
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+
+def test_next_cursor() -> None:
+    page = [SimpleNamespace(date_creation=datetime(2021, 1, day), id=day) for day in (3, 2, 1)]
+    assert decode_cursor(next_cursor(page, 3)) == (datetime(2021, 1, 1), 1)
+    assert next_cursor(page, 5) is None
+    assert next_cursor([], 5) is None
+
+
+def test_paginate_with_total_on_key(db: Session) -> None:
+    doctor, patient, manager, assistant = [
+        crud.user.create(db, obj_in=UserCreate(email=random_email(), password=random_lower_string(), role=role))
+        for role in ("doctor", "patient", "manager", "assistant")
+    ]
+    crud.user.create_doctor_manager(db, obj_in=DoctorManagerCreate(doctor_id=doctor.id, manager_id=manager.id))
+    crud.user.create_assistant_manager(db, obj_in=AssistantManagerCreate(assistant_id=assistant.id,
+        manager_id=manager.id))
+    # same date, the ties are ordered by id
+    first, second, third = [
+        crud.voice.create_with_doctor(db, obj_in=VoiceCreate(path=random_lower_string(), doctor_id=doctor.id,
+            patient_id=patient.id), date_creation=datetime(2021, 1, 1))
+        for _ in range(3)
+    ]
+    # the worklist is ordered on its own columns, not on the ones of the voices
+    db.query(PendingWork).filter(PendingWork.voice_id == first.id).update(
+        {PendingWork.date_creation: datetime(2021, 1, 2)})
+    db.commit()
+
+    def worklist(**kwargs) -> tuple:
+        page = crud.voice.get_multi_by_assistant(db, assistant_id=assistant.id, note_created=False, limit=2,
+            with_total=True, **kwargs)
+        return [voice.id for voice in page.items], page.total, page.next_cursor
+
+    ids, total, cursor = worklist()
+    assert (ids, total) == ([first.id, third.id], 3)
+    assert decode_cursor(cursor) == (datetime(2021, 1, 1), third.id)
+    assert worklist(cursor=cursor) == ([second.id], 3, None)
+    assert worklist(skip=2) == ([second.id], 3, None)
+
+
+def test_note_listings_are_built_once(db: Session) -> None:
+    doctors = []
+    for validated in (True, False):
+        doctor, patient, assistant = [
+            crud.user.create(db, obj_in=UserCreate(email=random_email(), password=random_lower_string(), role=role))
+            for role in ("doctor", "patient", "assistant")
+        ]
+        voice = crud.voice.create_with_doctor(db, obj_in=VoiceCreate(path=random_lower_string(),
+            doctor_id=doctor.id, patient_id=patient.id), date_creation=datetime(2021, 1, 1))
+        note = crud.note.create_with_assistant(db, obj_in=NoteCreate(content_txt=random_lower_string(),
+            voice_id=voice.id, assistant_id=assistant.id), date_creation=datetime(2021, 1, 2))
+        crud.note.update_note(db, db_obj=note, obj_in={'validated': validated})
+        doctors.append((doctor, note))
+    db.commit()
+
+    for doctor, note in doctors:
+        assert [n.id for n in crud.note.get_multi_by_doctor_id(db, doctor_id=doctor.id)] == [note.id]
+        assert [n.id for n in crud.note.get_multi_by_doctor_id(db, doctor_id=doctor.id,
+            validated=note.validated)] == [note.id]
+        assert crud.note.get_multi_by_doctor_id(db, doctor_id=doctor.id, validated=not note.validated,
+            with_total=True).total == 0
+    # one query without a session for each role and permutation of the filters, whatever the user
+    listing = note_listings[("doctor", True, None)]
+    assert listing.session is None
+    crud.note.get_multi_by_doctor_id(db, doctor_id=doctors[0][0].id, validated=False)
+    assert note_listings[("doctor", True, None)] is listing
@@ -0,0 +1,44 @@
+from datetime import datetime
+
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.schemas.assistant_manager import AssistantManagerCreate, AssistantManagerUpdate
+from app.schemas.doctor_manager import DoctorManagerCreate
+from app.schemas.user import UserCreate
+from app.schemas.voice import VoiceCreate
+from app.tests.utils.utils import random_email, random_lower_string
+
+
+def test_pending_work_follows_voices_and_relationships(db: Session) -> None:
+    doctor, patient, manager, assistant = [
+        crud.user.create(db, obj_in=UserCreate(email=random_email(), password=random_lower_string(), role=role))
+        for role in ("doctor", "patient", "manager", "assistant")
+    ]
+    first, second = [
+        crud.voice.create_with_doctor(db, obj_in=VoiceCreate(path=random_lower_string(), doctor_id=doctor.id,
+            patient_id=patient.id), date_creation=datetime(2021, 1, day))
+        for day in (1, 2)
+    ]
+
+    def worklist() -> list:
+        return [voice.id for voice in crud.voice.get_multi_by_assistant(db, assistant_id=assistant.id,
+            note_created=False, limit=10)]
+
+    crud.user.create_doctor_manager(db, obj_in=DoctorManagerCreate(doctor_id=doctor.id, manager_id=manager.id))
+    assert worklist() == []
+    crud.user.create_assistant_manager(db, obj_in=AssistantManagerCreate(assistant_id=assistant.id,
+        manager_id=manager.id))
+    assert worklist() == [second.id, first.id]
+
+    third = crud.voice.create_with_doctor(db, obj_in=VoiceCreate(path=random_lower_string(), doctor_id=doctor.id,
+        patient_id=patient.id), date_creation=datetime(2021, 1, 3))
+    crud.voice.update_voice(db, db_obj=second, obj_in={'note_created': True})
+    assert worklist() == [third.id, first.id]
+    assert crud.voice.get_multi_by_assistant_count(db, assistant_id=assistant.id, note_created=False) == 2
+
+    crud.voice.remove(db, id=third.id)
+    assert worklist() == [first.id]
+    crud.user.remove_assistant_manager(db, obj_in=AssistantManagerUpdate(assistant_id=assistant.id,
+        manager_id=manager.id))
+    assert worklist() == []
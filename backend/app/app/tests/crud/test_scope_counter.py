@@ -0,0 +1,108 @@
+import threading
+from datetime import datetime
+
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.crud.crud_scope_counter import DOCTOR, SCOPES, voice_status
+from app.db.session import SessionLocal
+from app.schemas.assistant_manager import AssistantManagerCreate
+from app.schemas.doctor_manager import DoctorManagerCreate
+from app.schemas.note import NoteCreate
+from app.schemas.user import UserCreate
+from app.schemas.voice import VoiceCreate
+from app.tests.utils.utils import random_email, random_lower_string
+
+
+def test_counters_follow_voices_and_notes(db: Session) -> None:
+    doctor, patient, manager, assistant = [
+        crud.user.create(db, obj_in=UserCreate(email=random_email(), password=random_lower_string(), role=role))
+        for role in ("doctor", "patient", "manager", "assistant")
+    ]
+    crud.user.create_doctor_manager(db, obj_in=DoctorManagerCreate(doctor_id=doctor.id, manager_id=manager.id))
+    crud.user.create_assistant_manager(db, obj_in=AssistantManagerCreate(assistant_id=assistant.id,
+        manager_id=manager.id))
+    first, second = crud.voice.create_multi_with_doctor(db, objs_in=[
+        VoiceCreate(path=random_lower_string(), doctor_id=doctor.id, patient_id=patient.id) for _ in range(2)],
+        date_creation=datetime(2021, 1, 1))
+
+    note = crud.note.create_with_assistant(db, obj_in=NoteCreate(content_txt=random_lower_string(),
+        voice_id=first.id, assistant_id=assistant.id), date_creation=datetime(2021, 1, 2))
+    crud.voice.update_voice(db, db_obj=first, obj_in={'note_created': True})
+    assert crud.voice.get_multi_by_doctor_count(db, doctor_id=doctor.id) == 2
+    assert crud.voice.get_multi_by_manager_count(db, manager_id=manager.id, note_created=True) == 1
+    assert crud.voice.get_multi_by_assistant_count(db, assistant_id=assistant.id, note_created=True) == 1
+    assert crud.voice.get_multi_by_patient_count(db, patient_id=patient.id, note_created=False) == 1
+    assert crud.note.get_multi_by_doctor_id_count(db, doctor_id=doctor.id, validated=False, treated=False) == 1
+
+    crud.note.update_note(db, db_obj=note, obj_in={'validated': True, 'modifier_id': doctor.id,
+        'date_modification': datetime(2021, 1, 3)})
+    assert crud.note.get_multi_by_doctor_id_count(db, doctor_id=doctor.id, validated=False, treated=False) == 0
+    assert crud.note.get_multi_by_assistant_count(db, assistant_id=assistant.id, validated=True, treated=True) == 1
+    assert crud.note.get_multi_by_manager_count(db, manager_id=manager.id, validated=True) == 1
+    assert crud.note.get_multi_by_patient_count(db, patient_id=patient.id) == 1
+    assert crud.scope_counter.get_stats(db, role='manager', user_id=manager.id) == {
+        'voices': 2, 'voices_with_note': 1, 'voices_without_note': 1, 'notes': 1, 'notes_validated': 1,
+        'notes_not_validated': 0, 'notes_treated': 1, 'notes_not_treated': 0}
+    assert crud.scope_counter.get_stats(db, role='doctor', user_id=doctor.id)['notes_treated'] == 1
+
+    crud.note.remove(db, id=note.id)
+    crud.voice.remove(db, id=second.id)
+    assert crud.note.get_multi_by_assistant_count(db, assistant_id=assistant.id) == 0
+    assert crud.voice.get_multi_by_doctor_count(db, doctor_id=doctor.id) == 1
+    for scope in SCOPES:
+        for user in (doctor, patient, assistant):
+            assert not crud.scope_counter.reconcile(db, scope=scope, min_id=user.id, max_id=user.id)
+    db.commit()
+
+
+def test_stats_of_assistant_and_superuser(db: Session) -> None:
+    doctor, patient, first_manager, second_manager, assistant = [
+        crud.user.create(db, obj_in=UserCreate(email=random_email(), password=random_lower_string(), role=role))
+        for role in ("doctor", "patient", "manager", "manager", "assistant")
+    ]
+    # the doctor is reached by the assistant through both managers
+    for manager in (first_manager, second_manager):
+        crud.user.create_doctor_manager(db, obj_in=DoctorManagerCreate(doctor_id=doctor.id, manager_id=manager.id))
+        crud.user.create_assistant_manager(db, obj_in=AssistantManagerCreate(assistant_id=assistant.id,
+            manager_id=manager.id))
+    first, _ = crud.voice.create_multi_with_doctor(db, objs_in=[
+        VoiceCreate(path=random_lower_string(), doctor_id=doctor.id, patient_id=patient.id) for _ in range(2)],
+        date_creation=datetime(2021, 1, 1))
+    crud.note.create_with_assistant(db, obj_in=NoteCreate(content_txt=random_lower_string(),
+        voice_id=first.id, assistant_id=assistant.id), date_creation=datetime(2021, 1, 2))
+    crud.voice.update_voice(db, db_obj=first, obj_in={'note_created': True})
+
+    stats = crud.scope_counter.get_stats(db, role='assistant', user_id=assistant.id)
+    assert (stats['voices'], stats['voices_with_note'], stats['voices_without_note'], stats['notes']) == (2, 1, 1, 1)
+    # a super user without a dashboard of their own counts the voices and notes of all the doctors
+    stats = crud.scope_counter.get_stats(db, role=None, user_id=1)
+    assert stats['voices'] == stats['voices_with_note'] + stats['voices_without_note'] >= 2
+    assert stats['notes'] == stats['notes_validated'] + stats['notes_not_validated'] >= 1
+    db.commit()
+
+
+def test_reconcile_waits_for_the_cells_being_inserted(db: Session) -> None:
+    doctor, patient = [
+        crud.user.create(db, obj_in=UserCreate(email=random_email(), password=random_lower_string(), role=role))
+        for role in ("doctor", "patient")
+    ]
+    db.commit()
+    reconciling, writing = SessionLocal(), SessionLocal()
+    try:
+        # the doctor has no cell yet, the reconcile holds them until it commits
+        assert not crud.scope_counter.reconcile(reconciling, scope=DOCTOR, min_id=doctor.id, max_id=doctor.id)
+        writer = threading.Thread(target=lambda: crud.voice.create_with_doctor(writing, obj_in=VoiceCreate(
+            path=random_lower_string(), doctor_id=doctor.id, patient_id=patient.id), date_creation=datetime(2021, 1, 1)))
+        writer.start()
+        writer.join(0.3)
+        assert writer.is_alive()
+        reconciling.commit()
+        writer.join(5)
+        assert not writer.is_alive()
+    finally:
+        reconciling.close()
+        writing.close()
+    assert crud.scope_counter.get(db, scope=DOCTOR, scope_id=doctor.id, status=voice_status(None)) == 1
+    assert not crud.scope_counter.reconcile(db, scope=DOCTOR, min_id=doctor.id, max_id=doctor.id)
+    db.commit()
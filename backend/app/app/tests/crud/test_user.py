@@ -1,8 +1,11 @@
+from datetime import datetime
+
 from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
 
 from app import crud
 from app.core.security import verify_password
+from app.schemas.doctor_patient import DoctorPatientCreate
 from app.schemas.user import UserCreate, UserUpdate
 from app.tests.utils.utils import random_email, random_lower_string
 
@@ -92,3 +95,24 @@ def test_update_user(db: Session) -> None:
     assert user_2
     assert user.email == user_2.email
     assert verify_password(new_password, user_2.hashed_password)
+
+
+def test_search_patients(db: Session) -> None:
+    name = random_lower_string()[:10]
+    birth_date = datetime(1980, 5, 4)
+    doctor, patient, other_patient = [
+        crud.user.create(db, obj_in=UserCreate(email=random_email(), password=random_lower_string(),
+            full_name=full_name, birth_date=birth_date, role=role))
+        for full_name, role in (("Doctor", "doctor"), (f"Jean {name}", "patient"), (f"Marie {name}", "patient"))
+    ]
+    crud.user.create_doctor_patient(db, obj_in=DoctorPatientCreate(doctor_id=doctor.id, patient_id=patient.id))
+
+    matches = crud.user.search_patients(db, name=name.upper(), doctor_id=doctor.id)
+    assert [match.id for match in matches] == [patient.id]
+    matches = crud.user.search_patients(db, name=name)
+    assert {match.id for match in matches} >= {patient.id, other_patient.id}
+
+    similar = crud.user.get_similar_patients(db, full_name=f"JEAN {name}", birth_date=birth_date)
+    assert [match.id for match in similar] == [patient.id]
+    assert similar[0].similarity == 1
+    assert crud.user.get_similar_patients(db, full_name=f"Jean {name}", birth_date=datetime(1980, 5, 5)) == []
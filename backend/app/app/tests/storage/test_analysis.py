@@ -0,0 +1,12 @@
+from array import array
+
+from app.storage import analysis, staging
+
+
+def test_bucket_peaks() -> None:
+    samples = array('h', [0, 100, -32768, 5, 32767, 0, 10])
+    assert analysis._bucket_peaks(samples.tobytes(), 3) == [255, 255, 0]
+
+
+def test_peaks_key() -> None:
+    assert staging.peaks_key("blobs/ab/cd/abcd.ogg") == "blobs/ab/cd/abcd.ogg.peaks"
@@ -0,0 +1,93 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.archive_voices import archive_voice_path
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.note import Note
+from app.models.voice import Voice
+from app.schemas.user import UserCreate
+from app.storage.cold import ColdTier
+from app.storage.local import LocalStorage
+from app.tests.utils.utils import random_email, random_lower_string
+
+
+@pytest.fixture
+def cold_tier(tmp_path, monkeypatch) -> ColdTier:
+    monkeypatch.setattr(settings, "VOICE_STORAGE_DIR", str(tmp_path))
+    return ColdTier(LocalStorage(str(tmp_path / "cold")), cache_dir=str(tmp_path / "rehydrated"),
+        cache_max_bytes=2500)
+
+
+def _archive(cold_tier: ColdTier, tmp_path, key: str, data: bytes) -> str:
+    path = str(tmp_path / "original")
+    with open(path, "wb") as f:
+        f.write(data)
+    return asyncio.run(cold_tier.archive(key, path))
+
+
+def test_archive_and_rehydrate(cold_tier: ColdTier, tmp_path) -> None:
+    compressible = b"\x00" * 1000
+    cold_key = _archive(cold_tier, tmp_path, "blobs/aa/aa/a.wav", compressible)
+    assert cold_key == "cold/blobs/aa/aa/a.wav.gz"
+    incompressible = os.urandom(1000)
+    assert _archive(cold_tier, tmp_path, "blobs/bb/bb/b.ogg", incompressible) == "cold/blobs/bb/bb/b.ogg"
+
+    assert asyncio.run(cold_tier.rehydrate("blobs/aa/aa/a.wav", cold_key))
+    assert asyncio.run(cold_tier.cache.read("blobs/aa/aa/a.wav")) == compressible
+    assert not asyncio.run(cold_tier.rehydrate("blobs/cc/cc/c.wav", "cold/blobs/cc/cc/c.wav"))
+
+
+def test_rehydrated_cache_is_evicted(cold_tier: ColdTier, tmp_path) -> None:
+    keys = ["blobs/aa/aa/a.ogg", "blobs/bb/bb/b.ogg", "blobs/cc/cc/c.ogg"]
+    for i, key in enumerate(keys):
+        cold_key = _archive(cold_tier, tmp_path, key, os.urandom(1000))
+        assert asyncio.run(cold_tier.rehydrate(key, cold_key))
+        os.utime(cold_tier.cache.resolve(key), (i, i))
+
+    asyncio.run(cold_tier.rehydrate(keys[0], "cold/" + keys[0]))
+    asyncio.run(cold_tier.rehydrate(keys[2], "cold/" + keys[2]))
+    asyncio.run(cold_tier.evict(keep=keys[2]))
+    assert [asyncio.run(cold_tier.cache.exists(key)) for key in keys] == [True, False, True]
+
+
+def test_archive_voice_path_commits_before_deleting(db: Session, cold_tier: ColdTier, tmp_path) -> None:
+    storage = LocalStorage(str(tmp_path / "hot"))
+    key = f"blobs/aa/aa/{random_lower_string()}.wav"
+    with open(str(tmp_path / "original"), "wb") as f:
+        f.write(b"\x00" * 1000)
+    asyncio.run(storage.save(key, str(tmp_path / "original")))
+    doctor, patient, assistant = [
+        crud.user.create(db, obj_in=UserCreate(email=random_email(), password=random_lower_string(), role=role))
+        for role in ("doctor", "patient", "assistant")
+    ]
+    voice = Voice(path=key, doctor_id=doctor.id, patient_id=patient.id, date_creation=datetime(2021, 1, 1))
+    db.add(voice)
+    db.flush()
+    db.add(Note(voice_id=voice.id, assistant_id=assistant.id, validated=True, content_txt="",
+        date_creation=datetime(2021, 1, 1)))
+    db.commit()
+
+    delete = storage.delete
+
+    async def delete_committed(path: str) -> None:
+        other_db = SessionLocal()
+        try:
+            # the cold path is visible to other sessions before the file goes away
+            assert other_db.query(Voice).get(voice.id).cold_path == f"cold/{key}.gz"
+        finally:
+            other_db.close()
+        await delete(path)
+
+    storage.delete = delete_committed
+    assert asyncio.run(archive_voice_path(db, storage, cold_tier, path=key,
+        validated_before=datetime.now() - timedelta(days=1)))
+    assert not asyncio.run(storage.exists(key))
+    assert asyncio.run(cold_tier.rehydrate(key, f"cold/{key}.gz"))
+    assert asyncio.run(cold_tier.cache.read(key)) == b"\x00" * 1000
+    assert crud.voice.get_archivable_paths(db, validated_before=datetime.now(), paths=[key]) == []
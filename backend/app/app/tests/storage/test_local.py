@@ -0,0 +1,76 @@
+import asyncio
+import os
+from typing import AsyncIterator, List
+
+import pytest
+
+from app.core.config import settings
+from app.storage import staging
+from app.storage.local import LocalStorage
+
+
+async def _chunks(chunks: List[bytes]) -> AsyncIterator[bytes]:
+    for chunk in chunks:
+        yield chunk
+
+
+@pytest.fixture
+def storage_dir(tmp_path, monkeypatch) -> str:
+    monkeypatch.setattr(settings, "VOICE_STORAGE_DIR", str(tmp_path))
+    return str(tmp_path)
+
+
+def test_stage_stream_same_content_same_key(storage_dir: str) -> None:
+    storage = LocalStorage(storage_dir)
+    staged_1 = asyncio.run(
+        staging.stage_stream(_chunks([b"abc", b"def"]), "a.MP3", max_bytes=100)
+    )
+    staged_2 = asyncio.run(staging.stage_bytes(b"abcdef", "b.mp3"))
+    assert staged_1.key == staged_2.key
+    assert staged_1.key.endswith(".mp3")
+    assert staging.is_sharded_key(staged_1.key)
+    assert staged_1.size == 6
+
+    key = asyncio.run(storage.store(staged_1))
+    assert asyncio.run(storage.store(staged_2)) == key
+    assert not os.path.exists(staged_2.tmp_path)
+    with open(storage.resolve(key), "rb") as f:
+        assert f.read() == b"abcdef"
+
+
+def test_stage_stream_too_large(storage_dir: str) -> None:
+    with pytest.raises(staging.VoiceTooLarge):
+        asyncio.run(
+            staging.stage_stream(_chunks([b"abc", b"def"]), "a.mp3", max_bytes=5)
+        )
+    assert os.listdir(os.path.join(storage_dir, "tmp")) == []
+
+
+def test_iter_range(storage_dir: str) -> None:
+    storage = LocalStorage(storage_dir)
+    key = asyncio.run(storage.store(asyncio.run(staging.stage_bytes(b"abcdef", "a.mp3"))))
+
+    async def read_range(start: int, end: int) -> bytes:
+        return b"".join([chunk async for chunk in storage.iter_range(key, start=start, end=end)])
+
+    assert asyncio.run(read_range(1, 3)) == b"bcd"
+    assert asyncio.run(storage.read(key)) == b"abcdef"
+    assert asyncio.run(storage.size(key)) == 6
+    asyncio.run(storage.delete(key))
+    assert asyncio.run(storage.size(key)) is None
+
+
+def test_resolve_legacy_absolute_path(storage_dir: str) -> None:
+    storage = LocalStorage(storage_dir)
+    assert storage.resolve("/app/storage/old_voice.mp3") == "/app/storage/old_voice.mp3"
+
+
+def test_iter_files(storage_dir: str) -> None:
+    storage = LocalStorage(storage_dir)
+    key = asyncio.run(storage.store(asyncio.run(staging.stage_bytes(b"abcdef", "a.mp3"))))
+
+    async def list_files(prefix: str) -> List[str]:
+        return [stored_file.key async for stored_file in storage.iter_files(prefix)]
+
+    assert asyncio.run(list_files("blobs/")) == [key]
+    assert asyncio.run(list_files("missing/")) == []
@@ -0,0 +1,47 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.core.config import settings
+from app.models.upload_session import UploadSession
+from app.models.voice import Voice
+from app.reconcile_storage import iter_legacy_files, reconcile_files, reconcile_uploads
+from app.schemas.user import UserCreate
+from app.storage import staging
+from app.storage.local import LocalStorage
+from app.tests.utils.utils import random_email, random_lower_string
+
+
+def test_reconcile_legacy_files_and_uploads(db: Session, tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "VOICE_STORAGE_DIR", str(tmp_path))
+    storage = LocalStorage(str(tmp_path))
+    doctor, patient = [
+        crud.user.create(db, obj_in=UserCreate(email=random_email(), password=random_lower_string(), role=role))
+        for role in ("doctor", "patient")
+    ]
+    referenced, orphan = [os.path.join(str(tmp_path), f"{random_lower_string()}_voice.mp3") for _ in range(2)]
+    for path in (referenced, orphan, referenced + ".peaks"):
+        with open(path, "wb") as f:
+            f.write(b"abc")
+    db.add(Voice(path=referenced, doctor_id=doctor.id, patient_id=patient.id, date_creation=datetime(2021, 1, 1)))
+
+    session_id = random_lower_string()
+    db.add(UploadSession(id=session_id, path=staging.upload_session_path(session_id), filename="voice.mp3",
+        doctor_id=doctor.id, patient_id=patient.id, received=3, date_creation=datetime.now(),
+        date_expiration=datetime.now() + timedelta(hours=1)))
+    db.commit()
+    for part_path in (staging.upload_session_path(session_id), staging.upload_session_path(random_lower_string())):
+        with open(part_path, "wb") as f:
+            f.write(b"abc")
+
+    orphans = asyncio.run(reconcile_files(db, storage, iter_legacy_files(storage),
+        batch_size=2, pause=0, grace=0, purge=True))
+    assert orphans == 1
+    assert sorted(os.listdir(str(tmp_path))) == sorted(
+        ["uploads", os.path.basename(referenced), os.path.basename(referenced) + ".peaks"])
+
+    assert asyncio.run(reconcile_uploads(db, grace=0, purge=True)) == 1
+    assert os.listdir(os.path.join(str(tmp_path), "uploads")) == [session_id + staging.PART_SUFFIX]
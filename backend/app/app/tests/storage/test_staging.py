@@ -0,0 +1,34 @@
+import asyncio
+import base64
+import os
+import pytest
+
+from app.core.config import settings
+from app.storage import staging
+
+
+def test_decode_b64(monkeypatch) -> None:
+    monkeypatch.setattr(staging, "B64_DECODE_CHUNK_SIZE", 8)
+    data = os.urandom(100)
+    encoded = base64.b64encode(data).decode()
+    assert staging.decode_b64(encoded) == data
+    assert staging.decode_b64("") == b""
+    for invalid in ("QQ==QUFB", encoded[:-1], encoded[:-4] + "QR==", "QUF*", "QUFé"):
+        with pytest.raises(ValueError):
+            staging.decode_b64(invalid)
+
+
+def test_stage_b64(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "VOICE_STORAGE_DIR", str(tmp_path))
+    monkeypatch.setattr(staging, "B64_DECODE_CHUNK_SIZE", 8)
+    data = os.urandom(100)
+    staged = asyncio.run(staging.stage_b64(base64.b64encode(data).decode(), "voice.mp3"))
+    assert staged.size == 100
+    assert staged.key == staging.blob_key(staging.file_sha256(staged.tmp_path), "voice.mp3")
+    with open(staged.tmp_path, "rb") as f:
+        assert f.read() == data
+    staging.discard(staged.tmp_path)
+    # the partial file of an invalid voice is removed
+    with pytest.raises(ValueError):
+        asyncio.run(staging.stage_b64(base64.b64encode(data).decode() + "QQ==QUFB", "voice.mp3"))
+    assert os.listdir(str(tmp_path / "tmp")) == []
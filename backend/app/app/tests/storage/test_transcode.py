@@ -0,0 +1,54 @@
+import asyncio
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+import pytest
+
+from app.core.config import settings
+from app.storage import transcode
+
+
+def test_same_duration() -> None:
+    assert transcode._same_duration(60.0, 60.4)
+    assert not transcode._same_duration(60.0, 58.0)
+    assert not transcode._same_duration(None, 60.0)
+
+
+def test_ffmpeg_jobs_run_in_their_own_pool() -> None:
+    running = []
+    most_running = 0
+    lock = threading.Lock()
+
+    def job() -> str:
+        nonlocal most_running
+        with lock:
+            running.append(1)
+            most_running = max(most_running, len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+        return threading.current_thread().name
+
+    async def burst() -> list:
+        return await asyncio.gather(*[transcode.run_in_ffmpeg_executor(job) for _ in range(6)])
+
+    names = asyncio.run(burst())
+    assert all(name.startswith("ffmpeg") for name in names)
+    assert most_running <= settings.VOICE_TRANSCODE_CONCURRENCY
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None,
+    reason="ffmpeg is not installed")
+def test_transcode_staged(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(settings, "VOICE_STORAGE_DIR", str(tmp_path))
+    in_path = str(tmp_path / "voice.wav")
+    subprocess.run(["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "sine=duration=3", in_path], check=True)
+
+    staged = transcode._transcode_staged(in_path)
+    assert staged is not None
+    assert staged.key.endswith(".ogg")
+    assert staged.size < os.path.getsize(in_path)
+    assert abs(transcode.probe_duration(staged.tmp_path) - 3) < 0.5
@@ -0,0 +1,24 @@
+import io
+import zipfile
+
+from app.storage.zip_stream import ZipStreamBuffer
+
+
+def test_zip_stream_buffer() -> None:
+    buffer = ZipStreamBuffer()
+    chunks = []
+    with zipfile.ZipFile(buffer, "w") as archive:
+        info = zipfile.ZipInfo("voices/1.mp3")
+        info.file_size = 6
+        with archive.open(info, "w") as audio_file:
+            for data in (b"abc", b"def"):
+                audio_file.write(data)
+                chunks.append(buffer.drain())
+        archive.writestr("manifest.json", "{}", compress_type=zipfile.ZIP_DEFLATED)
+    chunks.append(buffer.drain())
+
+    assert buffer.drain() == b""
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+    assert archive.testzip() is None
+    assert archive.read("voices/1.mp3") == b"abcdef"
+    assert archive.read("manifest.json") == b"{}"
@@ -0,0 +1,54 @@
+import argparse
+import asyncio
+import logging
+
+from app import crud
+from app.db import base  # noqa: F401
+from app.db.session import SessionLocal
+from app.storage.session import voice_storage
+from app.storage.transcode import transcode_available, transcode_voice
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def transcode(*, batch_size: int, pause: float) -> int:
+    db = SessionLocal()
+    transcoded = 0
+    after_id = 0
+    try:
+        while True:
+            voice_ids = [voice.id for voice in
+                crud.voice.get_multi_not_transcoded(db, after_id=after_id, limit=batch_size)]
+            db.rollback()
+            if not voice_ids:
+                return transcoded
+            after_id = voice_ids[-1]
+            for voice_id in voice_ids:
+                if await transcode_voice(voice_id, voice_storage):
+                    transcoded += 1
+            await asyncio.sleep(pause)
+    finally:
+        db.close()
+        await voice_storage.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Transcode the voices not transcoded yet, e.g. uploaded before ffmpeg was installed"
+    )
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--pause", type=float, default=1.0,
+        help="seconds to wait between two batches")
+    args = parser.parse_args()
+
+    if not transcode_available():
+        logger.error("ffmpeg and ffprobe are required, or VOICE_TRANSCODE_ENABLED is false")
+        return
+    logger.info("Transcoding voices")
+    transcoded = asyncio.run(transcode(batch_size=args.batch_size, pause=args.pause))
+    logger.info(f"{transcoded} voices transcoded")
+
+
+if __name__ == "__main__":
+    main()